@@ -0,0 +1,106 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+import os
+import sys
+import json
+import time
+import signal
+import concurrent.futures
+from engines import execute_file
+from environments import builtin_env
+from printer import kimify, jsonify
+from errors import *
+
+# Settings for the programs a worker runs, set up once when the worker starts
+WORKER = dict()
+
+class Timeout(Exception):
+    pass
+
+def find_programs(directory):
+    '''Return the paths of all the .kimi files in directory (and its subdirectories), in order.'''
+    paths = []
+    for (root, dirs, files) in os.walk(directory):
+        dirs.sort()
+        paths.extend(os.path.join(root, f) for f in sorted(files) if f.endswith('.kimi'))
+    return paths
+
+# How a worker turns a program's result into text, for each result format
+RESULT_FORMATS = {
+    'kimi': kimify,
+    'json': jsonify,
+}
+
+def start_worker(engine, timeout, use_cache, result_format='kimi'):
+    '''Warm up a worker process: build the shared builtins once, and get ready to enforce timeouts.'''
+    builtin_env()
+    WORKER['engine'] = engine
+    WORKER['timeout'] = timeout
+    WORKER['use_cache'] = use_cache
+    WORKER['format'] = RESULT_FORMATS[result_format]
+    if timeout and hasattr(signal, 'setitimer'):
+        signal.signal(signal.SIGALRM, time_is_up)
+
+def time_is_up(signum, frame):
+    raise Timeout()
+
+def run_file(path):
+    '''Run the program in the file at path, and return a record of how it went:
+    the path, the result (as text in the worker's result format) or the error message, and the wall time in seconds.'''
+    timeout = WORKER['timeout']
+    timed = timeout and hasattr(signal, 'setitimer')
+    result = error = None
+    start = time.perf_counter()
+    try:
+        if timed:
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            result = WORKER['format'](execute_file(path, engine=WORKER['engine'], use_cache=WORKER['use_cache']))
+        finally:
+            if timed:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    except KimiError as e:
+        error = str(e)
+    except Timeout:
+        error = "TIMEOUT ERROR! The program took longer than " + str(timeout) + " seconds."
+    except Exception as e:
+        # e.g. division by zero, or recursion too deep for the closure engine
+        error = "PYTHON ERROR! " + type(e).__name__ + ": " + str(e)
+    return {'path': path, 'result': result, 'error': error, 'seconds': time.perf_counter() - start}
+
+def record_line(record, result_format='kimi'):
+    '''Return a record as a line of JSON. In the json result format, the result is already JSON,
+    so it goes in as it is, rather than as a string.'''
+    if result_format != 'json' or record['result'] is None:
+        return json.dumps(record)
+    return ('{"path": ' + json.dumps(record['path']) + ', "result": ' + record['result']
+            + ', "error": null, "seconds": ' + json.dumps(record['seconds']) + '}')
+
+def run_batch(directory, jobs=None, engine='vm', timeout=None, use_cache=True, out=sys.stdout, log=sys.stderr,
+              result_format='kimi'):
+    '''Run every .kimi file in directory across a pool of jobs worker processes (by default, one per CPU).
+    Write a JSON line to out for each program as soon as it finishes (see run_file), with its result
+    as Kimi code (in a string), or, in the json result format, as JSON (see printer.JSON),
+    then a summary of the throughput to log. Return the number of programs that failed.'''
+    jobs = jobs or os.cpu_count() or 1
+    paths = find_programs(directory)
+    failures = 0
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=start_worker,
+                                                initargs=(engine, timeout, use_cache, result_format)) as pool:
+        # one file per task, so each record is written as soon as its program finishes,
+        # however long the other programs take
+        pending = [pool.submit(run_file, path) for path in paths]
+        for finished in concurrent.futures.as_completed(pending):
+            record = finished.result()
+            if record['error'] is not None:
+                failures += 1
+            out.write(record_line(record, result_format) + "\n")
+            out.flush()
+    seconds = time.perf_counter() - start
+    if log is not None:
+        log.write("{} programs ({} failed) in {:.3f} seconds with {} jobs: {:.1f} programs per second\n".format(
+            len(paths), failures, seconds, jobs, len(paths) / seconds if seconds else 0.0))
+    return failures
@@ -0,0 +1,50 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+'''Time the arithmetic and comparison builtins: called through their type-checking wrappers,
+called directly, and called from Kimi code in each engine (whose call sites cache the direct path).
+
+Usage: $ python3 benchmarks/arithmetic.py
+'''
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tokenizer import tokenize
+from parser import parse
+from environments import standard_env, builtin_env
+import evaluator
+import closures
+import vm
+
+CALLS = 200000
+ITERATIONS = 20000
+PROGRAM = '''(do
+    (define loop (lambda n acc
+        (if (< n 1) acc (loop (- n 1) (+ (* acc 3) (% n 7))))))
+    (loop {} 0))'''
+ENGINES = [('tree', evaluator.evaluate), ('closure', closures.evaluate), ('vm', vm.evaluate)]
+
+def main():
+    env = builtin_env()
+    print("{} calls of each builtin (microseconds per call):".format(CALLS))
+    print("{:>4} {:>10} {:>10}".format("", "checked", "unchecked"))
+    for symbol in ['+', '-', '*', '/', '%', '<', '>=']:
+        builtin = env[symbol]
+        checked = timeit.timeit(lambda: builtin(7, 3), number=CALLS)
+        unchecked = timeit.timeit(lambda: builtin.unchecked(7, 3), number=CALLS)
+        print("{:>4} {:>10.3f} {:>10.3f}".format(symbol, checked / CALLS * 1e6, unchecked / CALLS * 1e6))
+    print()
+    print("An arithmetic loop of {} iterations (seconds):".format(ITERATIONS))
+    # the closure engine recurses in Python, so it needs room for the loop
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), ITERATIONS * 10))
+    tree = parse(tokenize(PROGRAM.format(ITERATIONS)))
+    for (name, evaluate) in ENGINES:
+        seconds = timeit.timeit(lambda: evaluate(tree, standard_env()), number=1)
+        print("{:>8} {:>10.4f}".format(name, seconds))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+'''Compare the time and memory used by the parser's node trees
+against the dictionary-based trees built by earlier versions of the parser.
+
+Usage: $ python3 benchmarks/parser_memory.py
+'''
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tokenizer import tokenize
+from parser import parse
+
+SIZES = [1000, 3000, 10000]
+
+def dict_parse(tokens):
+    '''The original dictionary-based parser, kept here for comparison.'''
+    (token_type, token_value) = tokens.pop(0)
+    if token_type == 'opening':
+        operator = dict_parse(tokens)
+        arguments = []
+        while tokens[0][0] != 'closing':
+            arguments.append(dict_parse(tokens))
+        tokens.pop(0)
+        return {'type': 'apply', 'operator': operator, 'arguments': tuple(arguments)}
+    else:
+        return {'type': token_type, 'value': token_value}
+
+def make_program(definitions):
+    body = " ".join('(define x{0} (+ (* {0} y) "s"))'.format(i) for i in range(definitions))
+    return "(do " + body + ")"
+
+def measure(parser, tokens):
+    tracemalloc.start()
+    start = time.perf_counter()
+    tree = parser(tokens)
+    seconds = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return seconds, size, tree
+
+def main():
+    print("{:>12} {:>12} {:>12} {:>14} {:>14}".format("definitions", "dict s", "nodes s", "dict bytes", "nodes bytes"))
+    for size in SIZES:
+        tokens = tokenize(make_program(size))
+        dict_seconds, dict_size, _ = measure(dict_parse, list(tokens))
+        node_seconds, node_size, _ = measure(parse, tokens)
+        print("{:>12} {:>12.4f} {:>12.4f} {:>14} {:>14}".format(size, dict_seconds, node_seconds, dict_size, node_size))
+
+if __name__ == "__main__":
+    main()
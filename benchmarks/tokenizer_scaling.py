@@ -0,0 +1,49 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+'''Show that tokenizing scales linearly with the size of the program.
+
+Usage: $ python3 benchmarks/tokenizer_scaling.py
+'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tokenizer import scan
+
+SIZES = [1000, 10000, 100000, 1000000, 10000000]
+
+def make_program(size):
+    '''Build a program of roughly size characters out of many small definitions.'''
+    chunk = '\n    (define x{0} (+ (* {0} 2) "str {0}"))'
+    pieces = ['(do']
+    total = 3
+    i = 0
+    while total < size:
+        piece = chunk.format(i)
+        pieces.append(piece)
+        total += len(piece)
+        i += 1
+    pieces.append('\n)')
+    return "".join(pieces)
+
+def time_scan(program):
+    start = time.perf_counter()
+    count = 0
+    for token in scan(program):
+        count += 1
+    return time.perf_counter() - start, count
+
+def main():
+    print("{:>12} {:>10} {:>10} {:>14}".format("bytes", "tokens", "seconds", "us per KB"))
+    for size in SIZES:
+        program = make_program(size)
+        seconds, count = time_scan(program)
+        per_kb = seconds / (len(program) / 1000) * 1e6
+        print("{:>12} {:>10} {:>10.4f} {:>14.1f}".format(len(program), count, seconds, per_kb))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+import time
+from errors import *
+
+# The budget of the evaluation in progress, if any (see engines.evaluate_async).
+# Evaluations started by builtins (e.g. map calling a Kimi function) count their steps against it too,
+# so a program can't escape its budget by running inside a builtin.
+ACTIVE = None
+
+# How many steps an evaluation takes before pausing, by default
+YIELD_EVERY = 1000
+
+class Budget:
+    '''The limits on an evaluation that can be paused, and how much of them it has used.
+    A step is a call to a Kimi function: every loop in Kimi is a recursive function,
+    so a program that never stops calls functions forever.
+    The depth is how much work is waiting on the evaluator's stack, which grows with non-tail recursion
+    (and the memory it takes).'''
+    __slots__ = ('max_steps', 'max_depth', 'timeout', 'deadline', 'yield_every', 'steps', 'countdown')
+
+    def __init__(self, max_steps=None, max_depth=None, timeout=None, yield_every=YIELD_EVERY):
+        if yield_every < 1:
+            raise ValueError("yield_every must be at least 1")
+        self.max_steps = max_steps
+        self.max_depth = max_depth
+        self.timeout = timeout
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.yield_every = yield_every
+        self.steps = 0
+        self.countdown = yield_every
+
+    def step(self, depth):
+        '''Count a step taken at the given depth. Throw a limit error if the budget is used up,
+        otherwise return True if it's time for the evaluation to pause.'''
+        self.steps += 1
+        if self.max_steps is not None and self.steps > self.max_steps:
+            throw_error("limit", "The program took more than " + str(self.max_steps) + " steps.")
+        if self.max_depth is not None and depth > self.max_depth:
+            throw_error("limit", "The program went deeper than " + str(self.max_depth) + " levels.")
+        self.countdown -= 1
+        if self.countdown:
+            return False
+        self.countdown = self.yield_every
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            throw_error("limit", "The program took longer than " + str(self.timeout) + " seconds.")
+        return True
+
+    def charge(self, steps):
+        '''Count the steps a builtin is about to take all at once (e.g. to make a long list),
+        throwing a limit error if the budget can't cover them. The evaluation can't pause in a builtin,
+        so if it's time to pause, it pauses at its next step.'''
+        self.steps += steps
+        if self.max_steps is not None and self.steps > self.max_steps:
+            throw_error("limit", "The program took more than " + str(self.max_steps) + " steps.")
+        self.countdown = max(1, self.countdown - steps)
+
+def charge(size):
+    '''Charge making a value of size elements (one step each) to the budget of the evaluation in progress,
+    if there is one, before the value is made: so a program can't use unlimited memory and time
+    in a single call to a builtin like range.'''
+    if ACTIVE is not None and size > 0:
+        ACTIVE.charge(size)
+
+def finish(steps):
+    '''Run an evaluation that can be paused (a generator, see evaluator.steps) to the end,
+    without pausing, and return its value.'''
+    try:
+        while True:
+            next(steps)
+    except StopIteration as stop:
+        return stop.value
@@ -0,0 +1,339 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+import os
+import marshal
+import hashlib
+from tokenizer import tokenize
+from parser import parse
+from nodes import Literal, Symbol, Apply
+from closures import Scope, defined_names
+from special_forms import well_formed
+from errors import *
+
+# Opcodes. Every instruction is an opcode followed by a single integer argument.
+CONST = 0           # push constants[arg]
+LOAD_LOCAL = 1      # push the variable symbols[arg], found in the current frame
+LOAD_OUTER = 2      # push the variable symbols[arg], found in an enclosing frame
+LOAD_GLOBAL = 3     # push the variable symbols[arg], found in the global environment
+FUNCTION = 4        # check that the top of the stack can be called
+CALL = 5            # call a function with the arg values above it on the stack
+TAIL_CALL = 6       # the same, but returning whatever the function returns
+RETURN = 7          # return the top of the stack to the caller
+POP = 8             # discard the top of the stack
+JUMP = 9            # continue at instruction arg
+JUMP_IF_FALSE = 10  # pop a test; continue at instruction arg if it is false
+ENTER = 11          # enter a (do ...) block, with a new frame of arg slots
+LEAVE = 12          # leave the (do ...) block, going back to the enclosing frame
+MAKE_LAMBDA = 13    # push a function for the Code in constants[arg], closing over the current frame
+DEFINE = 14         # store the top of the stack in slot definitions[arg]
+DEFINE_CHECKED = 15 # the same, but complain if the variable already has a value
+DEFINE_GLOBAL = 16  # define definitions[arg] in the global environment
+REDEFINE = 17       # complain that definitions[arg] (a lambda's variable) already exists
+MALFORMED = 18      # evaluate the badly-formed special form in constants[arg], which complains
+MEMO = 19           # memoize the function below the top arg - 1 values on the stack (see special_forms.Memo)
+
+OPNAMES = ['CONST', 'LOAD_LOCAL', 'LOAD_OUTER', 'LOAD_GLOBAL', 'FUNCTION', 'CALL', 'TAIL_CALL',
+           'RETURN', 'POP', 'JUMP', 'JUMP_IF_FALSE', 'ENTER', 'LEAVE', 'MAKE_LAMBDA', 'DEFINE',
+           'DEFINE_CHECKED', 'DEFINE_GLOBAL', 'REDEFINE', 'MALFORMED', 'MEMO']
+
+# Changes whenever the format of compiled files does
+MAGIC = b'KIMIC\x00\x02'
+CACHE_DIRECTORY = '__kimicache__'
+
+class Code:
+    '''Compiled bytecode for a program or a lambda body.
+
+    - instructions: flat list of integers, alternating opcodes and their arguments
+    - constants: literal values, Code for lambdas, and (frozen) malformed special forms
+    - symbols: (name, candidates, global_depth) for each variable loaded, where candidates are
+      the (depth, slot) coordinates of the frames that may hold it, innermost first (see closures.Scope)
+    - definitions: (name, slot, environment name) for each variable defined
+    - params: the number of arguments a lambda takes
+    - size: the number of slots in a lambda's frame besides its arguments
+    - sites: the VM's inline caches for calls to type-checked builtins, by instruction (not saved)
+    '''
+    __slots__ = ('instructions', 'constants', 'symbols', 'definitions', 'params', 'size', 'sites')
+
+    def __init__(self, instructions, constants, symbols, definitions, params=0, size=0):
+        self.instructions = instructions
+        self.constants = constants
+        self.symbols = symbols
+        self.definitions = definitions
+        self.params = params
+        self.size = size
+        self.sites = [None] * (len(instructions) // 2 + 1)
+
+class Compiler:
+    '''Compiles trees into Code.
+    Work is kept on an explicit stack (of (expression, tail) pairs and instructions to emit),
+    so deeply nested programs don't hit Python's recursion limit.'''
+
+    def __init__(self, scope=None):
+        self.scope = scope
+        self.instructions = []
+        self.constants = []
+        self.constant_indices = dict()
+        self.symbols = []
+        self.symbol_indices = dict()
+        self.definitions = []
+
+    def emit(self, op, arg=0):
+        self.instructions.append(op)
+        self.instructions.append(arg)
+        return len(self.instructions) - 1
+
+    def patch(self, index):
+        '''Point the jump whose argument is at index to the next instruction.'''
+        self.instructions[index] = len(self.instructions)
+
+    def constant(self, value):
+        key = (type(value), value) if type(value) in (int, str) else id(value)
+        if key not in self.constant_indices:
+            self.constant_indices[key] = len(self.constants)
+            self.constants.append(value)
+        return self.constant_indices[key]
+
+    def symbol(self, name):
+        if self.scope is None:
+            entry = (name, (), 0)
+        else:
+            candidates, global_depth = self.scope.resolve(name)
+            entry = (name, tuple(candidates), global_depth)
+        if entry not in self.symbol_indices:
+            self.symbol_indices[entry] = len(self.symbols)
+            self.symbols.append(entry)
+        return self.symbol_indices[entry]
+
+    def definition(self, name, slot):
+        self.definitions.append((name, slot, self.scope.name if self.scope else "global"))
+        return len(self.definitions) - 1
+
+    def compile(self, expression, params=0):
+        '''Compile an expression whose value is returned, and return the Code.'''
+        work = [(expression, True)]
+        while work:
+            item = work.pop()
+            if callable(item):
+                item()
+            else:
+                work.extend(reversed(self.expand(*item)))
+        size = self.scope.size - params if self.scope else 0
+        return Code(self.instructions, self.constants, tuple(self.symbols), tuple(self.definitions), params, size)
+
+    def expand(self, expression, tail):
+        '''Return the work needed to compile an expression, in order: either (expression, tail) pairs
+        or functions that emit instructions.
+        An expression in tail position returns its value from the Code (or makes a tail call).'''
+        emit = self.emit
+        expr_type = type(expression)
+        if expr_type is Literal:
+            work = [lambda: emit(CONST, self.constant(expression.value))]
+        elif expr_type is Symbol:
+            work = [lambda: self.emit_load(expression.name)]
+        elif expr_type is Apply:
+            operator = expression.operator
+            args = expression.arguments
+            if type(operator) is Symbol and operator.name in FORMS:
+                work = FORMS[operator.name](self, args, tail)
+                if work is None:
+                    work = [lambda: emit(MALFORMED, self.constant(freeze(expression)))]
+                elif operator.name in TAIL_FORMS:
+                    return work
+            else:
+                work = [(operator, False), lambda: emit(FUNCTION)]
+                work.extend((arg, False) for arg in args)
+                work.append(lambda: emit(TAIL_CALL if tail else CALL, len(args)))
+                return work
+        else:
+            complain_and_die("PARSING ERROR! Unexpected expression type: " + str(expression) + ".")
+        if tail:
+            work.append(lambda: emit(RETURN))
+        return work
+
+    def emit_load(self, name):
+        index = self.symbol(name)
+        (name, candidates, global_depth) = self.symbols[index]
+        if not candidates:
+            self.emit(LOAD_GLOBAL, index)
+        elif candidates[0][0] == 0:
+            self.emit(LOAD_LOCAL, index)
+        else:
+            self.emit(LOAD_OUTER, index)
+
+    def compile_do(self, args, tail):
+        if not well_formed('do', args):
+            return None
+        outer = self.scope
+        do_scope = Scope("do", outer, defines=defined_names(args))
+        def enter():
+            self.scope = do_scope
+            self.emit(ENTER, do_scope.size)
+        def leave():
+            if not tail:
+                self.emit(LEAVE)
+            self.scope = outer
+        work = [enter]
+        for a in args[:-1]:
+            work.append((a, False))
+            work.append(lambda: self.emit(POP))
+        work.append((args[-1], tail))
+        work.append(leave)
+        return work
+
+    def compile_lambda(self, args, tail):
+        if not well_formed('lambda', args):
+            return None
+        largs = tuple(la.name for la in args[:-1])
+        def make_lambda():
+            lambda_scope = Scope("anon_fn", self.scope, params=largs, defines=defined_names(args[-1:]))
+            code = Compiler(lambda_scope).compile(args[-1], params=len(largs))
+            self.emit(MAKE_LAMBDA, self.constant(code))
+        return [make_lambda]
+
+    def compile_define(self, args, tail):
+        if not well_formed('define', args):
+            return None
+        variable = args[0].name
+        def define():
+            scope = self.scope
+            if scope is None:
+                self.emit(DEFINE_GLOBAL, self.definition(variable, 0))
+            elif variable in scope.params:
+                self.emit(REDEFINE, self.definition(variable, 0))
+            elif scope.defines[variable] == 1:
+                self.emit(DEFINE, self.definition(variable, scope.slots[variable]))
+            else:
+                self.emit(DEFINE_CHECKED, self.definition(variable, scope.slots[variable]))
+        return [(args[1], False), define]
+
+    def compile_if(self, args, tail):
+        if not well_formed('if', args):
+            return None
+        jumps = []
+        work = [(args[0], False), lambda: jumps.append(self.emit(JUMP_IF_FALSE)), (args[1], tail)]
+        if not tail:
+            work.append(lambda: jumps.append(self.emit(JUMP)))
+        work.append(lambda: self.patch(jumps[0]))
+        work.append((args[2], tail))
+        if not tail:
+            work.append(lambda: self.patch(jumps[1]))
+        return work
+
+    def compile_memo(self, args, tail):
+        if not well_formed('memo', args):
+            return None
+        work = [(a, False) for a in args]
+        work.append(lambda: self.emit(MEMO, len(args)))
+        return work
+
+FORMS = {
+    'do': Compiler.compile_do,
+    'lambda': Compiler.compile_lambda,
+    'define': Compiler.compile_define,
+    'if': Compiler.compile_if,
+    'memo': Compiler.compile_memo,
+}
+
+# Forms that take care of their own tail position
+TAIL_FORMS = {'do', 'if'}
+
+def compile_program(expression):
+    '''Compile a tree into the Code for a program, to be run in the global environment.'''
+    return Compiler().compile(expression)
+
+def freeze(expression):
+    '''Turn a tree into nested tuples, which can be saved along with the rest of the Code.'''
+    if type(expression) is Apply:
+        return ('apply', freeze(expression.operator), tuple(freeze(arg) for arg in expression.arguments))
+    elif type(expression) is Symbol:
+        return ('symbol', expression.name)
+    else:
+        return ('literal', expression.value)
+
+def thaw(frozen):
+    '''Turn nested tuples made by freeze back into a tree.'''
+    if frozen[0] == 'apply':
+        return Apply(thaw(frozen[1]), tuple(thaw(arg) for arg in frozen[2]))
+    elif frozen[0] == 'symbol':
+        return Symbol(frozen[1])
+    else:
+        return Literal(frozen[1])
+
+def to_tuple(code):
+    constants = []
+    for c in code.constants:
+        if type(c) is Code:
+            constants.append(('code', to_tuple(c)))
+        elif type(c) is tuple:
+            constants.append(('malformed', c))
+        else:
+            constants.append(('value', c))
+    return (code.instructions, tuple(constants), code.symbols, code.definitions, code.params, code.size)
+
+def from_tuple(data):
+    (instructions, constants, symbols, definitions, params, size) = data
+    constants = [from_tuple(value) if kind == 'code' else value for (kind, value) in constants]
+    return Code(list(instructions), constants, symbols, definitions, params, size)
+
+def dumps(code):
+    '''Serialize Code to bytes.'''
+    return marshal.dumps(to_tuple(code))
+
+def loads(data):
+    '''Read Code back from bytes made by dumps.'''
+    return from_tuple(marshal.loads(data))
+
+def cache_path(path, optimized=False):
+    '''Where the compiled Code for the program in the file at path is kept,
+    e.g. samples/__kimicache__/factorial.kimic for samples/factorial.kimi
+    (or samples/__kimicache__/factorial.opt.kimic, if it was optimized).'''
+    (directory, filename) = os.path.split(os.path.abspath(path))
+    extension = '.opt.kimic' if optimized else '.kimic'
+    return os.path.join(directory, CACHE_DIRECTORY, os.path.splitext(filename)[0] + extension)
+
+def compile_source(source, optimizer=None):
+    tree = parse(tokenize(source))
+    if optimizer is not None:
+        tree = optimizer.optimize(tree)
+    return compile_program(tree)
+
+def load_program(path, use_cache=True, optimizer=None):
+    '''Read the program in the file at path, and return its Code (optimized, if there is an optimizer).
+    Compiled code is kept in a .kimic file, along with a hash of the source it was compiled from;
+    if the source hasn't changed since, the code is loaded from there, without tokenizing or parsing.'''
+    with open(path, 'r') as f:
+        source = f.read()
+    if not use_cache:
+        return compile_source(source, optimizer)
+    digest = hashlib.sha256(source.encode('utf-8')).digest()
+    compiled = cache_path(path, optimized=optimizer is not None)
+    header = MAGIC + digest
+    try:
+        with open(compiled, 'rb') as f:
+            data = f.read()
+        if data.startswith(header):
+            return loads(data[len(header):])
+    except (OSError, ValueError, EOFError, TypeError):
+        # no cache yet, or an unreadable one: compile from scratch
+        pass
+    code = compile_source(source, optimizer)
+    try:
+        os.makedirs(os.path.dirname(compiled), exist_ok=True)
+        temporary = compiled + '.' + str(os.getpid())
+        with open(temporary, 'wb') as f:
+            f.write(header + dumps(code))
+        os.replace(temporary, compiled)
+    except OSError:
+        # like Python's __pycache__, the cache is only an optimization
+        pass
+    return code
+
+def disassemble(code):
+    '''Return a readable listing of the instructions in Code.'''
+    lines = []
+    instructions = code.instructions
+    for pc in range(0, len(instructions), 2):
+        lines.append(str(pc).rjust(4) + " " + OPNAMES[instructions[pc]].ljust(15) + str(instructions[pc + 1]))
+    return "\n".join(lines)
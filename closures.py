@@ -0,0 +1,326 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+import evaluator as ev
+import profiling
+from special_forms import throw_arity_error, throw_test_error, make_memo, well_formed
+from nodes import Literal, Symbol, Apply
+from environments import already_exists
+from errors import *
+
+# Marks a slot whose variable hasn't been defined (yet)
+UNSET = object()
+
+class Scope:
+    '''Compile-time description of a frame created by a (do ...) block or a lambda call.
+
+    At run time a frame is a plain list: index 0 holds the enclosing frame
+    (or, for the outermost frame, the global Environment), and every variable
+    defined in the frame has a fixed slot after it.
+    Symbols are resolved to (depth, slot) coordinates when they are compiled,
+    so looking a variable up never searches dictionaries by name.
+    '''
+    __slots__ = ('name', 'outer', 'slots', 'size', 'params', 'defines')
+
+    def __init__(self, name, outer, params=(), defines=()):
+        self.name = name
+        self.outer = outer
+        self.params = params
+        self.slots = dict()
+        for (i, variable) in enumerate(params):
+            self.slots[variable] = i + 1
+        self.size = len(params)
+        self.defines = dict()
+        for variable in defines:
+            self.defines[variable] = self.defines.get(variable, 0) + 1
+            if variable not in self.slots:
+                self.size += 1
+                self.slots[variable] = self.size
+
+    def resolve(self, name):
+        '''Return the coordinates of every frame (innermost first) that may hold the variable,
+        and the depth of the global environment.'''
+        candidates = []
+        depth = 0
+        scope = self
+        while scope is not None:
+            if name in scope.slots:
+                candidates.append((depth, scope.slots[name]))
+            scope = scope.outer
+            depth += 1
+        return candidates, depth
+
+def defined_names(expressions):
+    '''Find the names that (define ...) forms in these expressions would add to the current frame,
+    i.e. everything but the bodies of nested (do ...) blocks and lambdas, which get frames of their own.'''
+    names = []
+    pending = list(reversed(expressions))
+    while pending:
+        expression = pending.pop()
+        if type(expression) is not Apply:
+            continue
+        operator = expression.operator
+        args = expression.arguments
+        if type(operator) is Symbol and operator.name in COMPILERS:
+            if operator.name == 'define' and well_formed('define', args):
+                names.append(args[0].name)
+                pending.append(args[1])
+            elif operator.name not in ('do', 'lambda'):
+                pending.extend(reversed(args))
+        else:
+            pending.extend(reversed(args))
+            pending.append(operator)
+    return names
+
+def evaluate(expression, environment):
+    '''Take an expression (a tree of nodes) and an environment.
+    Compile the expression into a closure, then run the closure in the environment and return the result.
+
+    >>> evaluate(parse(tokenize("(+ 1 2)")), standard_env())
+    3
+    '''
+    return compile_expression(expression)(environment)
+
+def compile_expression(expression, scope=None):
+    '''Take an expression (a tree of nodes) and the Scope it appears in (None at the top level),
+    and return a Python function that takes a frame and evaluates the expression in it.
+    Each node is only looked at once: special forms are recognized and variables are resolved at compile time,
+    and lambda bodies are compiled along with the rest of the program, not every time they are called.
+    '''
+    expr_type = type(expression)
+    if expr_type is Literal:
+        return compile_literal(expression.value)
+    elif expr_type is Symbol:
+        return compile_symbol(expression.name, scope)
+    elif expr_type is Apply:
+        operator = expression.operator
+        if type(operator) is Symbol and operator.name in COMPILERS:
+            return COMPILERS[operator.name](expression.arguments, scope)
+        return compile_apply(operator, expression.arguments, scope)
+    else:
+        complain_and_die("PARSING ERROR! Unexpected expression type: " + str(expression) + ".")
+
+def compile_literal(value):
+    def literal(env):
+        return value
+    return literal
+
+def outer_frame(env, depth):
+    for _ in range(depth):
+        env = env[0]
+    return env
+
+def compile_symbol(name, scope):
+    candidates, global_depth = scope.resolve(name) if scope else ([], 0)
+    if not candidates:
+        def global_symbol(env):
+            return outer_frame(env, global_depth).get(name)
+        return global_symbol
+
+    def fallback(env):
+        # The variable hasn't been defined in the innermost frame that can hold it (yet),
+        # so look further out, just like the tree interpreter would
+        for (depth, slot) in candidates[1:]:
+            value = outer_frame(env, depth)[slot]
+            if value is not UNSET:
+                return value
+        return outer_frame(env, global_depth).get(name)
+
+    (depth, slot) = candidates[0]
+    if depth == 0:
+        def symbol(env):
+            value = env[slot]
+            if value is UNSET:
+                return fallback(env)
+            return value
+    elif depth == 1:
+        def symbol(env):
+            value = env[0][slot]
+            if value is UNSET:
+                return fallback(env)
+            return value
+    elif depth == 2:
+        def symbol(env):
+            value = env[0][0][slot]
+            if value is UNSET:
+                return fallback(env)
+            return value
+    else:
+        def symbol(env):
+            value = outer_frame(env, depth)[slot]
+            if value is UNSET:
+                return fallback(env)
+            return value
+    return symbol
+
+def remember(site, fn):
+    '''Cache a builtin that only takes arguments of one type (see environments.verify_arg_type) at a call site.'''
+    unchecked = getattr(fn, 'unchecked', None)
+    if unchecked is not None:
+        site[:] = (fn, unchecked, fn.arg_type)
+
+def compile_apply(operator, arguments, scope):
+    fn_code = compile_expression(operator, scope)
+    arg_codes = tuple(compile_expression(arg, scope) for arg in arguments)
+    # Each call site has an inline cache of the last type-checked builtin it called: [builtin, unchecked, arg_type].
+    # If the site calls the same builtin again, and the arguments have the right type,
+    # the builtin's function is called directly, skipping its type checks.
+    site = [UNSET, None, None]
+    # the most common numbers of arguments get their own closures, to avoid building argument lists
+    if len(arg_codes) == 1:
+        (arg0,) = arg_codes
+        def apply(env):
+            fn = fn_code(env)
+            if fn is site[0]:
+                a = arg0(env)
+                if type(a) is site[2]:
+                    return site[1](a)
+                return fn(a)
+            if not callable(fn):
+                ev.throw_call_error()
+            remember(site, fn)
+            return fn(arg0(env))
+    elif len(arg_codes) == 2:
+        (arg0, arg1) = arg_codes
+        def apply(env):
+            fn = fn_code(env)
+            if fn is site[0]:
+                a = arg0(env)
+                b = arg1(env)
+                if type(a) is site[2] and type(b) is site[2]:
+                    return site[1](a, b)
+                return fn(a, b)
+            if not callable(fn):
+                ev.throw_call_error()
+            remember(site, fn)
+            return fn(arg0(env), arg1(env))
+    else:
+        def apply(env):
+            fn = fn_code(env)
+            if not callable(fn):
+                ev.throw_call_error()
+            return fn(*[arg(env) for arg in arg_codes])
+    return apply
+
+def malformed(name, args):
+    '''Compile a special form that was used incorrectly.
+    The form is left to the interpreter's version of it, which complains about the mistake
+    when (and only if) the form is actually evaluated.
+    '''
+    expression = Apply(Symbol(name), args)
+    def complain(env):
+        return ev.evaluate(expression, env)
+    return complain
+
+def compile_do(args, scope):
+    if not well_formed('do', args):
+        return malformed('do', args)
+    do_scope = Scope("do", scope, defines=defined_names(args))
+    codes = tuple(compile_expression(a, do_scope) for a in args)
+    blank = (UNSET,) * do_scope.size
+    def do(env):
+        do_env = [env, *blank]
+        result = None
+        for code in codes:
+            result = code(do_env)
+        return result
+    return do
+
+def compile_lambda(args, scope):
+    if not well_formed('lambda', args):
+        return malformed('lambda', args)
+    largs = tuple(la.name for la in args[:-1])
+    lambda_scope = Scope("anon_fn", scope, params=largs, defines=defined_names(args[-1:]))
+    body = compile_expression(args[-1], lambda_scope)
+    blank = (UNSET,) * (lambda_scope.size - len(largs))
+    profiler = profiling.ACTIVE
+    if profiler is not None:
+        # compiled while profiling: report every call to the profiler
+        def lamb(env):
+            def anonymous(*arguments):
+                if len(arguments) != len(largs):
+                    throw_arity_error(len(largs), len(arguments))
+                profiler.enter(anonymous.name)
+                try:
+                    return body([env, *arguments, *blank])
+                finally:
+                    profiler.exit()
+            anonymous.name = None
+            return anonymous
+        return lamb
+    def lamb(env):
+        def anonymous(*arguments):
+            if len(arguments) != len(largs):
+                throw_arity_error(len(largs), len(arguments))
+            return body([env, *arguments, *blank])
+        return anonymous
+    return lamb
+
+def compile_define(args, scope):
+    if not well_formed('define', args):
+        return malformed('define', args)
+    variable = args[0].name
+    value_code = compile_expression(args[1], scope)
+    if profiling.ACTIVE is not None:
+        # compiled while profiling: name functions after the variables they are defined as
+        unnamed_code = value_code
+        def value_code(env):
+            value = unnamed_code(env)
+            profiling.name_function(value, variable)
+            return value
+    if scope is None:
+        # defining in the global environment, which is shared with other programs (e.g. in the REPL)
+        def define(env):
+            value = value_code(env)
+            env.set(variable, value)
+            return value
+    elif variable in scope.params:
+        # redefining a lambda's variable always fails, but only after evaluating the value
+        def define(env):
+            value_code(env)
+            already_exists(variable, scope.name)
+    elif scope.defines[variable] == 1:
+        # a frame is only ever evaluated once, so the only definition of a variable can't find it already set
+        slot = scope.slots[variable]
+        def define(env):
+            value = env[slot] = value_code(env)
+            return value
+    else:
+        slot = scope.slots[variable]
+        def define(env):
+            value = value_code(env)
+            if env[slot] is not UNSET:
+                already_exists(variable, scope.name)
+            env[slot] = value
+            return value
+    return define
+
+def compile_if(args, scope):
+    if not well_formed('if', args):
+        return malformed('if', args)
+    (test_code, pass_code, fail_code) = (compile_expression(a, scope) for a in args)
+    def cond(env):
+        test = test_code(env)
+        if test is True:
+            return pass_code(env)
+        elif test is False:
+            return fail_code(env)
+        throw_test_error()
+    return cond
+
+def compile_memo(args, scope):
+    if not well_formed('memo', args):
+        return malformed('memo', args)
+    codes = tuple(compile_expression(a, scope) for a in args)
+    def memo(env):
+        return make_memo(*[code(env) for code in codes])
+    return memo
+
+COMPILERS = {
+    'do': compile_do,
+    'lambda': compile_lambda,
+    'define': compile_define,
+    'if': compile_if,
+    'memo': compile_memo,
+}
@@ -0,0 +1,170 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+import asyncio
+from tokenizer import tokenize, scan_chunks
+from parser import parse, parse_forms
+from evaluator import evaluate
+import evaluator
+import budgets
+import closures
+import bytecode
+import vm
+from environments import standard_env
+from errors import *
+
+# The ways Kimi can evaluate a tree:
+# - 'tree' walks the tree, interpreting each node every time it is evaluated
+# - 'closure' compiles the tree into Python closures once, then runs them
+# - 'vm' compiles the tree into bytecode, then runs it on a stack-based virtual machine
+ENGINES = {
+    'tree': evaluate,
+    'closure': closures.evaluate,
+    'vm': vm.evaluate,
+}
+
+# The same engines, split into compiling a tree and running the result, so the profiler can time each stage
+COMPILERS = {
+    'closure': closures.compile_expression,
+    'vm': bytecode.compile_program,
+}
+RUNNERS = {
+    'tree': evaluate,
+    'closure': lambda code, environment: code(environment),
+    'vm': vm.run,
+}
+
+def execute(program, engine='tree', environment=None, profiler=None, optimizer=None, cache=None):
+    '''Take a Kimi program as a string. Tokenize the program, parse the tokens into a tree,
+    then evaluate the tree with the given engine (see ENGINES), in the given global environment
+    (by default, a new standard environment). Return the result.
+    Errors in the program are raised as KimiErrors.
+    With an optimizer.Optimizer, simplify the tree before evaluating it.
+    With a parse_cache.ParseCache, reuse the tree of a program that has been run before.
+    With a profiling.Profiler, time each stage, and every call to a Kimi function.'''
+    if environment is None:
+        environment = standard_env()
+    if profiler is None:
+        if cache is not None:
+            tree = cache.parse(program, optimizer)
+        else:
+            tree = parse(tokenize(program))
+            if optimizer is not None:
+                tree = optimizer.optimize(tree)
+        return ENGINES[engine](tree, environment)
+    if cache is not None:
+        # tokenizing, parsing and optimizing, unless the cache remembers the program
+        with profiler.stage('parse'):
+            code = cache.parse(program, optimizer)
+    else:
+        with profiler.stage('tokenize'):
+            tokens = tokenize(program)
+        with profiler.stage('parse'):
+            code = parse(tokens)
+        if optimizer is not None:
+            with profiler.stage('optimize'):
+                code = optimizer.optimize(code)
+    with profiler.activated():
+        # the closure engine decides whether to report function calls when it compiles them
+        if engine in COMPILERS:
+            with profiler.stage('compile'):
+                code = COMPILERS[engine](code)
+        return run_profiled(RUNNERS[engine], code, environment, profiler)
+
+def run_profiled(run, code, environment, profiler):
+    with profiler.stage('evaluate'):
+        try:
+            return run(code, environment)
+        finally:
+            # calls an error escaped from never finished
+            profiler.unwind()
+
+def execute_file(path, engine='vm', environment=None, use_cache=True, profiler=None, optimizer=None):
+    '''Like execute, for the program in the file at path.
+    With the vm engine, compiled programs are cached (see bytecode.load_program),
+    so unchanged programs aren't tokenized or parsed again.'''
+    if environment is None:
+        environment = standard_env()
+    if engine == 'vm':
+        if profiler is None:
+            return vm.run(bytecode.load_program(path, use_cache=use_cache, optimizer=optimizer), environment)
+        with profiler.stage('load'):
+            code = bytecode.load_program(path, use_cache=use_cache, optimizer=optimizer)
+        with profiler.activated():
+            return run_profiled(vm.run, code, environment, profiler)
+    with open(path, 'r') as f:
+        program = f.read()
+    return execute(program, engine=engine, environment=environment, profiler=profiler, optimizer=optimizer)
+
+# How much of a file execute_stream reads at a time (in characters)
+CHUNK_SIZE = 1 << 16
+
+def read_chunks(path, chunk_size=CHUNK_SIZE):
+    with open(path, 'r') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+def evaluate_forms(chunks, engine='vm', environment=None, optimizer=None):
+    '''Take a Kimi program as an iterable of chunks of text, and evaluate every top-level expression in it
+    (not just the first, like execute), one after the other, in one global environment
+    (by default, a new standard environment). Yield the result of each expression.
+    Each expression is evaluated as soon as it has been read, before any more of the program is,
+    so the program is never held in memory all at once.'''
+    if environment is None:
+        environment = standard_env()
+    evaluate = ENGINES[engine]
+    for tree in parse_forms(scan_chunks(chunks)):
+        if optimizer is not None:
+            tree = optimizer.optimize(tree)
+        yield evaluate(tree, environment)
+
+def execute_stream(path, engine='vm', environment=None, optimizer=None, chunk_size=CHUNK_SIZE):
+    '''Evaluate every top-level expression in the file at path (see evaluate_forms),
+    reading chunk_size characters of it at a time. Yield the result of each expression.'''
+    return evaluate_forms(read_chunks(path, chunk_size), engine=engine, environment=environment, optimizer=optimizer)
+
+# The engines whose evaluations can be paused (see budgets.py): they take a tree, an environment and a Budget,
+# and return a generator. The closure engine recurses in Python, so it can't be paused.
+STEPPERS = {
+    'tree': evaluator.steps,
+    'vm': lambda tree, environment, budget: vm.steps(bytecode.compile_program(tree), environment, budget),
+}
+
+async def evaluate_async(program, environment=None, engine='tree', max_steps=None, max_depth=None,
+                         timeout=None, yield_every=budgets.YIELD_EVERY, optimizer=None):
+    '''Like execute, as a coroutine that lets other tasks run while the program does:
+    the evaluation pauses and yields to the event loop every yield_every steps (calls to Kimi functions),
+    so many programs can run concurrently, taking turns.
+
+    It throws a KimiLimitError if the program takes more than max_steps steps, goes deeper than
+    max_depth levels of work waiting on the evaluator's stack (e.g. non-tail recursion),
+    or runs for longer than timeout seconds. Cancelling the task stops the program the next time it pauses.
+    Steps taken inside builtins (e.g. a function called by map) count against the limits too,
+    but the program can only pause between them.'''
+    if engine not in STEPPERS:
+        raise ValueError("The " + engine + " engine can't evaluate programs asynchronously.")
+    if environment is None:
+        environment = standard_env()
+    tree = parse(tokenize(program))
+    if optimizer is not None:
+        tree = optimizer.optimize(tree)
+    budget = budgets.Budget(max_steps=max_steps, max_depth=max_depth, timeout=timeout, yield_every=yield_every)
+    evaluation = STEPPERS[engine](tree, environment, budget)
+    try:
+        while True:
+            # other tasks only run while this one is paused, so no one else sees this budget
+            previous = budgets.ACTIVE
+            budgets.ACTIVE = budget
+            try:
+                next(evaluation)
+            except StopIteration as stop:
+                return stop.value
+            finally:
+                budgets.ACTIVE = previous
+            await asyncio.sleep(0)
+    finally:
+        evaluation.close()
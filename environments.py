@@ -3,6 +3,13 @@
 # http://www.github.com/vakila/kimi
 
 import operator as op
+import budgets
+import lists
+import vectors
+import strings
+from lists import List, verify_list
+from vectors import Vec
+from strings import Rope, is_string, kimi_type, text, verify_string
 from errors import *
 
 class Environment(dict):
@@ -16,21 +23,84 @@ class Environment(dict):
         if key in self:
             return self[key]
         elif self.outer == None:
-            throw_error("name", "Undefined variable: " + key)
+            undefined_variable(key)
         else:
             return self.outer.get(key)
 
     def set(self, key, value):
         if key in self:
-            throw_error("name", "Variable " + key + " already exists in " + self.name + " environment!")
+            already_exists(key, self.name)
         # else warn if exists in an outer env
         else:
             self[key] = value
 
+class GlobalEnvironment(Environment):
+    '''The global environment of a program: a layer for the program's own definitions,
+    on top of frozen layers shared with other programs (the builtins, and maybe a snapshot of a prelude).
+    Variables are read through all the layers, but only ever defined in the top one,
+    so setting up a new program's environment doesn't copy anything.
+    '''
+
+    def __init__(self, outer=None):
+        Environment.__init__(self, name="global", outer=outer)
+        self.frozen = False
+
+    def get(self, key):
+        layer = self
+        while layer is not None:
+            if key in layer:
+                return layer[key]
+            layer = layer.outer
+        undefined_variable(key)
+
+    def set(self, key, value):
+        if self.frozen:
+            throw_error("name", "Can't define " + key + " in a frozen environment!")
+        layer = self
+        while layer is not None:
+            if key in layer:
+                already_exists(key, self.name)
+            layer = layer.outer
+        self[key] = value
+
+    def snapshot(self):
+        '''Freeze the environment (no more definitions can be added to it) and return it,
+        so it can be shared: restore() it to get a fresh environment for each program that uses it.'''
+        self.frozen = True
+        return self
+
+    def restore(self):
+        '''Return a new, empty global environment on top of this frozen one.'''
+        assert self.frozen, "Only snapshots can be restored."
+        return GlobalEnvironment(outer=self)
+
+def undefined_variable(key):
+    throw_error("name", "Undefined variable: " + key)
+
+def already_exists(key, env_name):
+    throw_error("name", "Variable " + key + " already exists in " + env_name + " environment!")
+
+def throw_call_error():
+    throw_error("type", 'Trying to call a non-function. Did you use parentheses correctly?')
+
+BUILTINS = None
+
 def standard_env():
-    '''Returns the standard environment as a dictionary of (variable: value) pairs
+    '''Returns a new global environment for a program, on top of the (shared) builtins.
+    '''
+    return builtin_env().restore()
+
+def builtin_env():
+    '''Returns the frozen environment of builtins as a dictionary of (variable: value) pairs.
+    It is only built once, and shared by every program.
     '''
-    env = Environment()
+    global BUILTINS
+    if BUILTINS is None:
+        BUILTINS = make_builtin_env().snapshot()
+    return BUILTINS
+
+def make_builtin_env():
+    env = GlobalEnvironment()
 
     add_booleans(env)
     add_nil(env)
@@ -40,6 +110,8 @@ def standard_env():
     add_comparison(env)
     add_strings(env)
     add_lists(env)
+    add_vectors(env)
+    add_memo(env)
 
     return env
 
@@ -52,15 +124,22 @@ def add_booleans(env):
 def add_nil(env):
     env['nil'] = None
 
-def verify_arg_type(fn, t):
+def verify_arg_type(fn, t, vector_fn=None):
     '''Function wrapper that makes function fn only accept arguments of type t.
     Throws an error if non-t arguments are passed to fn, otherwise calls fn on the arguments.
+    If there is a vector_fn, arguments that include a vector (see vectors.py) are passed to it instead.
+    The verifier remembers fn (as verifier.unchecked) and t (as verifier.arg_type), so that call sites
+    that have already checked the types of their arguments can call fn directly.
     '''
     def verifier(*args):
         for arg in args:
-            assert_or_complain(type(arg) == t,
-                "TYPE ERROR! Invalid argument type: " + str(arg) + " is type " + type(arg).__name__ + ", expected type " + t.__name__ + ".")
+            if type(arg) != t:
+                if vector_fn is not None and any(type(a) is Vec for a in args):
+                    return vector_fn(*args)
+                throw_error("type", "Invalid argument type: " + str(arg) + " is type " + type(arg).__name__ + ", expected type " + t.__name__ + ".")
         return fn(*args)
+    verifier.unchecked = fn
+    verifier.arg_type = t
     return verifier
 
 def add_arithmetic(env):
@@ -79,7 +158,7 @@ def add_logic(env):
 
 def add_equality(env):
     def equals(a, b):
-        if type(a) != type(b):
+        if kimi_type(a) != kimi_type(b):
             return False
         else:
             return a == b
@@ -93,37 +172,185 @@ def add_comparison(env):
         ('<=', op.le)], env, int)
 
 def add_strings(env):
-    pass
+    def concat(*args):
+        result = ""
+        for arg in args:
+            verify_string(arg)
+            result = strings.concat(result, arg)
+        return result
+
+    def verify_index(n):
+        if type(n) is not int:
+            throw_error("type", "Invalid argument type: " + str(n) + " is type " + type(n).__name__ + ", expected type int.")
+
+    def substring(s, start, end):
+        verify_string(s)
+        verify_index(start)
+        verify_index(end)
+        return text(s)[max(start, 0):max(end, 0)]
+
+    def split(s, separator):
+        verify_string(s)
+        verify_string(separator)
+        if not separator:
+            throw_error("type", "Incorrect use of (split ...): the separator can't be empty.")
+        return lists.make_list(text(s).split(text(separator)))
+
+    def join(listy, separator):
+        verify_list(listy)
+        verify_string(separator)
+        values = [] if listy is None else list(listy)
+        for x in values:
+            verify_string(x)
+        return text(separator).join([text(x) for x in values])
+
+    def string_to_list(s):
+        verify_string(s)
+        budgets.charge(len(s))
+        return lists.make_list(text(s))
+
+    def number_to_string(n):
+        verify_index(n)
+        return str(n)
+
+    def string_to_number(s):
+        verify_string(s)
+        # a string that isn't an integer is nil
+        try:
+            return int(text(s))
+        except ValueError:
+            return None
+
+    add_builtins([
+        ('concat', concat),
+        ('substring', substring),
+        ('split', split),
+        ('join', join),
+        ('string->list', string_to_list),
+        ('number->string', number_to_string),
+        ('string->number', string_to_number)], env)
 
 def add_lists(env):
+    def make_list(*args):
+        return lists.make_list(args)
+
     def prepend(first, rest):
-        return (first, rest)
+        if rest is None:
+            return List([first], 1)
+        verify_list(rest)
+        return rest.prepend(first)
 
     def first(listy):
-        if listy == None:
+        if listy is None:
             return None
-        return listy[0]
+        verify_list(listy)
+        return listy.first()
 
     def rest(listy):
-        if listy == None:
+        if listy is None:
             return None
-        return listy[1]
+        verify_list(listy)
+        return listy.rest()
 
-    def make_list(*args):
-        result = None
-        for x in reversed(args):
-            result = (x, result)
+    def length(listy):
+        if is_string(listy):
+            return len(listy)
+        verify_list(listy)
+        return 0 if listy is None else listy.count
+
+    def nth(listy, n):
+        verify_list(listy)
+        if type(n) is not int:
+            throw_error("type", "Invalid argument type: " + str(n) + " is type " + type(n).__name__ + ", expected type int.")
+        return None if listy is None else listy.nth(n)
+
+    # map, filter and fold call their function on each element in a Python loop,
+    # so they don't need any Kimi recursion
+    def verify_function(fn):
+        if not callable(fn):
+            throw_call_error()
+
+    def map_list(fn, listy):
+        verify_function(fn)
+        verify_list(listy)
+        return None if listy is None else lists.make_list([fn(x) for x in listy])
+
+    def filter_list(fn, listy):
+        verify_function(fn)
+        verify_list(listy)
+        if listy is None:
+            return None
+        kept = []
+        for x in listy:
+            test = fn(x)
+            if type(test) is not bool:
+                throw_error("type", "Incorrect use of (filter ...): the function must return a boolean.")
+            if test:
+                kept.append(x)
+        return lists.make_list(kept)
+
+    def fold(fn, initial, listy):
+        verify_function(fn)
+        verify_list(listy)
+        result = initial
+        if listy is not None:
+            for x in listy:
+                result = fn(result, x)
         return result
 
+    def make_range(start, end):
+        if start >= end:
+            return None
+        budgets.charge(end - start)
+        return List(list(range(end - 1, start - 1, -1)), end - start)
+
     add_builtins([
         ('list', make_list),
         ('prepend', prepend),
         ('first', first),
-        ('rest', rest)], env)
+        ('rest', rest),
+        ('length', length),
+        ('nth', nth),
+        ('map', map_list),
+        ('filter', filter_list),
+        ('fold', fold)], env)
+    add_builtins([('range', make_range)], env, int)
+
+def add_vectors(env):
+    def vec_to_list(v):
+        vectors.verify_vec(v)
+        return lists.make_list(list(v))
+
+    def list_to_vec(listy):
+        verify_list(listy)
+        values = [] if listy is None else list(listy)
+        for x in values:
+            if type(x) is not int:
+                throw_error("type", "Invalid argument type: " + str(x) + " is type " + type(x).__name__ + ", expected type int.")
+        return vectors.make_vec(values)
+
+    add_builtins([
+        ('vec', lambda *args: vectors.make_vec(args)),
+        ('vec-range', vectors.vec_range)], env, int)
+    add_builtins([
+        ('vec-sum', vectors.vec_sum),
+        ('vec-max', vectors.vec_max),
+        ('vec->list', vec_to_list),
+        ('list->vec', list_to_vec)], env)
+
+def add_memo(env):
+    def memo_stats(fn):
+        # functions made by (memo ...) are special_forms.Memo objects (which can't be imported here)
+        stats = getattr(fn, 'stats', None)
+        if stats is None:
+            throw_error("type", "Invalid argument type: " + str(fn) + " is type " + type(fn).__name__ + ", expected a memoized function.")
+        return lists.make_list(stats())
+
+    add_builtins([('memo-stats', memo_stats)], env)
 
 def add_builtins(pairs, env, arg_type=None):
     for (symbol, fn) in pairs:
         if arg_type:
-            env[symbol] = verify_arg_type(fn, arg_type)
+            env[symbol] = verify_arg_type(fn, arg_type, vectors.ELEMENTWISE.get(symbol))
         else:
             env[symbol] = fn
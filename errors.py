@@ -2,24 +2,54 @@
 # Anjana Vakil
 # http://www.github.com/vakila/kimi
 
+class KimiError(Exception):
+    '''An error in a Kimi program (or in Kimi itself).
+    Printing the error gives the message Kimi shows for it, e.g. "SYNTAX ERROR! Mismatching parentheses!"'''
+    kind = None
+
+    def __init__(self, message):
+        Exception.__init__(self, message)
+        self.message = message
+
+    def __str__(self):
+        if self.kind is None:
+            return self.message
+        return self.kind.upper() + " ERROR! " + self.message
+
+class KimiSyntaxError(KimiError):
+    '''A program that isn't written correctly, e.g. mismatching parentheses or a badly formed special form.'''
+    kind = "syntax"
+
+class KimiTypeError(KimiError):
+    '''A value of the wrong type, e.g. adding a string, or calling something that isn't a function.'''
+    kind = "type"
+
+class KimiNameError(KimiError):
+    '''A variable that is used without being defined, or defined twice.'''
+    kind = "name"
+
+class KimiLimitError(KimiError):
+    '''A program that used up its budget of steps, depth or time (see budgets.py).'''
+    kind = "limit"
+
+ERROR_TYPES = {
+    "syntax": KimiSyntaxError,
+    "type": KimiTypeError,
+    "name": KimiNameError,
+    "limit": KimiLimitError,
+}
+
 def complain_and_die(message):
-    print(message)
-    quit()
+    raise KimiError(message)
 
 def assert_or_complain(assertion, message):
-    try:
-        assert assertion
-    except AssertionError:
+    if not assertion:
         complain_and_die(message)
 
 
 def throw_error(err_type, message):
-    error = err_type.upper() + " ERROR!"
-    print(error, message)
-    quit()
+    raise ERROR_TYPES[err_type](message)
 
 def assert_or_throw(assertion, err_type, message):
-    try:
-        assert assertion
-    except AssertionError:
+    if not assertion:
         throw_error(err_type, message)
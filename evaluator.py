@@ -2,33 +2,139 @@
 # Anjana Vakil
 # http://www.github.com/vakila/kimi
 
+from types import GeneratorType
 import special_forms as sf
-from environments import Environment
+import profiling
+import budgets
+from special_forms import Tail, Lambda, Memo, Remember, MISSING
+from nodes import Literal, Symbol, Apply
+from environments import Environment, throw_call_error
 from errors import *
 
 SPECIALS = sf.special_forms()
 
+# Marks the end of a lambda call on the stack, but only while profiling
+RETURN = object()
+
+class Call:
+    '''A function application waiting for its operator and arguments to be evaluated.'''
+    __slots__ = ('arguments', 'environment', 'values')
+
+    def __init__(self, arguments, environment):
+        self.arguments = arguments
+        self.environment = environment
+        self.values = []
+
 def evaluate(expression, environment):
-    '''Take an expression and environment as dictionaries.
+    '''Take an expression (a tree of nodes) and an environment.
     Evaluate the expression in the context of the environment, and return the result.
 
     >>> evaluate(parse(tokenize("(+ 1 2)")), standard_env())
     3
+
+    Rather than recursing on subexpressions, the evaluator keeps the work that is waiting for
+    a value on its own stack: Calls collecting their operator and arguments, and special forms
+    (generators, see special_forms.py) waiting for a subexpression.
+    Calls to lambdas, and the last expressions of (do ...) and (if ...), replace the work that was
+    waiting for them instead of adding to the stack (proper tail calls), so tail-recursive functions
+    run in constant space, and other recursion is only limited by memory.
     '''
-    # print("EVALUATING:", expression)
-    expr_type = expression['type']
-    # print("EXPR_TYPE:", expr_type)
-    if expr_type == 'literal':
-        return expression['value']
-    elif expr_type == 'symbol':
-        symbol = expression['value']
-        return environment.get(symbol)
-    elif expr_type == 'apply':
-        operator = expression['operator']
-        if operator['type'] == 'symbol' and operator['value'] in SPECIALS:
-            return SPECIALS[operator['value']](expression['arguments'], environment)
-        fn = evaluate(operator, environment)
-        assert_or_throw(callable(fn), "type", 'Trying to call a non-function. Did you use parentheses correctly?')
-        return fn(*[evaluate(arg, environment) for arg in expression['arguments']])
-    else:
-        complain_and_die("PARSING ERROR! Unexpected expression type: " + str(expression) + ".")
+    return budgets.finish(steps(expression, environment, budgets.ACTIVE))
+
+def steps(expression, environment, budget=None):
+    '''Evaluate an expression like evaluate, as a generator that can be paused:
+    with a budgets.Budget, it counts every call to a lambda against the budget, and yields (None)
+    whenever the budget says it's time to pause. Its return value is the result.'''
+    stack = []
+    profiler = profiling.ACTIVE
+    while True:
+        # Evaluate the expression, until there is a value or some more work on the stack
+        # print("EVALUATING:", expression)
+        expr_type = type(expression)
+        # print("EXPR_TYPE:", expr_type)
+        if expr_type is Literal:
+            value = expression.value
+        elif expr_type is Symbol:
+            value = environment.get(expression.name)
+        elif expr_type is Apply:
+            operator = expression.operator
+            if type(operator) is Symbol and operator.name in SPECIALS:
+                form = SPECIALS[operator.name](expression.arguments, environment)
+                if type(form) is GeneratorType:
+                    try:
+                        (expression, environment) = form.send(None)
+                    except StopIteration as stop:
+                        value = stop.value
+                        if type(value) is Tail:
+                            (expression, environment) = (value.expression, value.environment)
+                            continue
+                    else:
+                        stack.append(form)
+                        continue
+                else:
+                    value = form
+            else:
+                stack.append(Call(expression.arguments, environment))
+                expression = operator
+                continue
+        else:
+            complain_and_die("PARSING ERROR! Unexpected expression type: " + str(expression) + ".")
+
+        # Hand the value to the work waiting for it, until there's another expression to evaluate
+        while True:
+            if not stack:
+                return value
+            waiting = stack[-1]
+            if type(waiting) is Call:
+                values = waiting.values
+                values.append(value)
+                if len(values) == 1:
+                    if not callable(value):
+                        throw_call_error()
+                if len(values) <= len(waiting.arguments):
+                    expression = waiting.arguments[len(values) - 1]
+                    environment = waiting.environment
+                    break
+                stack.pop()
+                fn = values[0]
+                if type(fn) is Memo:
+                    (key, value) = fn.lookup(tuple(values[1:]))
+                    if value is not MISSING:
+                        continue
+                    if type(fn.function) is not Lambda:
+                        value = fn.remember(key, fn.function(*values[1:]))
+                        continue
+                    # evaluate the call here, remembering its result when it returns
+                    stack.append(Remember(fn, key))
+                    fn = fn.function
+                if type(fn) is Lambda:
+                    expression = fn.body
+                    environment = fn.bind(values[1:])
+                    if profiler is not None:
+                        if stack and stack[-1] is RETURN:
+                            # a tail call: the caller is done
+                            stack.pop()
+                            profiler.exit()
+                        profiler.enter(fn.name)
+                        stack.append(RETURN)
+                    if budget is not None and budget.step(len(stack)):
+                        yield
+                    break
+                value = fn(*values[1:])
+            elif type(waiting) is Remember:
+                stack.pop()
+                waiting.memo.remember(waiting.key, value)
+            elif waiting is RETURN:
+                stack.pop()
+                profiler.exit()
+            else:
+                try:
+                    (expression, environment) = waiting.send(value)
+                except StopIteration as stop:
+                    stack.pop()
+                    value = stop.value
+                    if type(value) is Tail:
+                        (expression, environment) = (value.expression, value.environment)
+                        break
+                else:
+                    break
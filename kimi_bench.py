@@ -0,0 +1,255 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+'''Benchmark suite for Kimi: times the sample programs, scaled synthetic workloads,
+and the tokenizer, parser and engines on their own, saves the results as JSON,
+and compares them with a saved baseline to catch regressions.
+
+Usage:
+    $ python3 -m kimi_bench --save-baseline benchmarks/baseline.json   # before a change
+    $ python3 -m kimi_bench --baseline benchmarks/baseline.json        # after it
+
+Exits with status 1 if any benchmark got slower than the baseline by more than the threshold.
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+from tokenizer import tokenize
+from parser import parse
+from engines import ENGINES, execute
+from environments import standard_env
+from errors import *
+
+SAMPLES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'samples')
+
+# Engines that recurse in Python when Kimi functions do, so they can't run the deepest workloads
+PYTHON_RECURSION = {'closure'}
+
+# Workloads whose functions call themselves thousands of times deep at scale 1 (in tail calls, for long_list)
+DEEP = {'deep_recursion', 'long_list'}
+
+class Benchmark:
+    '''A workload to time. setup(scale) prepares whatever the workload needs (outside the timing),
+    and returns a function that runs the workload once.'''
+    __slots__ = ('name', 'group', 'setup')
+
+    def __init__(self, name, group, setup):
+        self.name = name
+        self.group = group
+        self.setup = setup
+
+def program_runner(program, engine):
+    def run():
+        return execute(program, engine=engine)
+    return run
+
+def sample_benchmarks(engines):
+    benchmarks = []
+    for filename in sorted(os.listdir(SAMPLES_DIRECTORY)):
+        if not filename.endswith('.kimi'):
+            continue
+        with open(os.path.join(SAMPLES_DIRECTORY, filename), 'r') as f:
+            program = f.read()
+        for engine in engines:
+            benchmarks.append(Benchmark("samples/" + filename[:-5] + "/" + engine, "samples",
+                                        lambda scale, program=program, engine=engine: program_runner(program, engine)))
+    return benchmarks
+
+def deep_recursion(scale):
+    return """(do
+        (define sum (lambda n (if (= n 0) 0 (+ n (sum (- n 1))))))
+        (sum {}))""".format(int(3000 * scale))
+
+def long_list(scale):
+    return """(do
+        (define upto (lambda n acc (if (= n 0) acc (upto (- n 1) (prepend n acc)))))
+        (define length (lambda list acc (if (= list nil) acc (length (rest list) (+ acc 1)))))
+        (length (upto {} nil) 0))""".format(int(5000 * scale))
+
+def wide_do(scale):
+    width = int(5000 * scale)
+    defines = " ".join("(define v{} (+ {} 1))".format(i, i) for i in range(width))
+    return "(do " + defines + " v0)"
+
+def big_source(scale):
+    '''A program of about 2MB (at scale 1): a do block of many small definitions and expressions.'''
+    lines = []
+    size = 0
+    i = 0
+    while size < 2000000 * scale:
+        line = "    (define x{} (if (< {} 100) (* {} (- {} 1)) (% {} 7)))\n".format(i, i, i, i, i)
+        lines.append(line)
+        size += len(line)
+        i += 1
+    return "(do\n" + "".join(lines) + "    x0)"
+
+SYNTHETIC = [
+    ('deep_recursion', deep_recursion),
+    ('long_list', long_list),
+    ('wide_do', wide_do),
+    ('big_source', big_source),
+]
+
+def many_small_programs(engine):
+    def setup(scale):
+        programs = ["(do (define x {}) (if (> x 50) (* x 2) (- x 1)))".format(i % 100) for i in range(int(2000 * scale))]
+        def run():
+            # each in its own global environment, like kimi's run_many
+            return [execute(program, engine=engine) for program in programs]
+        return run
+    return setup
+
+def synthetic_benchmarks(engines):
+    benchmarks = []
+    for (name, make_program) in SYNTHETIC:
+        for engine in engines:
+            if name in DEEP and engine in PYTHON_RECURSION:
+                continue
+            benchmarks.append(Benchmark("synthetic/" + name + "/" + engine, "synthetic",
+                                        lambda scale, make_program=make_program, engine=engine: program_runner(make_program(scale), engine)))
+    for engine in engines:
+        benchmarks.append(Benchmark("synthetic/many_small_programs/" + engine, "synthetic", many_small_programs(engine)))
+    return benchmarks
+
+def micro_benchmarks(engines):
+    def tokenize_setup(scale):
+        program = big_source(scale)
+        return lambda: tokenize(program)
+
+    def parse_setup(scale):
+        tokens = tokenize(big_source(scale))
+        return lambda: parse(tokens)
+
+    def evaluate_setup(engine):
+        def setup(scale):
+            tree = parse(tokenize(long_list(scale)))
+            evaluate = ENGINES[engine]
+            return lambda: evaluate(tree, standard_env())
+        return setup
+
+    benchmarks = [Benchmark("micro/tokenize", "micro", tokenize_setup),
+                  Benchmark("micro/parse", "micro", parse_setup)]
+    for engine in engines:
+        # evaluates long_list
+        if engine not in PYTHON_RECURSION:
+            benchmarks.append(Benchmark("micro/evaluate/" + engine, "micro", evaluate_setup(engine)))
+    return benchmarks
+
+def all_benchmarks(engines=tuple(sorted(ENGINES))):
+    return sample_benchmarks(engines) + synthetic_benchmarks(engines) + micro_benchmarks(engines)
+
+def measure(run, repeat=5, min_time=0.05):
+    '''Time run: first find how many runs take at least min_time (so tiny workloads can be timed),
+    then take repeat measurements of that many runs. Return the seconds per run of each measurement.'''
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or number >= 1000000:
+            break
+        number *= 10
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        timings.append((time.perf_counter() - start) / number)
+    return timings
+
+def run_benchmarks(benchmarks, scale=1.0, repeat=5, min_time=0.05, log=None):
+    '''Run each benchmark, and return the results as a dictionary that can be saved as JSON:
+    the benchmark's group, and its best and median time (in seconds per run) for each benchmark's name.'''
+    results = dict()
+    for benchmark in benchmarks:
+        run = benchmark.setup(scale)
+        timings = measure(run, repeat=repeat, min_time=min_time)
+        results[benchmark.name] = {
+            'group': benchmark.group,
+            'best': min(timings),
+            'median': statistics.median(timings),
+            'repeat': len(timings),
+        }
+        if log is not None:
+            log.write("{:<48} {:>12.6f} s\n".format(benchmark.name, min(timings)))
+            log.flush()
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'scale': scale,
+        'results': results,
+    }
+
+def compare(current, baseline, threshold=0.10):
+    '''Compare the best times of the benchmarks in both sets of results.
+    Return a list of (name, baseline seconds, current seconds, ratio) for every benchmark
+    that is slower than its baseline by more than threshold (e.g. 0.10 for 10%), slowest first.'''
+    regressions = []
+    for (name, result) in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None or before['best'] <= 0:
+            continue
+        ratio = result['best'] / before['best']
+        if ratio > 1 + threshold:
+            regressions.append((name, before['best'], result['best'], ratio))
+    return sorted(regressions, key=lambda regression: regression[3], reverse=True)
+
+def save(results, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+def load(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def main(argv):
+    arg_parser = argparse.ArgumentParser(prog="kimi_bench",
+        description="Time Kimi on sample programs, synthetic workloads and micro-benchmarks.")
+    arg_parser.add_argument("--filter", metavar="TEXT",
+        help="only run the benchmarks whose names contain TEXT")
+    arg_parser.add_argument("--engine", action="append", choices=sorted(ENGINES),
+        help="only run benchmarks for this engine (can be given more than once; default: all)")
+    arg_parser.add_argument("--scale", type=float, default=1.0,
+        help="make the synthetic workloads bigger or smaller (default: 1.0)")
+    arg_parser.add_argument("--repeat", type=int, default=5,
+        help="how many times to measure each benchmark (default: 5)")
+    arg_parser.add_argument("--output", metavar="FILE",
+        help="save the results as JSON in FILE")
+    arg_parser.add_argument("--save-baseline", metavar="FILE",
+        help="save the results as the baseline in FILE")
+    arg_parser.add_argument("--baseline", metavar="FILE",
+        help="compare the results with the baseline in FILE")
+    arg_parser.add_argument("--threshold", type=float, default=0.10,
+        help="how much slower than the baseline counts as a regression (default: 0.10, i.e. 10%%)")
+    args = arg_parser.parse_args(argv)
+
+    benchmarks = all_benchmarks(tuple(args.engine) if args.engine else tuple(sorted(ENGINES)))
+    if args.filter:
+        benchmarks = [b for b in benchmarks if args.filter in b.name]
+    results = run_benchmarks(benchmarks, scale=args.scale, repeat=args.repeat, log=sys.stdout)
+    for path in (args.output, args.save_baseline):
+        if path:
+            save(results, path)
+    if args.baseline:
+        regressions = compare(results, load(args.baseline), threshold=args.threshold)
+        for (name, before, after, ratio) in regressions:
+            print("REGRESSION: {} took {:.6f} s, {:.0%} slower than the baseline ({:.6f} s)".format(
+                name, after, ratio - 1, before))
+        if regressions:
+            return 1
+        print("No regressions beyond {:.0%}.".format(args.threshold))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,86 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+from strings import kimi_type
+from errors import *
+
+class List:
+    '''A non-empty Kimi list (the empty list is nil).
+
+    The elements are kept in a Python list, last element first, so the first element of the Kimi list
+    is items[count - 1]. Lists made with rest and prepend share their items with the list they came from:
+    rest just counts one element fewer, and prepend appends to the shared items, if no other list
+    has appended to them yet (otherwise it copies them). first, rest and prepend are all O(1) (amortized),
+    and length and nth are O(1) too.
+    '''
+    __slots__ = ('items', 'count')
+
+    def __init__(self, items, count):
+        self.items = items
+        self.count = count
+
+    def first(self):
+        return self.items[self.count - 1]
+
+    def rest(self):
+        if self.count == 1:
+            return None
+        return List(self.items, self.count - 1)
+
+    def prepend(self, value):
+        items = self.items
+        if len(items) != self.count:
+            # another list has already been made by prepending to this one
+            items = items[:self.count]
+        items.append(value)
+        return List(items, self.count + 1)
+
+    def nth(self, n):
+        if 0 <= n < self.count:
+            return self.items[self.count - 1 - n]
+        return None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self.items[self.count - 1::-1])
+
+    def __eq__(self, other):
+        if type(other) is not List:
+            return NotImplemented
+        # compare like Kimi's =, which never finds values of different types equal (e.g. 1 and true),
+        # without recursing on lists in lists
+        pending = [(self, other)]
+        while pending:
+            (a, b) = pending.pop()
+            if a.count != b.count:
+                return False
+            for (x, y) in zip(a, b):
+                if kimi_type(x) is not kimi_type(y):
+                    return False
+                elif type(x) is List:
+                    pending.append((x, y))
+                elif x != y:
+                    return False
+        return True
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return "List(" + repr(list(self)) + ")"
+
+def make_list(values):
+    '''Return a Kimi list of the values in a Python sequence (nil, if there are none).'''
+    if not values:
+        return None
+    items = list(values)
+    items.reverse()
+    return List(items, len(items))
+
+def verify_list(value):
+    '''Throw an error if value isn't a Kimi list (a List, or nil for the empty list).'''
+    if value is not None and type(value) is not List:
+        throw_error("type", "Invalid argument type: " + str(value) + " is type " + type(value).__name__ + ", expected a list.")
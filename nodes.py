@@ -0,0 +1,79 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+import sys
+
+class Literal:
+    '''A literal value (number, string, ...) appearing in a program.'''
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return type(other) is Literal and type(self.value) == type(other.value) and self.value == other.value
+
+    def __hash__(self):
+        return hash((Literal, self.value))
+
+    def __repr__(self):
+        return "Literal(" + repr(self.value) + ")"
+
+class Symbol:
+    '''A name (variable or operator) appearing in a program.
+    Names are interned, so that equal names share a single string.'''
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = sys.intern(name)
+
+    def __eq__(self, other):
+        return type(other) is Symbol and self.name == other.name
+
+    def __hash__(self):
+        return hash((Symbol, self.name))
+
+    def __repr__(self):
+        return "Symbol(" + repr(self.name) + ")"
+
+class Apply:
+    '''A function application: an operator expression and a tuple of argument expressions.'''
+    __slots__ = ('operator', 'arguments')
+
+    def __init__(self, operator, arguments):
+        self.operator = operator
+        self.arguments = arguments
+
+    # Equality and hashing walk the trees with a stack, rather than recursively,
+    # so that trees nested arbitrarily deep can be compared (e.g. by the REPL's :reload)
+
+    def __eq__(self, other):
+        pending = [(self, other)]
+        while pending:
+            (a, b) = pending.pop()
+            if type(a) is Apply:
+                if type(b) is not Apply or len(a.arguments) != len(b.arguments):
+                    return False
+                pending.append((a.operator, b.operator))
+                pending.extend(zip(a.arguments, b.arguments))
+            elif a != b:
+                return False
+        return True
+
+    def __hash__(self):
+        # the nodes in order, with the number of arguments of each application
+        parts = []
+        pending = [self]
+        while pending:
+            node = pending.pop()
+            if type(node) is Apply:
+                parts.append(len(node.arguments))
+                pending.extend(reversed(node.arguments))
+                pending.append(node.operator)
+            else:
+                parts.append(node)
+        return hash((Apply, tuple(parts)))
+
+    def __repr__(self):
+        return "Apply(" + repr(self.operator) + ", " + repr(self.arguments) + ")"
@@ -0,0 +1,216 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+from nodes import Literal, Symbol, Apply
+from closures import defined_names
+from special_forms import well_formed
+from environments import builtin_env
+from errors import *
+
+# Builtins that always give the same result for the same arguments, and do nothing else,
+# so calls to them with constant arguments can be made once, before the program runs
+PURE = {'+', '-', '*', '/', '%', '&', '|', '!', '=', '>', '<', '>=', '<='}
+
+# Builtin variables whose values never change (unless a program shadows them)
+CONSTANTS = {'true': True, 'false': False, 'nil': None}
+
+SPECIAL_NAMES = {'do', 'lambda', 'define', 'if', 'memo'}
+
+# The biggest lambda body (in nodes) that is inlined where the lambda is applied
+INLINE_LIMIT = 32
+
+# Marks a node that isn't a constant
+VARIABLE = object()
+
+class Optimizer:
+    '''Runs the optimization pass (see optimize) on programs before they are evaluated,
+    and keeps count of how many nodes it has seen, and how many it has removed.'''
+
+    def __init__(self):
+        self.nodes = 0
+        self.removed = 0
+
+    def optimize(self, expression):
+        before = count_nodes(expression)
+        optimized = optimize(expression)
+        self.nodes += before
+        self.removed += before - count_nodes(optimized)
+        return optimized
+
+    def report(self):
+        return "Optimizer removed " + str(self.removed) + " of " + str(self.nodes) + " nodes."
+
+def count_nodes(expression):
+    count = 0
+    pending = [expression]
+    while pending:
+        expression = pending.pop()
+        count += 1
+        if type(expression) is Apply:
+            pending.append(expression.operator)
+            pending.extend(expression.arguments)
+    return count
+
+def optimize(expression):
+    '''Take an expression (a tree of nodes), and return a simpler tree that evaluates to the same value
+    (or raises the same error) in any standard environment:
+        - calls to pure builtins on constant arguments are replaced by their results, e.g. (+ 60 60) => 120
+        - (if ...) with a constant test is replaced by the branch it would take, e.g. (if true a b) => a
+        - (do ...) with a single expression and no definitions is replaced by the expression, e.g. (do x) => x
+        - small lambdas applied directly to constant arguments are replaced by their bodies,
+          with the arguments in place of the variables, e.g. ((lambda x (* x x)) 3) => (* 3 3) => 9
+    Names a program defines for itself, or uses as a lambda's variables, are never treated as builtins.
+    Anything that would raise an error (including special forms used incorrectly) is left as it is,
+    so the error is still raised if and when it is evaluated.
+
+    The tree is walked with an explicit stack, like the parser does, so deeply nested programs
+    don't hit Python's recursion limit.
+    '''
+    results = []
+    work = [(expression, frozenset(defined_names([expression])), None)]
+    while work:
+        (expression, shadowed, plan) = work.pop()
+        if plan is None:
+            if type(expression) is not Apply:
+                results.append(expression)
+                continue
+            plan = children(expression, shadowed)
+            work.append((expression, shadowed, plan))
+            for (index, inner) in reversed(plan):
+                work.append((child(expression, index), inner, None))
+            continue
+        # all of the expression's children have been optimized: put it back together, and simplify it
+        parts = [expression.operator, *expression.arguments]
+        changed = False
+        for (index, inner) in reversed(plan):
+            optimized = results.pop()
+            if optimized is not parts[index + 1]:
+                parts[index + 1] = optimized
+                changed = True
+        if changed:
+            expression = Apply(parts[0], tuple(parts[1:]))
+        simpler = simplify(expression, shadowed)
+        if simpler is None:
+            results.append(expression)
+        elif type(simpler) is Inlined:
+            # the body of an inlined lambda may simplify further, now that its variables are constants
+            work.append((simpler.body, shadowed, None))
+        else:
+            results.append(simpler)
+    return results.pop()
+
+class Inlined:
+    '''The body of a lambda that was inlined, still to be optimized.'''
+    __slots__ = ('body',)
+
+    def __init__(self, body):
+        self.body = body
+
+def child(expression, index):
+    return expression.operator if index == -1 else expression.arguments[index]
+
+def children(expression, shadowed):
+    '''Return the children of an Apply to optimize, as (index, shadowed names) pairs
+    (the operator's index is -1): everything but the variables of lambdas and definitions,
+    and nothing at all in special forms used incorrectly.'''
+    operator = expression.operator
+    args = expression.arguments
+    if type(operator) is Symbol and operator.name in SPECIAL_NAMES:
+        name = operator.name
+        if not well_formed(name, args):
+            return []
+        if name == 'do':
+            inner = shadowed.union(defined_names(args))
+            return [(i, inner) for i in range(len(args))]
+        elif name == 'lambda':
+            inner = shadowed.union(l.name for l in args[:-1]).union(defined_names(args[-1:]))
+            return [(len(args) - 1, inner)]
+        elif name == 'define':
+            return [(1, shadowed)]
+        else:
+            return [(i, shadowed) for i in range(len(args))]
+    return [(-1, shadowed)] + [(i, shadowed) for i in range(len(args))]
+
+def constant(expression, shadowed):
+    '''Return the value of an expression that is a constant, or VARIABLE.'''
+    if type(expression) is Literal:
+        return expression.value
+    if type(expression) is Symbol and expression.name in CONSTANTS and expression.name not in shadowed:
+        return CONSTANTS[expression.name]
+    return VARIABLE
+
+def simplify(expression, shadowed):
+    '''Return a simpler version of an Apply whose children have been optimized,
+    an Inlined lambda body, or None if it can't be simplified.'''
+    operator = expression.operator
+    args = expression.arguments
+    if type(operator) is Symbol:
+        name = operator.name
+        if name == 'if' and len(args) == 3:
+            test = constant(args[0], shadowed)
+            if test is True:
+                return args[1]
+            elif test is False:
+                return args[2]
+        elif name == 'do' and len(args) == 1 and not defined_names(args):
+            return args[0]
+        elif name in PURE and name not in shadowed:
+            return fold(name, args, shadowed)
+    elif type(operator) is Apply:
+        return inline(operator, args, shadowed)
+    return None
+
+def fold(name, args, shadowed):
+    values = [constant(arg, shadowed) for arg in args]
+    if any(value is VARIABLE for value in values):
+        return None
+    try:
+        return Literal(builtin_env()[name](*values))
+    except Exception:
+        # e.g. a type error or division by zero: leave it to be raised when the program runs
+        return None
+
+def inline(function, args, shadowed):
+    if not (type(function.operator) is Symbol and function.operator.name == 'lambda'
+            and well_formed('lambda', function.arguments)):
+        return None
+    variables = [l.name for l in function.arguments[:-1]]
+    body = function.arguments[-1]
+    values = [constant(arg, shadowed) for arg in args]
+    if (len(values) != len(variables) or len(set(variables)) != len(variables)
+            or any(value is VARIABLE for value in values)
+            or any(variable in SPECIAL_NAMES for variable in variables)
+            or count_nodes(body) > INLINE_LIMIT
+            or defined_names([body])
+            or rebound_names(body).intersection(variables)):
+        return None
+    return Inlined(substitute(body, dict(zip(variables, values))))
+
+def rebound_names(expression):
+    '''Return the names defined, or used as lambda variables, anywhere in an expression.'''
+    names = set()
+    pending = [expression]
+    while pending:
+        expression = pending.pop()
+        if type(expression) is not Apply:
+            continue
+        operator = expression.operator
+        args = expression.arguments
+        if type(operator) is Symbol and operator.name == 'define' and args and type(args[0]) is Symbol:
+            names.add(args[0].name)
+        elif type(operator) is Symbol and operator.name == 'lambda':
+            names.update(l.name for l in args[:-1] if type(l) is Symbol)
+        pending.append(operator)
+        pending.extend(args)
+    return names
+
+def substitute(expression, values):
+    '''Replace the variables in values with their (constant) values in a small expression.'''
+    if type(expression) is Symbol:
+        if expression.name in values:
+            return Literal(values[expression.name])
+        return expression
+    elif type(expression) is Apply:
+        return Apply(substitute(expression.operator, values), tuple(substitute(arg, values) for arg in expression.arguments))
+    return expression
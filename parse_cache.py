@@ -0,0 +1,49 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+from collections import OrderedDict
+from tokenizer import tokenize
+from parser import parse
+from errors import *
+
+# How many programs a ParseCache remembers, by default
+CACHE_SIZE = 256
+
+class ParseCache:
+    '''Remembers the trees the last size programs were parsed into (and optimized into, if they were),
+    by their source text, so running a program again doesn't tokenize, parse or optimize it again.
+    When it remembers too many, it forgets the least recently used. Programs that don't parse are never remembered.
+    The engines never change a tree, so the same tree can be evaluated any number of times.'''
+    __slots__ = ('size', 'trees', 'hits', 'misses')
+
+    def __init__(self, size=CACHE_SIZE):
+        if size < 1:
+            raise ValueError("A parse cache must remember at least 1 program.")
+        self.size = size
+        self.trees = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def parse(self, program, optimizer=None):
+        '''Return the tree of a program (optimized by the optimizer, if there is one).'''
+        key = (program, optimizer is not None)
+        trees = self.trees
+        if key in trees:
+            self.hits += 1
+            trees.move_to_end(key)
+            return trees[key]
+        self.misses += 1
+        tree = parse(tokenize(program))
+        if optimizer is not None:
+            tree = optimizer.optimize(tree)
+        trees[key] = tree
+        if len(trees) > self.size:
+            trees.popitem(last=False)
+        return tree
+
+    def stats(self):
+        return (self.hits, self.misses, len(self.trees))
+
+    def clear(self):
+        self.trees.clear()
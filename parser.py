@@ -2,47 +2,62 @@
 # Anjana Vakil
 # http://www.github.com/vakila/kimi
 
+from nodes import Literal, Symbol, Apply
 from errors import *
 
 def parse(tokens):
-    '''Take a list of tokens representing a program, return a tree representing the program's syntax.
-    The tree is a nested dictionary, where each dictionary in the tree is an expression.
-
-    Expressions as dictionaries:
-    - All contain the key 'type'
-    - Based on the value of 'type', the dictionary will also have other keys:
-        - type 'apply' (function application) has keys 'operator' (value: expression) and 'arguments' (value: tuple of expressions)
-        - type 'symbol' (variable or operator) has key 'name' (value: string representing the variable/operator)
-        - type 'literal' (number, string, boolean, ...) has key 'value' (value: the literal)
+    '''Take an iterable of tokens representing a program, return a tree representing the program's syntax.
+    Only the first complete expression is parsed; any tokens after it are ignored.
+    The tree is made of nodes (see nodes.py), where each node is an expression:
+        - Apply (function application) has attributes operator (an expression) and arguments (a tuple of expressions)
+        - Symbol (variable or operator) has attribute name (the interned name of the variable/operator)
+        - Literal (number, string, boolean, ...) has attribute value (the literal)
 
     >>> parse(tokenize("(+ 1 2)"))
-    {'type': 'apply',
-     'operator': {'type': 'symbol', 'value': '+'},
-     'arguments': ({'type': 'literal', 'value': 1},
-                   {'type': 'literal', 'value': 2})}
+    Apply(Symbol('+'), (Literal(1), Literal(2)))
 
+    The tokens are walked once, front to back, and nesting is tracked with an explicit stack
+    rather than recursion, so deeply nested programs don't hit Python's recursion limit.
     '''
-    # print("tokens:", tokens)
-    if len(tokens) == 0:
+    for node in parse_forms(tokens):
+        return node
+    throw_error("syntax", "Nothing left to parse.")
+
+def parse_forms(tokens):
+    '''Take an iterable of tokens representing a program, and lazily yield the tree of each
+    top-level expression in it, as soon as its last token has been read.
+
+    >>> list(parse_forms(tokenize("(define x 1) x")))
+    [Apply(Symbol('define'), (Symbol('x'), Literal(1))), Symbol('x')]
+    '''
+    # each open application on the stack is a list: [operator, argument, argument, ...]
+    stack = []
+    for token in tokens:
+        (token_type, token_value) = token
+        if token_type == 'opening':
+            stack.append([])
+            continue
+        elif token_type == 'closing':
+            if not stack or not stack[-1]:
+                throw_error("syntax", "Unexpected ')'" + position(token) + ".")
+            parts = stack.pop()
+            node = Apply(parts[0], tuple(parts[1:]))
+        elif token_type == 'symbol':
+            node = Symbol(token_value)
+        else:
+            node = Literal(token_value)
+        if not stack:
+            yield node
+        else:
+            stack[-1].append(node)
+    if stack and stack[-1]:
+        throw_error("syntax", "Unexpected end of program.")
+    if stack:
         throw_error("syntax", "Nothing left to parse.")
-    (token_type, token_value) = tokens.pop(0)
-    if token_type == 'closing':
-        throw_error("syntax", "Unexpected ')'.")
-    elif token_type == 'opening':
-        # print("OPENING")
-        operator = parse(tokens)
-        arguments = []
-        while True:
-            if not tokens:
-                throw_error("syntax", "Unexpected end of program.")
-            next_token = tokens[0]
-            if next_token[0] == 'closing':
-                # print("CLOSING")
-                tokens.pop(0)
-                # print("tokens:", tokens)
-                break
-            arguments.append(parse(tokens))
-        arguments = tuple(arguments)
-        return {'type': 'apply', 'operator': operator, 'arguments': arguments}
-    else:
-        return {'type': token_type, 'value': token_value}
+
+def position(token):
+    '''Describe where a token was found, if the tokenizer recorded it.'''
+    line = getattr(token, 'line', None)
+    if line is None:
+        return ""
+    return " at line " + str(line) + ", column " + str(token.column)
@@ -0,0 +1,133 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+import io
+import json
+from lists import List
+from vectors import Vec
+from strings import Rope
+
+# How many characters the writers collect before writing them to the stream
+CHUNK_SIZE = 1 << 16
+
+# Marks the end of a list's elements
+END = object()
+
+class Format:
+    '''How to write values as text: how each kind of sequence opens (e.g. "(list"),
+    what comes before its first element and between its elements, how it closes,
+    and how to write a value that isn't a sequence.'''
+    __slots__ = ('openers', 'before_first', 'between', 'closer', 'atom')
+
+    def __init__(self, openers, before_first, between, closer, atom):
+        self.openers = openers
+        self.before_first = before_first
+        self.between = between
+        self.closer = closer
+        self.atom = atom
+
+def kimi_atom(exp):
+    if exp is None:
+        return "nil"
+    elif type(exp) == bool:
+        return {True: "true", False: "false"}[exp]
+    elif type(exp) == int:
+        return str(exp)
+    elif type(exp) == str:
+        return '"' + exp + '"'
+    elif type(exp) == Rope:
+        return '"' + exp.flatten() + '"'
+    elif callable(exp):
+        return "<" + exp.__name__ + " function>"
+    return str(exp)
+
+def json_atom(exp):
+    if type(exp) == bool or type(exp) == int or type(exp) == str or exp is None:
+        return json.dumps(exp)
+    elif type(exp) == Rope:
+        return json.dumps(exp.flatten())
+    elif callable(exp):
+        return json.dumps({'function': getattr(exp, 'name', None) or exp.__name__}, separators=(',', ':'))
+    return json.dumps(str(exp))
+
+# Kimi-readable text, e.g. (list 1 "a" (vec 2 3))
+KIMI = Format({List: "(list", Vec: "(vec"}, " ", " ", ")", kimi_atom)
+
+# Compact JSON, e.g. [1,"a",[2,3]]: nil is null, lists and vectors are arrays,
+# and functions are objects with their name, e.g. {"function":"square"}
+JSON = Format({List: "[", Vec: "["}, "", ",", "]", json_atom)
+
+FORMATS = {
+    'kimi': KIMI,
+    'json': JSON,
+}
+
+def pieces(exp, format=KIMI):
+    '''Yield the text of a value in a Format, a piece at a time.
+    Lists are walked with a stack of iterators, rather than recursively,
+    so lists nested arbitrarily deep can be written.'''
+    openers = format.openers
+    atom = format.atom
+    stack = [iter((exp,))]
+    started = [True]
+    while stack:
+        item = next(stack[-1], END)
+        if item is END:
+            stack.pop()
+            started.pop()
+            if stack:
+                yield format.closer
+            continue
+        if not started[-1]:
+            started[-1] = True
+            yield format.before_first
+        elif len(stack) > 1:
+            yield format.between
+        opener = openers.get(type(item))
+        if opener is None:
+            yield atom(item)
+        else:
+            yield opener
+            stack.append(iter(item))
+            started.append(False)
+
+def write_value(exp, out, format=KIMI, limit=None, chunk_size=CHUNK_SIZE):
+    '''Write the text of a value in a Format (Kimi-readable, by default) to a text stream,
+    chunk_size characters at a time, without building the whole text in memory.
+    With a limit, write at most limit characters of the text, followed by "..." if there was more.
+    Return the number of characters of the text written.'''
+    buffer = []
+    buffered = 0
+    written = 0
+    for piece in pieces(exp, format):
+        if limit is not None and written + buffered + len(piece) > limit:
+            buffer.append(piece[:limit - written - buffered])
+            buffer.append("...")
+            buffered = limit - written
+            break
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= chunk_size:
+            out.write("".join(buffer))
+            written += buffered
+            buffer = []
+            buffered = 0
+    out.write("".join(buffer))
+    return written + buffered
+
+def kimify(exp, limit=None):
+    '''Convert a Python object back into a Kimi-readable string
+    (cut short after limit characters, with "...", if there is a limit).'''
+    if limit is not None:
+        out = io.StringIO()
+        write_value(exp, out, limit=limit)
+        return out.getvalue()
+    return "".join(pieces(exp))
+
+def kimify_list(listy):
+    return " ".join([kimify(x) for x in listy])
+
+def jsonify(exp):
+    '''Convert a Python object into compact JSON (see JSON).'''
+    return "".join(pieces(exp, JSON))
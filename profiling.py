@@ -0,0 +1,135 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+import time
+from contextlib import contextmanager
+
+# The profiler the engines report function calls to, if any.
+# Engines only look at this once per evaluation (or, for the closure engine, per compilation),
+# so when it's None, profiling costs next to nothing.
+ACTIVE = None
+
+def name_function(value, name):
+    '''Give an anonymous Kimi function the name it is first defined as, for the profiler.'''
+    if getattr(value, 'name', False) is None:
+        value.name = name
+
+class FunctionStats:
+    '''What the profiler knows about one Kimi function.
+    Inclusive time counts time spent in the functions it calls (but each moment only once, even when recursing);
+    exclusive time doesn't.'''
+    __slots__ = ('calls', 'inclusive', 'exclusive', 'depth', 'max_depth')
+
+    def __init__(self):
+        self.calls = 0
+        self.inclusive = 0.0
+        self.exclusive = 0.0
+        self.depth = 0
+        self.max_depth = 0
+
+class StackNode:
+    '''A node in the tree of call stacks seen by the profiler, with the exclusive time spent there.'''
+    __slots__ = ('name', 'parent', 'children', 'seconds')
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.children = dict()
+        self.seconds = 0.0
+
+    def child(self, name):
+        node = self.children.get(name)
+        if node is None:
+            node = self.children[name] = StackNode(name, self)
+        return node
+
+class Profiler:
+    '''Collects the time spent in each stage of running a program (tokenize, parse, evaluate, ...),
+    and the calls, time and recursion depth of each Kimi function (by the name it was defined as).'''
+
+    def __init__(self):
+        self.stages = dict()
+        self.functions = dict()
+        self.root = StackNode("program")
+        # (stats, stack node, start time, time spent in callees) for each function call in progress
+        self.calls = []
+
+    @contextmanager
+    def stage(self, name):
+        '''Time a stage of running a program.'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    @contextmanager
+    def activated(self):
+        '''Have the engines report function calls to this profiler.'''
+        global ACTIVE
+        previous = ACTIVE
+        ACTIVE = self
+        try:
+            yield self
+        finally:
+            ACTIVE = previous
+
+    def enter(self, name):
+        '''Start a call to the function with the given name (None for functions never defined as anything).'''
+        name = name or "anonymous"
+        stats = self.functions.get(name)
+        if stats is None:
+            stats = self.functions[name] = FunctionStats()
+        stats.calls += 1
+        stats.depth += 1
+        if stats.depth > stats.max_depth:
+            stats.max_depth = stats.depth
+        node = (self.calls[-1][1] if self.calls else self.root).child(name)
+        self.calls.append([stats, node, time.perf_counter(), 0.0])
+
+    def exit(self):
+        '''Finish the innermost function call in progress.'''
+        (stats, node, start, callees) = self.calls.pop()
+        elapsed = time.perf_counter() - start
+        stats.depth -= 1
+        if stats.depth == 0:
+            stats.inclusive += elapsed
+        stats.exclusive += elapsed - callees
+        node.seconds += elapsed - callees
+        if self.calls:
+            self.calls[-1][3] += elapsed
+
+    def unwind(self):
+        '''Finish every call still in progress (e.g. after an error).'''
+        while self.calls:
+            self.exit()
+
+    def report(self):
+        '''Return a readable summary of the stages and the functions, hottest first.'''
+        lines = ["Stages:"]
+        for (name, seconds) in self.stages.items():
+            lines.append("  {:<12} {:>12.6f} s".format(name, seconds))
+        lines.append("")
+        lines.append("Functions:")
+        lines.append("  {:<24} {:>10} {:>14} {:>14} {:>10}".format("name", "calls", "inclusive (s)", "exclusive (s)", "max depth"))
+        hottest = sorted(self.functions.items(), key=lambda item: item[1].exclusive, reverse=True)
+        for (name, stats) in hottest:
+            lines.append("  {:<24} {:>10} {:>14.6f} {:>14.6f} {:>10}".format(
+                name, stats.calls, stats.inclusive, stats.exclusive, stats.max_depth))
+        return "\n".join(lines)
+
+    def collapsed_stacks(self):
+        '''Return the call stacks in the "collapsed" format that flame graph tools read:
+        one line per distinct stack, e.g. "program;fact;fact 42",
+        where the number is the exclusive time spent in that stack, in microseconds.'''
+        lines = []
+        pending = [(self.root, self.root.name)]
+        while pending:
+            (node, path) = pending.pop()
+            microseconds = int(round(node.seconds * 1e6))
+            if microseconds:
+                lines.append(path + " " + str(microseconds))
+            for child in reversed(list(node.children.values())):
+                pending.append((child, path + ";" + child.name))
+        return lines
@@ -2,18 +2,167 @@
 # Anjana Vakil
 # http://www.github.com/vakila/kimi
 
+from collections import OrderedDict
 import evaluator as ev
+import profiling
+from nodes import Symbol
 from environments import Environment
 from errors import *
 
+# Special forms take their (unevaluated) arguments and the environment.
+# A form either returns its value directly, or is a generator that
+# yields (expression, environment) pairs to have them evaluated,
+# receiving each value back from the yield. Instead of a value, a generator can
+# return a Tail, to have its last expression evaluated in its place;
+# this lets the evaluator make tail calls without growing its stack.
+
+class Tail:
+    '''An expression (and its environment) that a special form evaluates to, as its very last step.'''
+    __slots__ = ('expression', 'environment')
+
+    def __init__(self, expression, environment):
+        self.expression = expression
+        self.environment = environment
+
+class Lambda:
+    '''A function created by a lambda expression: its variables, its body, and the environment it was created in.
+    The evaluator calls lambdas itself, so it can make proper tail calls;
+    they can also be called like any other Python function (e.g. by builtins).'''
+    __slots__ = ('variables', 'body', 'environment', 'name')
+    __name__ = "anonymous"
+
+    def __init__(self, variables, body, environment):
+        self.variables = variables
+        self.body = body
+        self.environment = environment
+        self.name = None
+
+    def bind(self, arguments):
+        '''Return the environment to evaluate the body in, with the variables bound to the arguments.'''
+        if len(arguments) != len(self.variables):
+            throw_arity_error(len(self.variables), len(arguments))
+        return Environment(name="anon_fn", outer=self.environment, variables=self.variables, values=arguments)
+
+    def __call__(self, *arguments):
+        environment = self.bind(arguments)
+        profiler = profiling.ACTIVE
+        if profiler is None:
+            return ev.evaluate(self.body, environment)
+        profiler.enter(self.name)
+        try:
+            return ev.evaluate(self.body, environment)
+        finally:
+            profiler.exit()
+
+# How many results a memoized function remembers, unless (memo ...) is given a size
+MEMO_SIZE = 1000
+
+# What a Memo's lookup finds for arguments it doesn't remember a result for
+MISSING = object()
+
+class Memo:
+    '''A function made by (memo ...): it remembers the results of the last size calls to function,
+    by their arguments, and calls function only for arguments it doesn't remember (forgetting the
+    least recently used result when it remembers too many). Errors are never remembered, so calls
+    with the wrong number of arguments still fail every time.'''
+    __slots__ = ('function', 'size', 'cache', 'hits', 'misses')
+    __name__ = "memoized"
+
+    def __init__(self, function, size):
+        self.function = function
+        self.size = size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    # the profiler names the function the memo calls, after the variable the memo is defined as
+    @property
+    def name(self):
+        return getattr(self.function, 'name', False)
+
+    @name.setter
+    def name(self, name):
+        profiling.name_function(self.function, name)
+
+    def lookup(self, arguments):
+        '''Return the key for a call with a tuple of arguments, and the result remembered for it
+        (or MISSING, if there isn't one), counting the call as a hit or a miss.'''
+        # 1 and true are equal (and hash the same) in Python, but not in Kimi
+        key = (arguments, tuple(type(a) for a in arguments))
+        cache = self.cache
+        try:
+            value = cache.get(key, MISSING)
+        except TypeError:
+            throw_error("type", "Memoized functions only take arguments that can be remembered (hashed).")
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            cache.move_to_end(key)
+        return (key, value)
+
+    def remember(self, key, value):
+        cache = self.cache
+        cache[key] = value
+        if len(cache) > self.size:
+            cache.popitem(last=False)
+        return value
+
+    def __call__(self, *arguments):
+        (key, value) = self.lookup(arguments)
+        if value is MISSING:
+            value = self.remember(key, self.function(*arguments))
+        return value
+
+    def stats(self):
+        return (self.hits, self.misses, len(self.cache))
+
+class Remember:
+    '''A call to a Memo's function that missed the cache, waiting on the tree engine's or the VM's own stack
+    for the function to return, so the result can be remembered. Calling the function there,
+    instead of through the Memo, keeps memoized recursion off Python's stack.'''
+    __slots__ = ('memo', 'key')
+
+    def __init__(self, memo, key):
+        self.memo = memo
+        self.key = key
+
+def make_memo(function, size=MEMO_SIZE):
+    if not callable(function):
+        throw_error("type", "Incorrect use of (memo ...): the first argument must be a function.")
+    if type(size) is not int or size < 1:
+        throw_error("type", "Incorrect use of (memo ...): the size must be a positive integer.")
+    return Memo(function, size)
+
+def throw_arity_error(expected, provided):
+    throw_error("syntax", "This function takes " + str(expected) + " arguments (" + str(provided) + " provided).")
+
+def throw_test_error():
+    throw_error("type", "Incorrect use of (if ...): the test must evaluate to a boolean.")
+
+def well_formed(name, args):
+    '''Whether the arguments of a special form are the right number and kind for it to be evaluated.
+    The engines that compile programs compile forms that aren't well formed to evaluate them
+    with the forms here, which throw the error.'''
+    if name == 'do':
+        return len(args) > 0
+    elif name == 'lambda':
+        return len(args) >= 2 and all(type(l) is Symbol for l in args[:-1])
+    elif name == 'define':
+        return len(args) == 2 and type(args[0]) is Symbol
+    elif name == 'if':
+        return len(args) == 3
+    elif name == 'memo':
+        return len(args) in (1, 2)
+    return False
+
 def do(args, env):
     do_env = Environment(name="do", outer=env)
     if len(args) == 0:
         throw_error("syntax", "Incorrect use of (do ...): must take at least one argument.")
-    result = None
-    for a in args:
-        result = ev.evaluate(a, do_env)
-    return result
+    for a in args[:-1]:
+        yield a, do_env
+    return Tail(args[-1], do_env)
 
 def lamb(args, env):
     # print("\n")
@@ -25,37 +174,40 @@ def lamb(args, env):
     lbody = args[-1]
     # print("largs (" + str(len(largs)) + "):", largs)
     for l in largs:
-        assert_or_throw(l['type'] == 'symbol', "syntax", "Incorrect use of (lambda ...): the anonymous function's variables must be symbols.")
-    largs = tuple(la['value'] for la in largs)
+        assert_or_throw(type(l) is Symbol, "syntax", "Incorrect use of (lambda ...): the anonymous function's variables must be symbols.")
+    largs = tuple(la.name for la in largs)
     # print("lbody:", lbody)
-    def anonymous(*arguments):
-        # print("inside anonymous function")
-        # print("arguments(" + str(len(arguments)) + "):", arguments)
-        if len(arguments) != len(largs):
-            throw_error("syntax", "This function takes " + str(len(largs)) + " arguments (" + str(len(arguments)) + " provided).")
-        lenv = Environment(name="anon_fn", outer=env, variables=largs, values=arguments)
-        return ev.evaluate(lbody, lenv)
-    return anonymous
+    return Lambda(largs, lbody, env)
 
 def define(args, env):
     if len(args) != 2:
         throw_error("syntax", "Incorrect use of (define ...): must take exactly two arguments.")
-    assert_or_throw(args[0]['type'] == 'symbol', "type", "Incorrect use of (define ...): the variable must be a symbol.")
-    variable = args[0]['value']
-    value = ev.evaluate(args[1], env)
+    assert_or_throw(type(args[0]) is Symbol, "type", "Incorrect use of (define ...): the variable must be a symbol.")
+    variable = args[0].name
+    value = yield args[1], env
     env.set(variable, value)
+    profiling.name_function(value, variable)
     return value
 
 def cond(args, env):
     if len(args) != 3:
         throw_error("syntax", "Incorrect use of (if ...): must take exactly three arguments (a test, a pass case, and a fail case).")
-    test = ev.evaluate(args[0], env)
+    test = yield args[0], env
     if type(test) != bool:
-        throw_error("type", "Incorrect use of (if ...): the test must evaluate to a boolean.")
+        throw_test_error()
     if test:
-        return ev.evaluate(args[1], env)
+        return Tail(args[1], env)
     else:
-        return ev.evaluate(args[2], env)
+        return Tail(args[2], env)
+
+def memo(args, env):
+    if len(args) not in (1, 2):
+        throw_error("syntax", "Incorrect use of (memo ...): must take one or two arguments (a function, and optionally how many results to remember).")
+    function = yield args[0], env
+    if len(args) == 1:
+        return make_memo(function)
+    size = yield args[1], env
+    return make_memo(function, size)
 
 def special_forms():
     specials = dict()
@@ -64,5 +216,6 @@ def special_forms():
     specials['lambda'] = lamb
     specials['define'] = define
     specials['if'] = cond
+    specials['memo'] = memo
 
     return specials
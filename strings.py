@@ -0,0 +1,89 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+from errors import *
+
+# Joining strings at most this long makes a plain Python string, rather than a Rope
+SHORT = 64
+
+class Rope:
+    '''A Kimi string made by concat: the two strings (Python strings or Ropes) it joins, and its length.
+
+    Joining strings just makes a new Rope, so building a string by repeated concats is O(1) per concat,
+    however long the string gets. The characters are only copied into one Python string (once, and kept)
+    when something needs them: equality, printing, or picking out characters (substring, split, ...).
+    Kimi strings are either Python strings (e.g. literals) or Ropes, and Kimi can't tell them apart.
+    '''
+    __slots__ = ('left', 'right', 'length', 'flat')
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.length = len(left) + len(right)
+        self.flat = None
+
+    def flatten(self):
+        '''Return the string as one Python string.
+        The tree of Ropes is walked with a stack, rather than recursively, so it can be arbitrarily deep.'''
+        if self.flat is None:
+            parts = []
+            pending = [self]
+            while pending:
+                node = pending.pop()
+                if type(node) is str:
+                    parts.append(node)
+                elif node.flat is not None:
+                    parts.append(node.flat)
+                else:
+                    pending.append(node.right)
+                    pending.append(node.left)
+            self.flat = "".join(parts)
+            # the Ropes joined aren't needed any more
+            self.left = self.flat
+            self.right = ""
+        return self.flat
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        return self.flatten()
+
+    def __eq__(self, other):
+        if type(other) is Rope:
+            return self.length == other.length and self.flatten() == other.flatten()
+        elif type(other) is str:
+            return self.length == len(other) and self.flatten() == other
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.flatten())
+
+    def __repr__(self):
+        return "Rope(" + repr(self.flatten()) + ")"
+
+def is_string(value):
+    return type(value) is str or type(value) is Rope
+
+def kimi_type(value):
+    '''Return the type of a Kimi value, where Ropes are strings like any other.'''
+    return str if type(value) is Rope else type(value)
+
+def text(value):
+    '''Return a Kimi string as a Python string.'''
+    return value.flatten() if type(value) is Rope else value
+
+def verify_string(value):
+    if not is_string(value):
+        throw_error("type", "Invalid argument type: " + str(value) + " is type " + type(value).__name__ + ", expected type str.")
+
+def concat(a, b):
+    '''Join two Kimi strings.'''
+    if not b:
+        return a
+    elif not a:
+        return b
+    elif type(a) is str and type(b) is str and len(a) + len(b) <= SHORT:
+        return a + b
+    return Rope(a, b)
@@ -1,6 +1,19 @@
+import io
+import asyncio
+import os
+import json
+import tempfile
+import warnings
 import unittest
+import kimi_bench
+from special_forms import make_memo
+from strings import Rope
+import vectors
 from kimi import *
 
+# NumPy, if it's installed (the vector tests also run without it)
+NUMPY = vectors.numpy
+
 class TestTokenize(unittest.TestCase):
 
     def test_numbers(self):
@@ -39,141 +52,1121 @@ class TestTokenize(unittest.TestCase):
              ('closing', None), ('closing', None), ('closing', None)])
 
     def test_syntax_errors(self):
-        self.assertRaises(SystemExit, tokenize, ("( + 1 2 )"))
-        self.assertRaises(SystemExit, tokenize, ("(((+ 1 2)))"))
-        self.assertRaises(SystemExit, tokenize, (")+ 1 2("))
-        self.assertRaises(SystemExit, tokenize, ("+ 1 2()"))
+        self.assertRaises(KimiSyntaxError, tokenize, ("( + 1 2 )"))
+        self.assertRaises(KimiSyntaxError, tokenize, ("(((+ 1 2)))"))
+        self.assertRaises(KimiSyntaxError, tokenize, (")+ 1 2("))
+        self.assertRaises(KimiSyntaxError, tokenize, ("+ 1 2()"))
         # self.assertEqual(tokenize("(+ 1 2) (+ 3 4)"),
         #     [('opening', None), ('symbol', '+'), ('literal', 1), ('literal', 2), ('closing', None),
         #      ('opening', None), ('symbol', '+'), ('literal', 3), ('literal', 4), ('closing', None)] )
 
+    def test_positions(self):
+        tokens = tokenize('(do\n  (define s "a\nb")\n\ts)')
+        self.assertEqual([(t.line, t.column) for t in tokens],
+            [(1, 1), (1, 2), (2, 3), (2, 4), (2, 11), (2, 13), (3, 3), (4, 2), (4, 3)])
+
+    def test_scan_is_lazy(self):
+        tokens = scan("(+ 1 2)")
+        self.assertEqual(next(tokens), ('opening', None))
+        self.assertEqual(list(tokens), [('symbol', '+'), ('literal', 1), ('literal', 2), ('closing', None)])
+
 class TestParse(unittest.TestCase):
 
     def test_parse(self):
         self.assertEqual(parse(tokenize("(+ 1 2)")),
-             {'type': 'apply',
-              'operator': {'type': 'symbol', 'value': '+'},
-              'arguments': ({'type': 'literal', 'value': 1},
-                            {'type': 'literal', 'value': 2})})
+             Apply(Symbol('+'), (Literal(1), Literal(2))))
         self.assertEqual(parse(tokenize("(define square (lambda x (* x x)))")),
-             {'type': 'apply',
-              'operator': {'type': 'symbol', 'value': 'define'},
-              'arguments': ({'type': 'symbol', 'value': 'square'},
-                            {'type': 'apply',
-                             'operator': {'type': 'symbol', 'value': 'lambda'},
-                             'arguments': ({'type': 'symbol', 'value': 'x'},
-                                           {'type': 'apply',
-                                            'operator': {'type': 'symbol', 'value': '*'},
-                                            'arguments': ({'type': 'symbol', 'value': 'x'},
-                                                          {'type': 'symbol', 'value': 'x'})})})})
+             Apply(Symbol('define'),
+                   (Symbol('square'),
+                    Apply(Symbol('lambda'),
+                          (Symbol('x'),
+                           Apply(Symbol('*'), (Symbol('x'), Symbol('x'))))))))
+
+    def test_interned_names(self):
+        tree = parse(tokenize("(* xyz xyz)"))
+        self.assertIs(tree.arguments[0].name, tree.arguments[1].name)
+
+    def test_deep_nesting(self):
+        depth = 20000
+        tree = parse(tokenize("(- " * depth + "1" + " 1)" * depth))
+        for i in range(depth):
+            self.assertEqual(tree.operator, Symbol('-'))
+            tree = tree.arguments[0]
+        self.assertEqual(tree, Literal(1))
+
+    def test_syntax_errors(self):
+        self.assertRaises(KimiSyntaxError, parse, tokenize(""))
+        self.assertRaises(KimiSyntaxError, parse, [('opening', None), ('symbol', '+')])
+        self.assertRaises(KimiSyntaxError, parse, [('closing', None)])
+
+
+class EngineTestCase(unittest.TestCase):
+    '''Base class for tests that execute whole programs, so they can be rerun with every engine.'''
+    engine = 'tree'
+    optimize = False
+
+    def execute(self, program, environment=None):
+        optimizer = Optimizer() if self.optimize else None
+        return execute(program, engine=self.engine, environment=environment, optimizer=optimizer)
 
 
-class TestExecute(unittest.TestCase):
+class TestExecute(EngineTestCase):
 
     def test_atoms(self):
-        self.assertEqual(execute("-10"), -10)
-        self.assertEqual(execute("true"), True)
-        self.assertEqual(execute('"string"'), "string")
+        self.assertEqual(self.execute("-10"), -10)
+        self.assertEqual(self.execute("true"), True)
+        self.assertEqual(self.execute('"string"'), "string")
 
     def test_nesting(self):
-        self.assertEqual(execute("(| (& true false) (! true))"), False)
-        self.assertEqual(execute("(+ (* 2 3) (- 4 2))"), 8)
+        self.assertEqual(self.execute("(| (& true false) (! true))"), False)
+        self.assertEqual(self.execute("(+ (* 2 3) (- 4 2))"), 8)
 
     @unittest.expectedFailure
     def test_bad_program(self):
-        self.assertRaises(SystemExit, execute, ("(+ (1) (2))"))
-        self.assertEqual(execute("(+ 1 2) (+ 3 4)"), 7) #or throw error
+        self.assertRaises(KimiError, self.execute, ("(+ (1) (2))"))
+        self.assertEqual(self.execute("(+ 1 2) (+ 3 4)"), 7) #or throw error
 
-class TestBuiltins(unittest.TestCase):
+class TestBuiltins(EngineTestCase):
 
     def test_arithmetic(self):
         # Addition
-        self.assertEqual(execute("(+ 1 2)"), 3)
-        self.assertEqual(execute("(+ -1 2)"), 1)
+        self.assertEqual(self.execute("(+ 1 2)"), 3)
+        self.assertEqual(self.execute("(+ -1 2)"), 1)
         # Subtraction
-        self.assertEqual(execute("(- 2 1)"), 1)
-        self.assertEqual(execute("(- 1 -2)"), 3)
+        self.assertEqual(self.execute("(- 2 1)"), 1)
+        self.assertEqual(self.execute("(- 1 -2)"), 3)
         # Multiplication
-        self.assertEqual(execute("(* 2 4)"), 8)
-        self.assertEqual(execute("(* 3 -2)"), -6)
+        self.assertEqual(self.execute("(* 2 4)"), 8)
+        self.assertEqual(self.execute("(* 3 -2)"), -6)
         # Floor division
-        self.assertEqual(execute("(/ 6 2)"), 3)
-        self.assertEqual(execute("(/ 7 2)"), 3)
-        self.assertEqual(execute("(/ 1 2)"), 0)
-        self.assertEqual(execute("(/ 6 -2)"), -3)
-        self.assertEqual(execute("(/ -3 -2)"), 1)
+        self.assertEqual(self.execute("(/ 6 2)"), 3)
+        self.assertEqual(self.execute("(/ 7 2)"), 3)
+        self.assertEqual(self.execute("(/ 1 2)"), 0)
+        self.assertEqual(self.execute("(/ 6 -2)"), -3)
+        self.assertEqual(self.execute("(/ -3 -2)"), 1)
         # Modulo
-        self.assertEqual(execute("(% 7 2)"), 1)
-        self.assertEqual(execute("(% 6 -4)"), -2)
-        self.assertEqual(execute("(% 2 3)"), 2)
+        self.assertEqual(self.execute("(% 7 2)"), 1)
+        self.assertEqual(self.execute("(% 6 -4)"), -2)
+        self.assertEqual(self.execute("(% 2 3)"), 2)
 
     def test_logic(self):
         # And
-        self.assertEqual(execute("(& true true)"), True)
-        self.assertEqual(execute("(& true false)"), False)
-        self.assertEqual(execute("(& false true)"), False)
-        self.assertEqual(execute("(& false false)"), False)
+        self.assertEqual(self.execute("(& true true)"), True)
+        self.assertEqual(self.execute("(& true false)"), False)
+        self.assertEqual(self.execute("(& false true)"), False)
+        self.assertEqual(self.execute("(& false false)"), False)
         # Or
-        self.assertEqual(execute("(| true true)"), True)
-        self.assertEqual(execute("(| true false)"), True)
-        self.assertEqual(execute("(| false true)"), True)
-        self.assertEqual(execute("(| false false)"), False)
+        self.assertEqual(self.execute("(| true true)"), True)
+        self.assertEqual(self.execute("(| true false)"), True)
+        self.assertEqual(self.execute("(| false true)"), True)
+        self.assertEqual(self.execute("(| false false)"), False)
         # Not
-        self.assertEqual(execute("(! true)"), False)
-        self.assertEqual(execute("(! false)"), True)
+        self.assertEqual(self.execute("(! true)"), False)
+        self.assertEqual(self.execute("(! false)"), True)
 
     def test_equality(self):
-        self.assertEqual(execute("(= 1 1)"), True)
-        self.assertEqual(execute("(= 1 2)"), False)
-        self.assertEqual(execute('(= "yes" "yes")'), True)
-        self.assertEqual(execute('(= "yes" "no")'), False)
-        self.assertEqual(execute("(= false false)"), True)
-        self.assertEqual(execute("(= true false)"), False)
+        self.assertEqual(self.execute("(= 1 1)"), True)
+        self.assertEqual(self.execute("(= 1 2)"), False)
+        self.assertEqual(self.execute('(= "yes" "yes")'), True)
+        self.assertEqual(self.execute('(= "yes" "no")'), False)
+        self.assertEqual(self.execute("(= false false)"), True)
+        self.assertEqual(self.execute("(= true false)"), False)
 
     def test_comparison(self):
         # Greater than
-        self.assertEqual(execute("(> 2 1)"), True)
-        self.assertEqual(execute("(> 2 2)"), False)
-        self.assertEqual(execute("(> 1 2)"), False)
+        self.assertEqual(self.execute("(> 2 1)"), True)
+        self.assertEqual(self.execute("(> 2 2)"), False)
+        self.assertEqual(self.execute("(> 1 2)"), False)
         # Less than
-        self.assertEqual(execute("(< 2 1)"), False)
-        self.assertEqual(execute("(< 2 2)"), False)
-        self.assertEqual(execute("(< 1 2)"), True)
+        self.assertEqual(self.execute("(< 2 1)"), False)
+        self.assertEqual(self.execute("(< 2 2)"), False)
+        self.assertEqual(self.execute("(< 1 2)"), True)
         # Greater or equal
-        self.assertEqual(execute("(>= 2 1)"), True)
-        self.assertEqual(execute("(>= 2 2)"), True)
-        self.assertEqual(execute("(>= 1 2)"), False)
+        self.assertEqual(self.execute("(>= 2 1)"), True)
+        self.assertEqual(self.execute("(>= 2 2)"), True)
+        self.assertEqual(self.execute("(>= 1 2)"), False)
         # Less or equal
-        self.assertEqual(execute("(<= 2 1)"), False)
-        self.assertEqual(execute("(<= 2 2)"), True)
-        self.assertEqual(execute("(<= 1 2)"), True)
+        self.assertEqual(self.execute("(<= 2 1)"), False)
+        self.assertEqual(self.execute("(<= 2 2)"), True)
+        self.assertEqual(self.execute("(<= 1 2)"), True)
+
+    def test_type_checks(self):
+        self.assertRaises(KimiTypeError, self.execute, '(+ 1 "2")')
+        self.assertRaises(KimiTypeError, self.execute, '(! 1)')
+        # the same call sites, first with the right types and then with the wrong ones
+        self.assertRaises(KimiTypeError, self.execute, '(do (define f (lambda a b (+ a b))) (f 1 2) (f 1 "2"))')
+        self.assertRaises(KimiTypeError, self.execute, '(do (define f (lambda a (! a))) (f true) (f 1))')
+        # the same call sites, calling different builtins
+        self.assertEqual(self.execute('(do (define g (lambda op (op 6 3))) (+ (g +) (g -)))'), 12)
+        self.assertEqual(self.execute('(do (define g (lambda op (op 6 3))) (g +) (g =))'), False)
 
     def test_lists(self):
-        self.assertEqual(execute("(prepend 1 (prepend 2 nil))"), (1, (2, None)))
-        self.assertEqual(execute("(list 1 2)"), (1, (2, None)))
-        self.assertEqual(execute("(first (list 1 2))"), 1)
-        self.assertEqual(execute("(rest (list 1 2))"), (2, None))
+        self.assertEqual(self.execute("(prepend 1 (prepend 2 nil))"), make_list([1, 2]))
+        self.assertEqual(self.execute("(list 1 2)"), make_list([1, 2]))
+        self.assertEqual(self.execute("(first (list 1 2))"), 1)
+        self.assertEqual(self.execute("(rest (list 1 2))"), make_list([2]))
+        self.assertEqual(self.execute("(rest (list 1))"), None)
+        self.assertEqual(self.execute("(list)"), None)
+        self.assertEqual(self.execute("(first nil)"), None)
+        self.assertRaises(KimiTypeError, self.execute, "(prepend 1 2)")
+        self.assertRaises(KimiTypeError, self.execute, "(first 1)")
+
+    def test_list_sharing(self):
+        # lists made from the same list don't see each other's elements
+        self.assertEqual(kimify(self.execute("""(do
+            (define a (list 2 3))
+            (define b (prepend 1 a))
+            (define c (prepend 0 a))
+            (define d (prepend 9 (rest b)))
+            (list a b c d))""")), "(list (list 2 3) (list 1 2 3) (list 0 2 3) (list 9 2 3))")
+
+    def test_list_equality(self):
+        self.assertEqual(self.execute("(= (list 1 (list 2 3)) (list 1 (list 2 3)))"), True)
+        self.assertEqual(self.execute("(= (list 1 2) (list 1 3))"), False)
+        self.assertEqual(self.execute("(= (list 1) (list true))"), False)
+        self.assertEqual(self.execute("(= (list 1) (list 1 2))"), False)
+        self.assertEqual(self.execute("(= (list 1) 1)"), False)
+
+    def test_list_builtins(self):
+        self.assertEqual(self.execute("(length (list 1 2 3))"), 3)
+        self.assertEqual(self.execute("(length nil)"), 0)
+        self.assertEqual(self.execute("(nth (list 1 2 3) 1)"), 2)
+        self.assertEqual(self.execute("(nth (list 1 2 3) 3)"), None)
+        self.assertEqual(self.execute("(range 2 6)"), make_list([2, 3, 4, 5]))
+        self.assertEqual(self.execute("(range 2 2)"), None)
+        self.assertEqual(self.execute("(map (lambda x (* x x)) (range 0 4))"), make_list([0, 1, 4, 9]))
+        self.assertEqual(self.execute("(map ! nil)"), None)
+        self.assertEqual(self.execute("(filter (lambda x (> x 1)) (range 0 4))"), make_list([2, 3]))
+        self.assertEqual(self.execute("(fold + 0 (range 0 101))"), 5050)
+        self.assertEqual(self.execute("(fold (lambda acc x (prepend x acc)) nil (list 1 2 3))"), make_list([3, 2, 1]))
+        self.assertEqual(self.execute("(length (range 0 100000))"), 100000)
+        self.assertRaises(KimiTypeError, self.execute, "(filter (lambda x x) (list 1))")
+        self.assertRaises(KimiTypeError, self.execute, "(range 0 true)")
+        self.assertRaises(KimiTypeError, self.execute, "(map ! 1)")
+        # the function has to be a function, even for the empty list
+        for program in ("(map 1 (list 1 2))", "(filter 1 nil)", "(fold true 0 (list 1))"):
+            with self.assertRaises(KimiTypeError) as caught:
+                self.execute(program)
+            self.assertEqual(str(caught.exception), "TYPE ERROR! Trying to call a non-function. Did you use parentheses correctly?")
+
+    def test_strings(self):
+        self.assertEqual(self.execute('(concat "ab" "cd" "e")'), "abcde")
+        self.assertEqual(self.execute('(concat)'), "")
+        self.assertEqual(self.execute('(length "hello")'), 5)
+        self.assertEqual(self.execute('(substring "hello" 1 3)'), "el")
+        self.assertEqual(self.execute('(substring "hello" 3 10)'), "lo")
+        self.assertEqual(self.execute('(split "a,b,,c" ",")'), make_list(["a", "b", "", "c"]))
+        self.assertEqual(self.execute('(join (list "a" "b" "c") ", ")'), "a, b, c")
+        self.assertEqual(self.execute('(join nil ",")'), "")
+        self.assertEqual(self.execute('(string->list "abc")'), make_list(["a", "b", "c"]))
+        self.assertEqual(self.execute('(number->string -42)'), "-42")
+        self.assertEqual(self.execute('(string->number "17")'), 17)
+        self.assertEqual(self.execute('(string->number "x")'), None)
+        self.assertRaises(KimiTypeError, self.execute, '(concat "a" 1)')
+        self.assertRaises(KimiTypeError, self.execute, '(substring "abc" 0 true)')
+        self.assertRaises(KimiTypeError, self.execute, '(split "abc" "")')
+        self.assertRaises(KimiTypeError, self.execute, '(join (list "a" 1) ",")')
+        self.assertRaises(KimiTypeError, self.execute, '(number->string "1")')
+
+    def test_ropes(self):
+        # strings built by concat are the same as any other string
+        self.assertEqual(self.execute('(= (concat "ab" "cd") "abcd")'), True)
+        self.assertEqual(self.execute('(= "abcd" (concat "ab" "cd"))'), True)
+        self.assertEqual(self.execute('(= (concat "ab" "cd") 1)'), False)
+        self.assertEqual(self.execute('(= (list (concat "a" "b")) (list "ab"))'), True)
+        long_string = "(concat" + ' "0123456789"' * 20 + ")"
+        self.assertEqual(self.execute("(= " + long_string + " " + long_string + ")"), True)
+        self.assertEqual(kimify(self.execute("(list " + long_string + ")")), '(list "' + "0123456789" * 20 + '")')
+        # a long string built one character at a time
+        built = self.execute('(fold (lambda s n (concat s (number->string (% n 10)))) "" (range 0 100000))')
+        self.assertEqual(len(built), 100000)
+        self.assertEqual(built, "".join(str(n % 10) for n in range(100000)))
+        self.assertEqual(self.execute('(substring (concat (concat "ab" "cd") (concat "ef" "gh")) 3 6)'), "def")
+
+
+class TestVectors(EngineTestCase):
+    '''Vectors backed by arrays (without NumPy), and by NumPy arrays in TestVectorsNumPy,
+    which should give the same results.'''
+    numpy = None
 
+    def setUp(self):
+        self.installed = vectors.numpy
+        vectors.numpy = self.numpy
 
-class TestSpecialForms(unittest.TestCase):
+    def tearDown(self):
+        vectors.numpy = self.installed
+
+    def test_vectors(self):
+        self.assertEqual(self.execute("(vec 1 2 3)"), make_vec([1, 2, 3]))
+        self.assertEqual(self.execute("(vec-range 0 4)"), make_vec([0, 1, 2, 3]))
+        self.assertEqual(self.execute("(+ (vec 1 2) (vec 10 20))"), make_vec([11, 22]))
+        self.assertEqual(self.execute("(* 3 (vec 1 2))"), make_vec([3, 6]))
+        self.assertEqual(self.execute("(% (vec-range 0 5) 2)"), make_vec([0, 1, 0, 1, 0]))
+        self.assertEqual(self.execute("(/ (vec 7 -7) 2)"), make_vec([3, -4]))
+        self.assertEqual(self.execute("(>= (vec 1 2 3) 2)"), make_vec([0, 1, 1]))
+        self.assertEqual(self.execute("(vec-sum (vec-range 0 101))"), 5050)
+        self.assertEqual(self.execute("(vec-max (vec 3 9 2))"), 9)
+        self.assertEqual(self.execute("(vec-max (vec))"), None)
+        self.assertEqual(self.execute("(vec->list (vec 1 2))"), make_list([1, 2]))
+        self.assertEqual(self.execute("(list->vec (range 0 3))"), make_vec([0, 1, 2]))
+        self.assertEqual(self.execute("(= (vec 1 2) (vec 1 2))"), True)
+        self.assertEqual(self.execute("(= (vec 1 2) (vec 1))"), False)
+        self.assertEqual(kimify(self.execute("(list (vec 1 2) (vec))")), "(list (vec 1 2) (vec))")
+        # the same call site, with ints and then vectors
+        self.assertEqual(self.execute("(do (define f (lambda a (+ a 1))) (f 1) (f (vec 1)))"), make_vec([2]))
+        self.assertRaises(KimiTypeError, self.execute, "(+ (vec 1 2) (vec 1))")
+        self.assertRaises(KimiTypeError, self.execute, "(+ (vec 1) true)")
+        self.assertRaises(KimiTypeError, self.execute, "(vec 1 true)")
+        self.assertRaises(KimiTypeError, self.execute, "(list->vec (list true))")
+        self.assertRaises(KimiTypeError, self.execute, "(vec-sum (list 1))")
+        self.assertRaises(ZeroDivisionError, self.execute, "(/ (vec 1) (vec 0))")
+
+    def test_int64_bounds(self):
+        biggest = "9223372036854775807"
+        self.assertEqual(self.execute("(vec-max (vec -9223372036854775808 " + biggest + "))"), 2 ** 63 - 1)
+        self.assertRaises(KimiTypeError, self.execute, "(vec 9223372036854775808)")
+        self.assertRaises(KimiTypeError, self.execute, "(vec -9223372036854775809)")
+        self.assertRaises(KimiTypeError, self.execute, "(* (vec 4611686018427387904) 2)")
+        self.assertRaises(KimiTypeError, self.execute, "(+ (vec 1 " + biggest + ") 1)")
+        self.assertRaises(KimiTypeError, self.execute, "(- (vec -9223372036854775808) (vec 1))")
+        self.assertRaises(KimiTypeError, self.execute, "(/ (vec -9223372036854775808) -1)")
+        self.assertRaises(KimiTypeError, self.execute, "(+ (vec 1) 9223372036854775808)")
+        self.assertRaises(KimiTypeError, self.execute, "(list->vec (list 9223372036854775808))")
+        self.assertRaises(KimiTypeError, self.execute, "(vec-range 9223372036854775806 9223372036854775809)")
+        # results close to the bounds that do fit
+        self.assertEqual(self.execute("(* (vec 4611686018427387903) 2)"), make_vec([2 ** 63 - 2]))
+        self.assertEqual(self.execute("(+ (vec " + biggest + " -1) (vec -1 " + biggest + "))"), make_vec([2 ** 63 - 2] * 2))
+        # the sum of a vector is a Kimi int, so it doesn't have to fit in 64 bits
+        self.assertEqual(self.execute("(vec-sum (vec " + biggest + " " + biggest + "))"), 2 ** 64 - 2)
+
+@unittest.skipIf(NUMPY is None, "NumPy isn't installed")
+class TestVectorsNumPy(TestVectors):
+    numpy = NUMPY
+
+
+class TestSpecialForms(EngineTestCase):
 
     def test_do(self):
-        self.assertEqual(execute("(do (> 4 3))"), True)
-        self.assertEqual(execute("(do (+ 1 2) (+ 3 4))"), 7)
+        self.assertEqual(self.execute("(do (> 4 3))"), True)
+        self.assertEqual(self.execute("(do (+ 1 2) (+ 3 4))"), 7)
 
     def test_lambda(self):
-        self.assertTrue(callable(execute("(lambda x (* x x))")))
-        self.assertEqual(execute("((lambda x (* x x)) 2)"), 4)
-        self.assertEqual(execute("((lambda a b (! (& a b))) true false)"), True)
-        self.assertEqual(execute("((lambda a ((lambda y (- a y)) 3)) 7)"), 4)
+        self.assertTrue(callable(self.execute("(lambda x (* x x))")))
+        self.assertEqual(self.execute("((lambda x (* x x)) 2)"), 4)
+        self.assertEqual(self.execute("((lambda a b (! (& a b))) true false)"), True)
+        self.assertEqual(self.execute("((lambda a ((lambda y (- a y)) 3)) 7)"), 4)
     #
     def test_define(self):
-        self.assertEqual(execute("(do (define x 1) (+ x x))"), 2)
+        self.assertEqual(self.execute("(do (define x 1) (+ x x))"), 2)
+
+    def test_scopes(self):
+        self.assertRaises(KimiNameError, self.execute, "(do (do (define x 3)) (+ 1 x))")
+        self.assertRaises(KimiNameError, self.execute, "(do (define x 1) (define x 2))")
+        self.assertRaises(KimiNameError, self.execute, "((lambda x (define x 2)) 1)")
+        self.assertRaises(KimiNameError, self.execute, "(define + 1)")
+        self.assertEqual(self.execute("(do (if true (define x 1) (define x 2)) x)"), 1)
+        # a variable used before it is defined in an inner block comes from the outer block
+        self.assertEqual(self.execute("(do (define x 1) (do (define y x) (define x 2) (+ x y)))"), 3)
+        self.assertEqual(self.execute("(do (define f (lambda a (g a))) (define g (lambda b (* b 2))) (f 4))"), 8)
 
     def test_if(self):
-        self.assertEqual(execute("(if true 1 2)"), 1)
-        self.assertEqual(execute("(if false 1 2)"), 2)
-        self.assertRaises(SystemExit, execute, "(if 1 2 3)")
+        self.assertEqual(self.execute("(if true 1 2)"), 1)
+        self.assertEqual(self.execute("(if false 1 2)"), 2)
+        self.assertRaises(KimiTypeError, self.execute, "(if 1 2 3)")
+
+    def test_malformed(self):
+        self.assertRaises(KimiSyntaxError, self.execute, "(do)")
+        self.assertRaises(KimiSyntaxError, self.execute, "(lambda x)")
+        self.assertRaises(KimiTypeError, self.execute, "(define 1 2)")
+        self.assertRaises(KimiSyntaxError, self.execute, "(if true 1)")
+        self.assertRaises(KimiSyntaxError, self.execute, "(memo)")
+        # mistakes are only reported when the form is evaluated
+        self.assertEqual(self.execute("(if true 1 (lambda x))"), 1)
+
+    def test_memo(self):
+        self.assertEqual(kimify(self.execute("""(do
+            (define fib (memo (lambda n (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))))
+            (list (fib 90) (memo-stats fib)))""")), "(list 2880067194370816120 (list 88 91 91))")
+        # only the last 2 results are remembered
+        self.assertEqual(kimify(self.execute("""(do
+            (define f (memo (lambda x (* x 10)) 2))
+            (list (f 1) (f 2) (f 1) (f 3) (f 2) (f 1) (memo-stats f)))""")), "(list 10 20 10 30 20 10 (list 1 5 2))")
+        # 1 and true are different arguments
+        self.assertEqual(self.execute("(do (define f (memo (lambda x x))) (f 1) (f true))"), True)
+        self.assertEqual(self.execute("(do (define f (memo +)) (f 1 2))"), 3)
+
+    def test_deep_memo(self):
+        # memoized recursion doesn't use Python's stack, so it goes far deeper than Python's recursion limit
+        fib = self.execute("""(do
+            (define fib (memo (lambda n (if (< n 2) n (+ (fib (- n 1)) (fib (- n 2)))))))
+            (list (fib 2000) (memo-stats fib)))""")
+        (a, b) = (0, 1)
+        for _ in range(2000):
+            (a, b) = (b, a + b)
+        self.assertEqual(fib, make_list([a, make_list([1998, 2001, 1000])]))
+        # a memoized function called in tail position
+        self.assertEqual(self.execute("""(do
+            (define count (memo (lambda n (if (= n 0) 0 (+ 1 (count (- n 1)))))))
+            (define f (lambda n (count n)))
+            (f 5000))"""), 5000)
+
+    def test_memo_errors(self):
+        # errors aren't remembered: calls with the wrong arguments fail every time
+        self.assertRaises(KimiSyntaxError, self.execute, "(do (define f (memo (lambda x x))) (f 1 2))")
+        self.assertRaises(KimiSyntaxError, self.execute, "(do (define f (memo (lambda x x))) (f 1) (f 1 1))")
+        self.assertRaises(KimiTypeError, self.execute, "(memo 1)")
+        self.assertRaises(KimiTypeError, self.execute, "(memo + 0)")
+        self.assertRaises(KimiTypeError, self.execute, "(memo-stats +)")
+        self.assertRaises(KimiTypeError, make_memo(len), [1])
+
+
+class TestSamples(EngineTestCase):
+
+    def run_sample(self, name):
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'samples', name)) as f:
+            return self.execute(f.read())
+
+    def test_samples(self):
+        self.assertEqual(self.run_sample('sample.kimi'), 7)
+        self.assertEqual(self.run_sample('closure.kimi'), 7)
+        self.assertEqual(self.run_sample('factorial.kimi'), 6)
+        self.assertEqual(self.run_sample('map.kimi'), make_list([False, True, False]))
+        self.assertEqual(self.run_sample('max.kimi'), 5)
+
+class TestEnvironments(EngineTestCase):
+
+    def test_shared_builtins(self):
+        (env1, env2) = (standard_env(), standard_env())
+        self.assertIsNot(env1, env2)
+        self.assertIs(env1.outer, env2.outer)
+        self.assertEqual(len(env1), 0)
+        self.assertEqual(self.execute("(define x 3)", env1), 3)
+        self.assertEqual(self.execute("(+ x 1)", env1), 4)
+        self.assertRaises(KimiNameError, self.execute, "(+ x 1)", env2)
+        self.assertRaises(KimiNameError, self.execute, "(define x 4)", env1)
+        self.assertRaises(KimiNameError, self.execute, "(define first 4)", env1)
+
+    def test_snapshot(self):
+        prelude = standard_env()
+        self.execute("(define square (lambda x (* x x)))", prelude)
+        prelude = prelude.snapshot()
+        self.assertRaises(KimiNameError, self.execute, "(define y 1)", prelude)
+        (env1, env2) = (prelude.restore(), prelude.restore())
+        self.assertEqual(self.execute("(define y (square 3))", env1), 9)
+        self.assertEqual(self.execute("(define y (square 4))", env2), 16)
+        self.assertRaises(KimiNameError, self.execute, "(define square 4)", env1)
+
+
+class TestErrors(unittest.TestCase):
+
+    def test_messages(self):
+        with self.assertRaises(KimiSyntaxError) as caught:
+            execute("(+ 1 2")
+        self.assertEqual(str(caught.exception), "SYNTAX ERROR! Mismatching parentheses!")
+        with self.assertRaises(KimiTypeError) as caught:
+            execute('(+ 1 "2")')
+        self.assertEqual(str(caught.exception), "TYPE ERROR! Invalid argument type: 2 is type str, expected type int.")
+        with self.assertRaises(KimiNameError) as caught:
+            execute("(+ x 1)")
+        self.assertEqual(str(caught.exception), "NAME ERROR! Undefined variable: x")
+
+    def test_run_many(self):
+        outcomes = run_many(["(define x 1)", "(+ x 1)", "(do (define x 2) (* x 3))", "(+ 1"])
+        self.assertEqual([result for (result, error) in outcomes], [1, None, 6, None])
+        self.assertEqual([type(error) for (result, error) in outcomes], [type(None), KimiNameError, type(None), KimiSyntaxError])
+
+    def test_run_many_crash(self):
+        # a program that crashes the interpreter doesn't stop the ones after it
+        outcomes = run_many(["(+ 1 2)", "(/ 1 0)", "(! true false)", "(+ 3 4)"])
+        self.assertEqual([result for (result, error) in outcomes], [3, None, None, 7])
+        self.assertEqual([type(error) for (result, error) in outcomes], [type(None), ZeroDivisionError, TypeError, type(None)])
+
+    def test_run_many_prelude(self):
+        prelude = standard_env()
+        execute("(define double (lambda x (* 2 x)))", environment=prelude)
+        outcomes = run_many(["(define y (double 2))", "(double y)", "(double 5)"], engine='vm', prelude=prelude.snapshot())
+        self.assertEqual([result for (result, error) in outcomes], [4, None, 10])
+
+
+class TestPrinter(unittest.TestCase):
+
+    class Stream:
+        '''A text stream that remembers each write.'''
+        def __init__(self):
+            self.writes = []
+
+        def write(self, text):
+            self.writes.append(text)
+
+    def test_kimify(self):
+        value = make_list([1, "a", None, True, make_list([2, make_vec([3, 4])]), make_vec([]), make_memo(len)])
+        self.assertEqual(kimify(value), '(list 1 "a" nil true (list 2 (vec 3 4)) (vec) <memoized function>)')
+        self.assertEqual(kimify(value, limit=12), '(list 1 "a" ...')
+        self.assertEqual(kimify(value, limit=1000), kimify(value))
+        self.assertEqual(kimify_list([1, make_list([2])]), "1 (list 2)")
+
+    def test_json(self):
+        square = execute("(define square (lambda x (* x x)))")
+        value = make_list([1, "a\"b", None, False, make_list([2, make_vec([3, 4])]), make_vec([]), square])
+        self.assertEqual(jsonify(value), '[1,"a\\"b",null,false,[2,[3,4]],[],{"function":"square"}]')
+        self.assertEqual(json.loads(jsonify(value))[:6], [1, 'a"b', None, False, [2, [3, 4]], []])
+        self.assertEqual(jsonify(make_list([Rope(Rope("a", "b"), "c")])), '["abc"]')
+
+    def test_big_values(self):
+        long = make_list(list(range(100000)))
+        out = self.Stream()
+        written = write_value(long, out, chunk_size=1000)
+        text = "".join(out.writes)
+        self.assertEqual(written, len(text))
+        self.assertEqual(text, "(list " + " ".join(str(i) for i in range(100000)) + ")")
+        self.assertLess(max(len(w) for w in out.writes), 1100)
+        # nested deeper than Python's recursion limit
+        deep = None
+        for i in range(50000):
+            deep = make_list([i, deep]) if deep is not None else make_list([i])
+        text = kimify(deep)
+        self.assertTrue(text.startswith("(list 49999 (list 49998 (list"))
+        self.assertTrue(text.endswith("(list 1 (list 0))" + ")" * 49998))
+        self.assertEqual(json.loads(jsonify(make_list([1, make_list([2, make_list([3])])]))), [1, [2, [3]]])
+
+    def test_print_value(self):
+        out = io.StringIO()
+        print_value(make_list([1, 2, 3]), out=out)
+        print_value(make_list([1, 2, 3]), format='json', out=out)
+        print_value(make_list(list(range(1000))), limit=10, out=out)
+        self.assertEqual(out.getvalue(), "(list 1 2 3)\n[1,2,3]\n(list 0 1 ...\n")
+
+
+class TestBatch(unittest.TestCase):
+
+    def test_run_batch(self):
+        programs = {
+            'ok.kimi': "(+ 1 2)",
+            'nested/list.kimi': "(list 1 2)",
+            'bad.kimi': '(+ 1 "a")',
+            'loop.kimi': "(do (define f (lambda n (f n))) (f 1))",
+            'ignored.txt': "(+ 1 2)",
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            for (name, program) in programs.items():
+                path = os.path.join(directory, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as f:
+                    f.write(program)
+            out = io.StringIO()
+            failures = batch.run_batch(directory, jobs=2, engine='tree', timeout=0.5, out=out, log=None)
+        records = dict()
+        for line in out.getvalue().splitlines():
+            record = json.loads(line)
+            records[os.path.relpath(record['path'], directory)] = record
+        self.assertEqual(failures, 2)
+        self.assertEqual(sorted(records), ['bad.kimi', 'loop.kimi', 'nested/list.kimi', 'ok.kimi'])
+        self.assertEqual(records['ok.kimi']['result'], "3")
+        self.assertEqual(records['nested/list.kimi']['result'], "(list 1 2)")
+        self.assertEqual(records['bad.kimi']['error'], "TYPE ERROR! Invalid argument type: a is type str, expected type int.")
+        self.assertTrue(records['loop.kimi']['error'].startswith("TIMEOUT ERROR!"))
+
+    def test_run_batch_json(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for (name, program) in {'list.kimi': '(list 1 "a" (list nil))', 'bad.kimi': '(+ 1 "a")'}.items():
+                with open(os.path.join(directory, name), 'w') as f:
+                    f.write(program)
+            out = io.StringIO()
+            failures = batch.run_batch(directory, jobs=1, engine='vm', out=out, log=None, result_format='json')
+        records = {os.path.basename(record['path']): record for record in map(json.loads, out.getvalue().splitlines())}
+        self.assertEqual(failures, 1)
+        self.assertEqual(records['list.kimi']['result'], [1, "a", [None]])
+        self.assertIsNone(records['bad.kimi']['result'])
+        self.assertTrue(records['bad.kimi']['error'].startswith("TYPE ERROR!"))
+
+    def test_run_batch_streams(self):
+        # a slow program doesn't hold back the records of programs that finish after it started
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'a_slow.kimi'), 'w') as f:
+                f.write("(do (define f (lambda n (f n))) (f 1))")
+            for i in range(63):
+                with open(os.path.join(directory, 'fast_' + str(i) + '.kimi'), 'w') as f:
+                    f.write("(+ 1 " + str(i) + ")")
+            out = io.StringIO()
+            failures = batch.run_batch(directory, jobs=2, engine='tree', timeout=1.0, out=out, log=None)
+        paths = [os.path.basename(json.loads(line)['path']) for line in out.getvalue().splitlines()]
+        self.assertEqual(failures, 1)
+        self.assertEqual(len(paths), 64)
+        self.assertEqual(paths[-1], 'a_slow.kimi')
+
+
+class TestParseCache(unittest.TestCase):
+
+    def test_cache(self):
+        cache = ParseCache(size=2)
+        tree = cache.parse("(+ 1 2)")
+        self.assertIs(cache.parse("(+ 1 2)"), tree)
+        self.assertEqual(cache.parse("(+ 1 2)", Optimizer()), Literal(3))
+        self.assertEqual(cache.stats(), (1, 2, 2))
+        # the least recently used program is forgotten
+        cache.parse("(+ 1 2)")
+        cache.parse("(* 2 3)")
+        self.assertEqual(cache.stats(), (2, 3, 2))
+        self.assertIs(cache.parse("(+ 1 2)"), tree)
+        self.assertIsNot(cache.parse("(+ 1 2)", Optimizer()), tree)
+        self.assertEqual(cache.stats(), (3, 4, 2))
+        # programs that don't parse are never remembered
+        for _ in range(2):
+            self.assertRaises(KimiSyntaxError, cache.parse, "(+ 1 2")
+        self.assertEqual(cache.stats(), (3, 6, 2))
+        self.assertRaises(ValueError, ParseCache, 0)
+
+    def test_execute(self):
+        cache = ParseCache()
+        environment = standard_env()
+        self.assertEqual(execute("(define x 2)", environment=environment, cache=cache), 2)
+        for engine in sorted(ENGINES):
+            self.assertEqual(execute("(* x 21)", engine=engine, environment=environment, cache=cache), 42)
+        self.assertEqual(cache.stats(), (2, 2, 2))
+        outcomes = run_many(["(+ 1 2)", "(+ 1 2)", "(+ 1 true)"], cache=cache)
+        self.assertEqual([result for (result, error) in outcomes], [3, 3, None])
+        self.assertEqual(cache.stats(), (3, 4, 4))
+        profiler = Profiler()
+        self.assertEqual(execute("(+ 1 2)", profiler=profiler, cache=cache), 3)
+        self.assertEqual(cache.stats(), (4, 4, 4))
+
+    def test_loader(self):
+        environment = standard_env()
+        loader = Loader(environment)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'program.kimi')
+            with open(path, 'w') as f:
+                f.write("(define x 10)\n(define f (lambda n (* n x)))\n(define y (f 2))\n")
+            self.assertEqual(loader.load(path), (3, 0))
+            self.assertEqual(execute("(+ y (f 1))", environment=environment), 30)
+            # loading again redefines everything
+            self.assertRaises(KimiNameError, loader.load, path)
+            self.assertEqual(loader.load(path, incremental=True), (0, 3))
+            # only the forms that changed (or use ones that did) are evaluated again
+            with open(path, 'w') as f:
+                f.write("(define x 10)\n(define f   (lambda n (+ n x)))\n(define y (f 2))\n(define z (f 0))\n")
+            self.assertEqual(loader.load(path, incremental=True), (2, 2))
+            self.assertEqual(execute("(list x y z (f 1))", environment=environment), make_list([10, 20, 10, 11]))
+            # definitions that are gone are forgotten
+            with open(path, 'w') as f:
+                f.write("(define x 10)\n(define f (lambda n (+ n x)))\n")
+            self.assertEqual(loader.load(path, incremental=True), (0, 2))
+            self.assertRaises(KimiNameError, execute, "z", environment=environment)
+            # a syntax error anywhere in the file changes nothing
+            with open(path, 'w') as f:
+                f.write("(define x 1)\n(define f")
+            self.assertRaises(KimiSyntaxError, loader.load, path, True)
+            self.assertEqual(execute("(f 1)", environment=environment), 11)
+
+    def test_load_deep(self):
+        # forms nested far deeper than Python's recursion limit can be loaded and compared
+        deep = "(- " * 3000 + "1" + " 1)" * 3000
+        loader = Loader(standard_env())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'deep.kimi')
+            with open(path, 'w') as f:
+                f.write("(define a " + deep + ")\n(define b " + deep + ")\n")
+            self.assertEqual(run_command(":load " + path, loader, None), "Loaded " + path + ": 2 expressions evaluated.")
+            with open(path, 'w') as f:
+                f.write("(define a " + deep + ")\n(define b (+ 1 " + deep + "))\n")
+            self.assertEqual(run_command(":reload", loader, None), "Reloaded " + path + ": 1 expressions evaluated, 1 unchanged.")
+            self.assertEqual(execute("(list a b)", environment=loader.environment), make_list([-2999, -2998]))
+
+    def test_commands(self):
+        cache = ParseCache(size=10)
+        execute("(+ 1 2)", cache=cache)
+        loader = Loader(standard_env())
+        self.assertEqual(run_command(":cache", loader, cache), "Parse cache: 0 hits, 1 misses, 1 of 10 programs remembered.")
+        self.assertEqual(run_command(":cache", loader, None), "The parse cache is off.")
+        self.assertEqual(run_command(":reload", loader, cache), "No files have been loaded.")
+        self.assertTrue(run_command(":help", loader, cache).startswith("Commands:"))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'program.kimi')
+            with open(path, 'w') as f:
+                f.write("(define x 10) (define y 20)")
+            self.assertEqual(run_command(":load " + path, loader, cache), "Loaded " + path + ": 2 expressions evaluated.")
+            with open(path, 'w') as f:
+                f.write("(define x 10) (define y 30)")
+            self.assertEqual(run_command(":reload", loader, cache), "Reloaded " + path + ": 1 expressions evaluated, 1 unchanged.")
+        self.assertEqual(loader.environment.get('y'), 30)
+
+
+class TestStreaming(EngineTestCase):
+
+    PROGRAM = """(define x 10)
+(define times_x (lambda n (* n x)))
+"a (string) with\nnewlines"
+(times_x 4)
+  x (list 1 2)"""
+
+    def chunked(self, program, size):
+        return [program[i:i + size] for i in range(0, len(program), size)]
+
+    def test_forms(self):
+        for size in (1, 2, 3, 7, 1000):
+            results = list(evaluate_forms(self.chunked(self.PROGRAM, size), engine=self.engine))
+            self.assertEqual(results[2:], ["a (string) with\nnewlines", 40, 10, make_list([1, 2])])
+
+    def test_positions(self):
+        expected = [(t.line, t.column) for t in scan(self.PROGRAM)]
+        for size in (1, 2, 5, 1000):
+            self.assertEqual([(t.line, t.column) for t in scan_chunks(self.chunked(self.PROGRAM, size))], expected)
+        self.assertEqual(list(scan_chunks(self.chunked(self.PROGRAM, 3))), tokenize(self.PROGRAM))
+
+    def test_long_tokens(self):
+        # tokens much longer than a chunk, which the scanner waits for rather than scanning again for each chunk
+        text = "ab (c) " * 100000
+        program = '(list "' + text + '" ' + "x" * 100000 + ")"
+        tokens = list(scan_chunks(self.chunked(program, 16)))
+        self.assertEqual(tokens, [('opening', None), ('symbol', 'list'), ('literal', text), ('symbol', "x" * 100000), ('closing', None)])
+        self.assertEqual([(t.line, t.column) for t in tokens][-2:], [(1, len(text) + 10), (1, len(text) + 100010)])
+
+    def test_errors(self):
+        for size in (1, 4, 1000):
+            with self.assertRaises(KimiSyntaxError) as raised:
+                list(evaluate_forms(self.chunked("(+ 1 2)\n(+ 3 4))", size), engine=self.engine))
+            self.assertEqual(raised.exception.message, "Unexpected ')' at line 2, column 8.")
+            self.assertRaises(KimiSyntaxError, list, evaluate_forms(self.chunked('(+ 1 2) "abc', size), engine=self.engine))
+            self.assertRaises(KimiSyntaxError, list, evaluate_forms(self.chunked('(+ 1 2) (+ 1', size), engine=self.engine))
+            self.assertRaises(KimiSyntaxError, list, evaluate_forms(self.chunked('(((+ 1 2)))', size), engine=self.engine))
+        # each form is evaluated before the next one is read
+        results = evaluate_forms(["(+ 1 2) (", "undefined"], engine=self.engine)
+        self.assertEqual(next(results), 3)
+
+    def test_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'forms.kimi')
+            with open(path, 'w') as f:
+                f.write("(define square (lambda x (* x x)))\n" + "".join("(square {})\n".format(i) for i in range(100)))
+            results = list(execute_stream(path, engine=self.engine, chunk_size=16))
+        self.assertEqual(len(results), 101)
+        self.assertEqual(results[-1], 99 * 99)
+
+
+class TestAsync(EngineTestCase):
+
+    LOOP = "(do (define loop (lambda n (if (= n 0) {} (do (tick) (loop (- n 1)))))) (loop {}))"
+
+    def ticking_env(self, log, name):
+        environment = standard_env()
+        environment.set('tick', lambda: log.append(name))
+        return environment
+
+    def gather(self, *coroutines):
+        async def main():
+            return await asyncio.gather(*coroutines, return_exceptions=True)
+        return asyncio.run(main())
+
+    def test_evaluate(self):
+        self.assertEqual(asyncio.run(evaluate_async("(+ 1 2)", engine=self.engine)), 3)
+        self.assertEqual(asyncio.run(evaluate_async(self.LOOP.format(7, 5000).replace("(tick) ", ""),
+                                                    engine=self.engine, yield_every=1)), 7)
+        with self.assertRaises(KimiTypeError):
+            asyncio.run(evaluate_async("(+ 1 true)", engine=self.engine))
+
+    def test_fair_interleaving(self):
+        log = []
+        scripts = [evaluate_async(self.LOOP.format(i, 50 + 10 * i), self.ticking_env(log, i),
+                                  engine=self.engine, yield_every=5)
+                   for i in range(20)]
+        self.assertEqual(self.gather(*scripts), list(range(20)))
+        self.assertEqual(len(log), sum(50 + 10 * i for i in range(20)))
+        # every script starts before any of them finishes...
+        last_start = max(log.index(i) for i in range(20))
+        first_finish = min(len(log) - 1 - log[::-1].index(i) for i in range(20))
+        self.assertLess(last_start, first_finish)
+        # ...and, while they are all running, none of them runs for more than its turn before the others get theirs
+        run = 1
+        for (previous, name) in zip(log[:first_finish], log[1:first_finish]):
+            run = run + 1 if name == previous else 1
+            self.assertLessEqual(run, 5)
+
+    def test_runaway(self):
+        log = []
+        runaway = evaluate_async("(do (define f (lambda n (f n))) (f 1))", engine=self.engine, max_steps=20000)
+        others = [evaluate_async(self.LOOP.format(i, 100), self.ticking_env(log, i), engine=self.engine) for i in range(5)]
+        results = self.gather(runaway, *others)
+        self.assertIsInstance(results[0], KimiLimitError)
+        self.assertEqual(results[1:], list(range(5)))
+
+    def test_limits(self):
+        runaway = "(do (define f (lambda n (f n))) (f 1))"
+        with self.assertRaises(KimiLimitError) as raised:
+            asyncio.run(evaluate_async(runaway, engine=self.engine, max_steps=100))
+        self.assertEqual(raised.exception.message, "The program took more than 100 steps.")
+        with self.assertRaises(KimiLimitError):
+            asyncio.run(evaluate_async("(do (define f (lambda n (+ 1 (f n)))) (f 1))", engine=self.engine, max_depth=500))
+        with self.assertRaises(KimiLimitError):
+            asyncio.run(evaluate_async(runaway, engine=self.engine, timeout=0.05))
+        # steps taken inside builtins count too
+        with self.assertRaises(KimiLimitError):
+            asyncio.run(evaluate_async("(do (define f (lambda n (f n))) (map f (list 1 2)))", engine=self.engine, timeout=0.05))
+        # and so do the values builtins make, before they're made
+        for program in ("(range 0 1000000000)", "(vec-range 0 1000000000)", "(length (range 0 60000))"):
+            with self.assertRaises(KimiLimitError):
+                asyncio.run(evaluate_async(program, engine=self.engine, max_steps=50000))
+        self.assertEqual(asyncio.run(evaluate_async('(string->list "abc")', engine=self.engine, max_steps=3)), make_list(["a", "b", "c"]))
+        with self.assertRaises(KimiLimitError):
+            asyncio.run(evaluate_async('(string->list "abc")', engine=self.engine, max_steps=2))
+        # and the budget is gone once the evaluation is over
+        self.assertEqual(self.execute("(map (lambda x (* x x)) (range 0 200))"), make_list([x * x for x in range(200)]))
+
+    def test_cancel(self):
+        async def main():
+            task = asyncio.ensure_future(evaluate_async("(do (define f (lambda n (f n))) (f 1))", engine=self.engine))
+            await asyncio.sleep(0.01)
+            self.assertFalse(task.done())
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+        asyncio.run(main())
+
+    def test_engines(self):
+        self.assertRaises(ValueError, asyncio.run, evaluate_async("(+ 1 2)", engine='closure'))
+
+
+class TestTranspiler(unittest.TestCase):
+
+    # Programs whose results or errors depend on the details of Kimi's semantics
+    PROGRAMS = [
+        "(do (define x 1) (do (list x (define x 2) x)))",
+        "(do (define f (lambda (g 1))) (define g (lambda n (* n 10))) (f))",
+        "(do (define even (lambda n (if (= n 0) true (odd (- n 1))))) (define odd (lambda n (if (= n 0) false (even (- n 1))))) (even 10))",
+        "(do (define x 1) (define x 2))",
+        "((lambda x (define x 2)) 1)",
+        "(do (define f (lambda x y (+ x y))) (f 1))",
+        "(do (define x 5) (x 1))",
+        "(if 1 2 3)",
+        "(+ 1 true)",
+        "(if (< (vec 1 2) 3) 1 2)",
+        "(vec-sum (* (vec 1 2 3) 2))",
+        "(do (if false (define a 1) (define b 2)) a)",
+        "(do (if false (define a 1) (define a 2)) a)",
+        "(do (define f (lambda n (g n))) (f 1))",
+        "(do (define x (list (define x 1))) x)",
+        "(do)",
+        "(define 1 2)",
+        "(lambda 1 2)",
+        "(do (define sq (memo (lambda x (* x x)))) (list (sq 3) (sq 3) (memo-stats sq)))",
+        "(filter (lambda x (= (% x 2) 0)) (range 0 10))",
+        "(list (= 1 true) (= nil nil) (= (list 1 2) (list 1 2)) (& true (! false)))",
+        "(do (define compose (lambda f g (lambda x (f (g x))))) ((compose (lambda x (+ x 1)) (lambda x (* x 2))) 5))",
+        "((if true + -) 1 2)",
+        "(do (define env 3) (define run (lambda x (+ x env))) (run 1))",
+        "(define + 1)",
+        '(list (= (concat "ab" "c") "abc") (= "abc" (concat "a" "bc")) (length (concat "a" "bc")))',
+        '(join (split (concat "a,b" ",c") ",") "-")',
+        "(1 (do (define y undefined_name) y))",
+        '(list (= 3 nil) (= nil "a") (= nil nil) (= nil (list)))',
+    ]
+
+    def run_transpiled(self, program):
+        namespace = dict()
+        exec(compile(transpile(parse(tokenize(program))), "<transpiled>", "exec"), namespace)
+        return namespace['run']()
+
+    def outcome(self, run, program):
+        try:
+            return ("result", kimify(run(program)))
+        except KimiError as error:
+            return ("error", str(error))
+
+    def test_samples(self):
+        for filename in sorted(os.listdir('samples')):
+            if filename.endswith('.kimi'):
+                with open(os.path.join('samples', filename), 'r') as f:
+                    program = f.read()
+                self.assertEqual(self.run_transpiled(program), execute(program), filename)
+
+    def test_semantics(self):
+        for program in self.PROGRAMS:
+            self.assertEqual(self.outcome(self.run_transpiled, program), self.outcome(execute, program), program)
+
+    def test_no_warnings(self):
+        # the generated code compiles without any warnings (e.g. about "is" with a literal)
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            for program in self.PROGRAMS:
+                compile(transpile(parse(tokenize(program))), "<transpiled>", "exec")
+
+    def test_module(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rules.kimi')
+            with open(path, 'w') as f:
+                f.write("(do (define limit 10) (lambda x (if (> x limit) limit x)))")
+            module_path = transpile_file(path)
+            self.assertEqual(module_path, os.path.join(directory, 'rules.py'))
+            with open(module_path, 'r') as f:
+                source = f.read()
+        # the generated module is plain Python: the lambda is a def, and the comparison an operator
+        self.assertIn("def anonymous(*arguments):", source)
+        self.assertIn("(x > limit)", source)
+        namespace = dict()
+        exec(compile(source, module_path, "exec"), namespace)
+        clamp = namespace['run']()
+        self.assertEqual([clamp(5), clamp(50)], [5, 10])
+        self.assertEqual(kimify(clamp), "<anonymous function>")
+        self.assertRaises(KimiSyntaxError, clamp, 1, 2)
+        self.assertRaises(KimiTypeError, clamp, "a")
+        # the global environment can be given, e.g. with a prelude
+        prelude = standard_env()
+        execute("(define offset 100)", environment=prelude)
+        namespace = dict()
+        exec(transpile(parse(tokenize("(+ offset 1)"))), namespace)
+        self.assertEqual(namespace['run'](prelude.snapshot().restore()), 101)
+        self.assertRaises(KimiNameError, namespace['run'])
+
+
+class TestOptimizer(unittest.TestCase):
+
+    def optimize(self, program):
+        return optimize(parse(tokenize(program)))
+
+    def assertOptimizes(self, program, optimized):
+        self.assertEqual(self.optimize(program), parse(tokenize(optimized)))
+
+    def test_folding(self):
+        self.assertEqual(self.optimize("(+ 60 60)"), Literal(120))
+        self.assertEqual(self.optimize("(= (* 2 3) (- 10 4))"), Literal(True))
+        self.assertEqual(self.optimize("(! false)"), Literal(True))
+        self.assertOptimizes("(+ x (* 2 3))", "(+ x 6)")
+
+    def test_dead_branches(self):
+        self.assertOptimizes("(if true a b)", "a")
+        self.assertOptimizes("(if (< 2 1) a (if false b c))", "c")
+        self.assertOptimizes("(if x a b)", "(if x a b)")
+
+    def test_do(self):
+        self.assertOptimizes("(do x)", "x")
+        self.assertOptimizes("(do (do (+ 1 2)))", "3")
+        self.assertOptimizes("(do (define x 1))", "(do (define x 1))")
+
+    def test_inlining(self):
+        self.assertOptimizes("((lambda x (* x x)) 3)", "9")
+        self.assertOptimizes("((lambda x y (+ x y)) 1 z)", "((lambda x y (+ x y)) 1 z)")
+        self.assertOptimizes("((lambda x (lambda y (+ x y))) 2)", "(lambda y (+ 2 y))")
+        self.assertOptimizes("((lambda x (define y x)) 2)", "((lambda x (define y x)) 2)")
+        self.assertOptimizes("((lambda x (lambda x x)) 2)", "((lambda x (lambda x x)) 2)")
+
+    def test_shadowing(self):
+        self.assertOptimizes("(lambda + (+ 1 2))", "(lambda + (+ 1 2))")
+        self.assertOptimizes("(do (define + -) (+ 1 2))", "(do (define + -) (+ 1 2))")
+        self.assertOptimizes("(lambda true (if true a b))", "(lambda true (if true a b))")
+
+    def test_errors(self):
+        self.assertOptimizes("(+ 1 true)", "(+ 1 true)")
+        self.assertOptimizes("(/ 1 0)", "(/ 1 0)")
+        self.assertOptimizes("(if 1 a b)", "(if 1 a b)")
+        self.assertOptimizes("(if true (+ 1 2))", "(if true (+ 1 2))")
+        self.assertOptimizes("((lambda x x) 1 2)", "((lambda x x) 1 2)")
+
+    def test_deep_nesting(self):
+        program = "(+ 1 " * 5000 + "0" + ")" * 5000
+        self.assertEqual(self.optimize(program), Literal(5000))
+
+    def test_counts(self):
+        optimizer = Optimizer()
+        self.assertEqual(execute("(do (+ 60 60))", optimizer=optimizer), 120)
+        self.assertEqual((optimizer.nodes, optimizer.removed), (6, 5))
+        self.assertEqual(optimizer.report(), "Optimizer removed 5 of 6 nodes.")
+
+
+class TestBench(unittest.TestCase):
+
+    def test_run_benchmarks(self):
+        benchmarks = [b for b in kimi_bench.all_benchmarks(('tree',)) if not b.name.startswith('synthetic/big_source')]
+        results = kimi_bench.run_benchmarks(benchmarks, scale=0.01, repeat=1, min_time=0)
+        self.assertIn('samples/factorial/tree', results['results'])
+        self.assertIn('micro/tokenize', results['results'])
+        self.assertEqual(results['results']['synthetic/wide_do/tree']['group'], 'synthetic')
+        self.assertTrue(all(result['best'] > 0 for result in results['results'].values()))
+        json.dumps(results)
+
+    def test_compare(self):
+        baseline = {'results': {'fast': {'best': 1.0}, 'same': {'best': 1.0}, 'gone': {'best': 1.0}}}
+        current = {'results': {'fast': {'best': 1.5}, 'same': {'best': 1.05}, 'new': {'best': 1.0}}}
+        self.assertEqual(kimi_bench.compare(current, baseline, threshold=0.10), [('fast', 1.0, 1.5, 1.5)])
+        self.assertEqual(kimi_bench.compare(current, baseline, threshold=0.60), [])
+
+
+class TestTailCalls(EngineTestCase):
+
+    def test_tail_recursion(self):
+        self.assertEqual(self.execute("""(do
+            (define count (lambda n acc (if (= n 0) acc (do (define m (- n 1)) (count m (+ acc 1))))))
+            (count 20000 0))"""), 20000)
+
+    def test_deep_recursion(self):
+        self.assertEqual(self.execute("""(do
+            (define sum (lambda n (if (= n 0) 0 (+ n (sum (- n 1))))))
+            (sum 5000))"""), 12502500)
+
+    def test_long_lists(self):
+        self.assertEqual(self.execute("""(do
+            (define upto (lambda n acc (if (= n 0) acc (upto (- n 1) (prepend n acc)))))
+            (define map (lambda fn list (if (= list nil) nil (prepend (fn (first list)) (map fn (rest list))))))
+            (first (rest (map (lambda x (* x x)) (upto 5000 nil)))))"""), 4)
+
+
+class TestProfiler(EngineTestCase):
+
+    def profile(self, program):
+        profiler = Profiler()
+        result = execute(program, engine=self.engine, profiler=profiler)
+        return (result, profiler)
+
+    def test_functions(self):
+        (result, profiler) = self.profile("""(do
+            (define fact (lambda n (if (= n 0) 1 (* n (fact (- n 1))))))
+            (define make_adder (lambda x (lambda y (+ x y))))
+            (define add3 (make_adder 3))
+            (add3 (fact 5)))""")
+        self.assertEqual(result, 123)
+        self.assertEqual(sorted(profiler.functions), ['add3', 'fact', 'make_adder'])
+        fact = profiler.functions['fact']
+        self.assertEqual((fact.calls, fact.max_depth), (6, 6))
+        self.assertEqual(profiler.functions['add3'].calls, 1)
+        self.assertTrue(0 <= fact.exclusive <= fact.inclusive)
+        self.assertEqual(profiler.calls, [])
+
+    def test_stages(self):
+        (result, profiler) = self.profile("((lambda x x) 1)")
+        self.assertEqual(list(profiler.stages)[:2], ['tokenize', 'parse'])
+        self.assertEqual(list(profiler.stages)[-1], 'evaluate')
+        self.assertEqual(list(profiler.functions), ['anonymous'])
+
+    def test_collapsed_stacks(self):
+        (result, profiler) = self.profile("""(do
+            (define inner (lambda n (if (= n 0) 0 (+ 1 (inner (- n 1))))))
+            (define outer (lambda n (+ 1 (inner n))))
+            (outer 200))""")
+        stacks = dict(line.rsplit(" ", 1) for line in profiler.collapsed_stacks())
+        self.assertTrue(all(path.startswith("program;outer") for path in stacks))
+        self.assertTrue(all(int(microseconds) > 0 for microseconds in stacks.values()))
+        self.assertIn("program;outer;inner;inner", "\n".join(stacks))
+
+    def test_errors(self):
+        profiler = Profiler()
+        with self.assertRaises(KimiTypeError):
+            execute("(do (define f (lambda x (+ x true))) (f 1))", engine=self.engine, profiler=profiler)
+        self.assertEqual(profiler.functions['f'].calls, 1)
+        self.assertEqual(profiler.calls, [])
+
+    def test_off(self):
+        self.execute("(do (define f (lambda x x)) (f 1))")
+        self.assertIsNone(profiling.ACTIVE)
+
+    def test_tail_calls(self):
+        (result, profiler) = self.profile("""(do
+            (define count (lambda n (if (= n 0) 0 (count (- n 1)))))
+            (count 100))""")
+        self.assertEqual(profiler.functions['count'].calls, 101)
+        self.assertEqual(profiler.functions['count'].max_depth, 1)
+
+
+class TestExecuteClosure(TestExecute):
+    engine = 'closure'
+
+class TestBuiltinsClosure(TestBuiltins):
+    engine = 'closure'
+
+class TestSpecialFormsClosure(TestSpecialForms):
+    engine = 'closure'
+
+    def test_deep_memo(self):
+        # the closure engine recurses in Python, memoized or not
+        self.assertRaises(RecursionError, self.execute,
+            "(do (define count (memo (lambda n (if (= n 0) 0 (+ 1 (count (- n 1))))))) (count 5000))")
+
+class TestSamplesClosure(TestSamples):
+    engine = 'closure'
+
+class TestExecuteVM(TestExecute):
+    engine = 'vm'
+
+class TestBuiltinsVM(TestBuiltins):
+    engine = 'vm'
+
+class TestSpecialFormsVM(TestSpecialForms):
+    engine = 'vm'
+
+class TestVectorsVM(TestVectors):
+    engine = 'vm'
+
+class TestSamplesVM(TestSamples):
+    engine = 'vm'
+
+class TestTailCallsVM(TestTailCalls):
+    engine = 'vm'
+
+class TestProfilerClosure(TestProfiler):
+    engine = 'closure'
+
+    def test_tail_calls(self):
+        # the closure engine doesn't make proper tail calls
+        (result, profiler) = self.profile("""(do
+            (define count (lambda n (if (= n 0) 0 (count (- n 1)))))
+            (count 100))""")
+        self.assertEqual(profiler.functions['count'].max_depth, 101)
+
+class TestProfilerVM(TestProfiler):
+    engine = 'vm'
+
+class TestBuiltinsOptimized(TestBuiltins):
+    optimize = True
+
+class TestSpecialFormsOptimized(TestSpecialForms):
+    optimize = True
+
+class TestSamplesOptimized(TestSamples):
+    optimize = True
+
+class TestSamplesOptimizedVM(TestSamples):
+    engine = 'vm'
+    optimize = True
+
+class TestStreamingClosure(TestStreaming):
+    engine = 'closure'
+
+class TestStreamingVM(TestStreaming):
+    engine = 'vm'
+
+class TestAsyncVM(TestAsync):
+    engine = 'vm'
+
+class TestEnvironmentsClosure(TestEnvironments):
+    engine = 'closure'
+
+class TestEnvironmentsVM(TestEnvironments):
+    engine = 'vm'
+
+
+class TestBytecode(unittest.TestCase):
+
+    def test_dumps_loads(self):
+        code = bytecode.compile_source("(do (define f (lambda x (if (= x 0) (lambda) (f 0)))) (f 1))")
+        self.assertEqual(bytecode.disassemble(bytecode.loads(bytecode.dumps(code))), bytecode.disassemble(code))
+        self.assertRaises(KimiSyntaxError, vm.run, bytecode.loads(bytecode.dumps(code)), standard_env())
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'program.kimi')
+            with open(path, 'w') as f:
+                f.write("(do (define x 3) (* x x))")
+            self.assertEqual(vm.run(bytecode.load_program(path), standard_env()), 9)
+            compiled = bytecode.cache_path(path)
+            self.assertTrue(os.path.exists(compiled))
+            # the cached code is used as long as the source is unchanged (even if it was tampered with)...
+            with open(compiled, 'rb') as f:
+                cached = f.read()
+            with open(compiled, 'wb') as f:
+                f.write(cached.replace(b'*', b'+'))
+            self.assertEqual(vm.run(bytecode.load_program(path), standard_env()), 6)
+            self.assertEqual(vm.run(bytecode.load_program(path, use_cache=False), standard_env()), 9)
+            # ...but not once the source changes
+            with open(path, 'w') as f:
+                f.write("(do (define x 3) (- x 1))")
+            self.assertEqual(vm.run(bytecode.load_program(path), standard_env()), 2)
 
 
 if __name__ == '__main__':
@@ -2,10 +2,50 @@
 # Anjana Vakil
 # http://www.github.com/vakila/kimi
 
+import re
 from errors import *
 
+WHITESPACE = re.compile(r'[ \n\t]*')
+TOKEN = re.compile(r'(\()|(\))|"([^"]*)"|([^()" \n\t]+)')
+WHITESPACES = ' \n\t'
+# Where a token (other than a string) might end
+DELIMITER = re.compile(r'[()" \n\t]')
+
+class Token:
+    '''A single token, remembering where in the program it was found.
+    Tokens compare equal to (and unpack like) the plain (type, value) pairs
+    returned by earlier versions of the tokenizer, e.g. ('literal', 3).
+    '''
+    __slots__ = ('type', 'value', 'line', 'column')
+
+    def __init__(self, token_type, token_value, line=None, column=None):
+        self.type = token_type
+        self.value = token_value
+        self.line = line
+        self.column = column
+
+    def __iter__(self):
+        return iter((self.type, self.value))
+
+    def __getitem__(self, index):
+        return (self.type, self.value)[index]
+
+    def __len__(self):
+        return 2
+
+    def __eq__(self, other):
+        if isinstance(other, Token):
+            return self.type == other.type and self.value == other.value
+        return (self.type, self.value) == other
+
+    def __hash__(self):
+        return hash((self.type, self.value))
+
+    def __repr__(self):
+        return repr((self.type, self.value))
+
 def tokenize(string):
-    '''Take a program as a string, return the tokenized program as a list of strings.
+    '''Take a program as a string, return the tokenized program as a list of tokens.
 
     >>> tokenize("-1")
     [('literal', -1)]
@@ -13,56 +53,114 @@ def tokenize(string):
     >>> tokenize("(+ 1 2)")
     [('opening', None), ('symbol', '+'), ('literal', 1), ('literal', 2), ('closing', None)]
     '''
+    return list(scan(string))
+
+def scan(string):
+    '''Take a program as a string, and lazily yield its tokens one at a time.
+    Each token carries the line and column (both starting at 1) where it begins.
+    The input is consumed with a single moving index, so scanning is linear in the length of the program.
+
+    >>> [(t.line, t.column) for t in scan("(+ 1\\n  2)")]
+    [(1, 1), (1, 2), (1, 4), (2, 3), (2, 4)]
+    '''
     assert_or_throw(string.count('(') == string.count(')'), "syntax", "Mismatching parentheses!")
     assert_or_throw('(((' not in string, "syntax", 'Incorrect parenthesis use: "(((". Opening parenthesis must be immediately followed by a function.')
-    special = ['(',')','"']
-    whitespaces = [' ','\n','\t']
-    tokens = []
-    remaining = string
-    while remaining:
-        this_char = remaining[0]
-        if this_char in whitespaces:
-            remaining = remaining[1:]
-            continue
-        if this_char in ["(", ")"]:
-            # the token is this character
-            if this_char == "(":
-                token_type = 'opening'
-                try:
-                    next_char = remaining[1]
-                except IndexError:
-                    throw_error("syntax", 'Incorrect parenthesis use: "(" at end of program.')
-                else:
-                    if next_char in [")", '"'] or next_char in whitespaces :
-                        throw_error("syntax", "Incorrect parenthesis use: " + '"' + this_char + next_char + '". Opening parenthesis must be immediately followed by a function.')
-            if this_char == ")":
-                token_type = 'closing'
-            token_value = None
-            remaining = remaining[1:]
-        elif this_char == '"':
+    yield from scan_from(string)
+
+def scan_chunks(chunks):
+    '''Like scan, for a program that comes in chunks of text (e.g. read from a large file a piece at a time).
+    Tokens are yielded once they are complete, and only the text of the token being read is kept,
+    so memory doesn't grow with the length of the program. A token that goes on for many chunks
+    (like a long string) is only scanned again once a chunk might complete it.
+    Without the whole program to count them in, mismatching parentheses are left for the parser to find.
+
+    >>> list(scan_chunks(["(+ 1", "0 2)"]))
+    [('opening', None), ('symbol', '+'), ('literal', 10), ('literal', 2), ('closing', None)]
+    '''
+    # the text of the token that isn't complete yet (from the end of the last chunk scanned), in pieces,
+    # and whether it is a string with no closing quote so far
+    pending = []
+    open_string = False
+    # the end of the text read so far, to spot "(((" across chunks
+    tail = ''
+    (line, line_start) = (1, 0)
+    for chunk in chunks:
+        assert_or_throw('(((' not in tail + chunk, "syntax", 'Incorrect parenthesis use: "(((". Opening parenthesis must be immediately followed by a function.')
+        tail = (tail + chunk[-2:])[-2:]
+        if pending:
+            pending.append(chunk)
+            # only scan again once the token might be complete, so a long token isn't scanned over and over
+            if open_string and '"' not in chunk:
+                continue
+            if not open_string and DELIMITER.search(chunk) is None:
+                continue
+            buffer = ''.join(pending)
+        else:
+            buffer = chunk
+        (index, line, line_start) = yield from scan_from(buffer, 0, line, line_start, final=False)
+        rest = buffer[index:]
+        pending = [rest] if rest else []
+        open_string = rest.startswith('"') and rest.find('"', 1) == -1
+        line_start -= index
+    yield from scan_from(''.join(pending), 0, line, line_start)
+
+def scan_from(string, index=0, line=1, line_start=0, final=True):
+    '''Yield the tokens in string, from index on, where the line being scanned starts at line_start
+    (which is negative if the line started before the string did).
+    If the string isn't final (the program goes on after it), stop at a token that might not be complete yet,
+    and return (index, line, line_start) for scanning it again once there is more of the program.'''
+    skip_whitespace = WHITESPACE.match
+    match_token = TOKEN.match
+    length = len(string)
+    last = index
+    index = skip_whitespace(string, index).end()
+    while index < length:
+        # keep track of lines by counting the newlines passed since the previous token
+        newlines = string.count('\n', last, index)
+        if newlines:
+            line += newlines
+            line_start = string.rfind('\n', last, index) + 1
+        last = index
+        match = match_token(string, index)
+        if match is None:
+            # the only thing the token pattern can't match is a quote with no closing quote
+            if not final:
+                return (index, line, line_start)
+            throw_error("syntax", "Improper string syntax.")
+        if match.end() == length and not final:
+            # the rest of the token may be in the next chunk
+            return (index, line, line_start)
+        group = match.lastindex
+        if group == 1:
+            # an opening parenthesis must be immediately followed by a function
+            if index + 1 == length:
+                throw_error("syntax", 'Incorrect parenthesis use: "(" at end of program.')
+            next_char = string[index + 1]
+            if next_char in ')"' or next_char in WHITESPACES:
+                throw_error("syntax", "Incorrect parenthesis use: " + '"(' + next_char + '". Opening parenthesis must be immediately followed by a function.')
+            token = Token('opening', None, line, index - line_start + 1)
+        elif group == 2:
+            token = Token('closing', None, line, index - line_start + 1)
+        elif group == 3:
             # the token is everything until the next "
-            endquote_index = remaining[1:].find('"')
-            if endquote_index == -1:
-                throw_error("syntax", "Improper string syntax.")
-            endquote_index += 1
-            token_value = remaining[1:endquote_index]
-            token_type = 'literal'
-            remaining = remaining[endquote_index+1:]
+            token = Token('literal', match.group(3), line, index - line_start + 1)
         else:
             # the token is everything until the next whitespace or special character
-            token_value = ""
-            while this_char not in special and this_char not in whitespaces:
-                token_value += this_char
-                remaining = remaining[1:]
-                if not remaining:
-                    break
-                this_char = remaining[0]
-            try:
-                # anything that can be converted to int is a literal number
-                token_value = int(token_value)
-                token_type = "literal"
-            except ValueError:
-                # everything else is a symbol
-                token_type = "symbol"
-        tokens.append((token_type, token_value))
-    return tokens
+            token_value = match.group(4)
+            token_type = 'symbol'
+            # anything that can be converted to int is a literal number
+            # (only worth trying if it ends in a digit, as every valid int does)
+            if token_value[-1].isdigit():
+                try:
+                    token_value = int(token_value)
+                    token_type = 'literal'
+                except ValueError:
+                    pass
+            token = Token(token_type, token_value, line, index - line_start + 1)
+        yield token
+        index = skip_whitespace(string, match.end()).end()
+    newlines = string.count('\n', last, index)
+    if newlines:
+        line += newlines
+        line_start = string.rfind('\n', last, index) + 1
+    return (index, line, line_start)
@@ -0,0 +1,492 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+import os
+import keyword
+from collections import Counter
+from tokenizer import tokenize
+from parser import parse
+from nodes import Literal, Symbol, Apply
+from closures import UNSET, defined_names
+from environments import standard_env, builtin_env, already_exists
+from evaluator import evaluate, throw_call_error
+from special_forms import throw_test_error, throw_arity_error, make_memo, well_formed
+from printer import kimify
+from errors import *
+
+# Names the generated code uses for itself, which Kimi variables can't have
+RESERVED = {
+    'run', 'environment', 'env', 'arguments', 'BUILTINS', 'UNSET', 'kimify',
+    'standard_env', 'builtin_env', 'already_exists', 'throw_arity_error', 'make_memo',
+    'truth', 'function', 'fail', 'define_global',
+    'type', 'int', 'bool', 'str', 'len', 'print', 'callable',
+}
+
+# Python names for builtins whose Kimi names aren't identifiers
+BUILTIN_NAMES = {
+    '+': 'add', '-': 'sub', '*': 'mul', '/': 'div', '%': 'mod',
+    '&': 'and_', '|': 'or_', '!': 'not_', '=': 'equals',
+    '>': 'gt', '<': 'lt', '>=': 'ge', '<=': 'le',
+}
+
+# Builtins that become Python operators, when their arguments have the type they check for:
+# the operator, and the type of the arguments and the result
+OPERATORS = {
+    '+': ('+', int, int), '-': ('-', int, int), '*': ('*', int, int),
+    '/': ('//', int, int), '%': ('%', int, int),
+    '>': ('>', int, bool), '<': ('<', int, bool), '>=': ('>=', int, bool), '<=': ('<=', int, bool),
+    '&': ('&', bool, bool), '|': ('|', bool, bool),
+}
+
+CONSTANTS = {'true': 'True', 'false': 'False', 'nil': 'None'}
+
+SPECIAL_NAMES = {'do', 'lambda', 'define', 'if', 'memo'}
+
+# The types the transpiler can prove a value has (besides None, for not knowing)
+FUNCTION = 'function'
+
+# Helpers the generated code calls (it imports everything it needs from this module)
+
+def truth(test):
+    '''Check the test of an (if ...) whose type couldn't be proven to be a boolean.'''
+    if test is True or test is False:
+        return test
+    throw_test_error()
+
+def function(fn):
+    '''Check that an operator whose type couldn't be proven can be called.'''
+    if not callable(fn):
+        throw_call_error()
+    return fn
+
+def fail(kind, message):
+    '''Raise the error of a special form used incorrectly.'''
+    throw_error(kind, message)
+
+def define_global(env, name, value):
+    env.set(name, value)
+    return value
+
+class Frame:
+    '''Compile-time description of a frame created by a (do ...) block or a lambda call (like closures.Scope):
+    the Python variable each Kimi variable in it is kept in, and what is known about them so far.
+    The generated code reads a variable directly when it has certainly been defined by then, and
+    otherwise checks, and falls back to the frames further out, just like the interpreter looks variables up.'''
+    __slots__ = ('name', 'outer', 'params', 'defines', 'names', 'assigned', 'types', 'needs_init', 'snapshot', 'defining')
+
+    def __init__(self, name, outer, params=(), defines=()):
+        self.name = name
+        self.outer = outer
+        self.params = params
+        self.defines = Counter(defines)
+        # Python names of the variables
+        self.names = dict()
+        # the variables certainly defined at this point of the frame's code
+        self.assigned = set()
+        # the types of variables that are only defined once, with a value of a known type
+        self.types = dict()
+        # the variables that may be read before they are defined, so must start out UNSET
+        self.needs_init = set()
+        # for a lambda's frame: the variables certainly defined in each enclosing frame when the lambda was made,
+        # and the variable the lambda is being defined as, if any
+        self.snapshot = dict()
+        self.defining = None
+
+class Code:
+    '''Generated code for an expression: the statements to run first, then a Python expression for the value,
+    its type (if it could be proven), and whether it's stable: a constant, or a variable that won't change,
+    so it can be evaluated later, or more than once, with the same result.
+    For builtins called with arguments of unproven types, guarded is the check that lets
+    the fast Python operator be used, and the operator and builtin versions of the call.'''
+    __slots__ = ('lines', 'expr', 'type', 'stable', 'guarded')
+
+    def __init__(self, lines, expr, type=None, stable=False, guarded=None):
+        self.lines = lines
+        self.expr = expr
+        self.type = type
+        self.stable = stable
+        self.guarded = guarded
+
+def indent(lines):
+    return ["    " + line for line in lines]
+
+def literal_type(value):
+    return FUNCTION if callable(value) else type(value)
+
+def transpile(tree, source_name="program"):
+    '''Take an expression (a tree of nodes), and return the source of a Python module with a function
+    run(environment=None) that evaluates it in a global environment (by default, a new standard environment),
+    with the same results and errors as the interpreter:
+        - lambdas become nested defs, that check how many arguments they are called with
+        - (do ...) blocks become sequences of statements, and their variables Python variables
+        - (if ...) becomes a conditional expression (or statement)
+        - builtins are called directly, and arithmetic, logic and comparisons become Python operators,
+          guarded by type checks where the types of the arguments can't be proven
+    Kimi functions become Python functions, which can be called from Python like any other.
+    Calls in Kimi become calls in Python, so unlike the interpreter,
+    deep recursion (even in tail calls) is limited by Python's recursion limit.'''
+    return Transpiler().module(tree, source_name)
+
+def transpile_file(path, output=None):
+    '''Transpile the Kimi program in the file at path (see transpile) into a Python module,
+    written to output (by default, the same path with .py instead of .kimi). Return the module's path.'''
+    with open(path, 'r') as f:
+        program = f.read()
+    if output is None:
+        output = os.path.splitext(path)[0] + ".py"
+    source = transpile(parse(tokenize(program)), os.path.basename(path))
+    with open(output, 'w') as f:
+        f.write(source)
+    return output
+
+class Transpiler:
+
+    def __init__(self):
+        self.used = set(RESERVED) | set(keyword.kwlist)
+        self.builtins = dict()
+        self.temps = 0
+
+    def name(self, kimi_name):
+        '''Return a new Python identifier for a Kimi name.'''
+        base = "".join(c if c.isalnum() or c == '_' else '_' for c in kimi_name).lstrip('_') or 'v'
+        if base[0].isdigit():
+            base = 'v' + base
+        name = base
+        i = 2
+        while name in self.used:
+            name = base + "_" + str(i)
+            i += 1
+        self.used.add(name)
+        return name
+
+    def temp(self):
+        # Kimi names never become Python names that start with _
+        self.temps += 1
+        return "_t" + str(self.temps)
+
+    def builtin(self, kimi_name):
+        if kimi_name not in self.builtins:
+            self.builtins[kimi_name] = self.name(BUILTIN_NAMES.get(kimi_name, kimi_name))
+        return self.builtins[kimi_name]
+
+    def module(self, tree, source_name):
+        body = self.tail(tree, None)
+        lines = [
+            "# Kimi program " + source_name + ", transpiled to Python by kimi --compile-py.",
+            "# Edit the Kimi program and transpile it again, rather than editing this file.",
+            "",
+            "from transpiler import (standard_env, builtin_env, already_exists, throw_arity_error, make_memo,",
+            "                        UNSET, truth, function, fail, define_global, kimify)",
+            "",
+            "BUILTINS = builtin_env()",
+        ]
+        lines += [alias + " = BUILTINS[" + repr(name) + "]" for (name, alias) in self.builtins.items()]
+        lines += [
+            "",
+            "def run(environment=None):",
+            "    '''Evaluate the program in the global environment (by default, a new standard environment), and return the result.'''",
+            "    env = standard_env() if environment is None else environment",
+        ]
+        lines += indent(body)
+        lines += [
+            "",
+            'if __name__ == "__main__":',
+            "    print(kimify(run()))",
+            "",
+        ]
+        return "\n".join(lines)
+
+    # Expressions
+
+    def expression(self, node, frame, defining=None):
+        node_type = type(node)
+        if node_type is Literal:
+            return Code([], repr(node.value), literal_type(node.value), stable=True)
+        elif node_type is Symbol:
+            return self.reference(node.name, frame, None)
+        elif node_type is Apply:
+            operator = node.operator
+            if type(operator) is Symbol and operator.name in SPECIAL_NAMES:
+                if not well_formed(operator.name, node.arguments):
+                    return malformed(node)
+                if operator.name == 'lambda':
+                    return self.compile_lambda(node.arguments, frame, defining)
+                return getattr(self, 'compile_' + operator.name)(node.arguments, frame)
+            return self.call(operator, node.arguments, frame)
+        complain_and_die("PARSING ERROR! Unexpected expression type: " + str(node) + ".")
+
+    def reference(self, name, frame, boundary):
+        '''Find the frame a variable is in, like closures.Scope.resolve. boundary is the outermost
+        lambda between the frame the variable is used in and the frame it is found in, if any.'''
+        while frame is not None:
+            if name in frame.params or name in frame.defines:
+                return self.local(name, frame, boundary)
+            if frame.name == "anon_fn":
+                boundary = frame
+            frame = frame.outer
+        if name in CONSTANTS:
+            return Code([], CONSTANTS[name], literal_type(builtin_env()[name]), stable=True)
+        if name in builtin_env():
+            return Code([], self.builtin(name), FUNCTION, stable=True)
+        return Code([], "env.get(" + repr(name) + ")")
+
+    def local(self, name, frame, boundary):
+        python_name = frame.names[name]
+        if name in frame.params:
+            return Code([], python_name, stable=True)
+        if boundary is None:
+            assigned = name in frame.assigned
+        else:
+            # the lambda's body only runs once the lambda has been made
+            assigned = name in boundary.snapshot.get(id(frame), ()) or boundary.defining == (frame, name)
+        if assigned:
+            return Code([], python_name, frame.types.get(name), stable=True)
+        # the variable may not have been defined yet: look further out, like the interpreter
+        frame.needs_init.add(name)
+        fallback = self.reference(name, frame.outer, frame if frame.name == "anon_fn" else boundary)
+        return Code([], "(" + python_name + " if " + python_name + " is not UNSET else " + fallback.expr + ")")
+
+    def sequence(self, nodes, frame):
+        '''Generate code for expressions evaluated in order (nodes, or Code already generated): the statements,
+        and a Code for each of them, whose expressions can be evaluated after all of the statements.'''
+        lines = []
+        codes = []
+        for node in nodes:
+            code = node if type(node) is Code else self.expression(node, frame)
+            if code.lines:
+                # the values before this one have to be computed before its statements run
+                for (i, earlier) in enumerate(codes):
+                    if not earlier.stable:
+                        temp = self.temp()
+                        lines.append(temp + " = " + earlier.expr)
+                        codes[i] = Code([], temp, earlier.type, stable=True)
+                lines.extend(code.lines)
+            codes.append(code)
+        return (lines, codes)
+
+    def call(self, operator, arguments, frame):
+        if type(operator) is Symbol and is_builtin(operator.name, frame):
+            if operator.name in OPERATORS and len(arguments) == 2:
+                return self.operator(operator.name, arguments, frame)
+            elif operator.name == '!' and len(arguments) == 1:
+                return self.negation(arguments, frame)
+            elif operator.name == '=' and len(arguments) == 2:
+                return self.equality(arguments, frame)
+        # the operator is checked before any argument is evaluated, as the interpreters do
+        fn = self.expression(operator, frame)
+        if fn.type is not FUNCTION:
+            fn = Code(fn.lines, "function(" + fn.expr + ")", FUNCTION)
+        (lines, codes) = self.sequence((fn,) + tuple(arguments), frame)
+        return Code(lines, codes[0].expr + "(" + ", ".join(code.expr for code in codes[1:]) + ")")
+
+    def operator(self, name, arguments, frame):
+        (python_operator, arg_type, result_type) = OPERATORS[name]
+        (lines, (a, b)) = self.sequence(arguments, frame)
+        fast = "(" + a.expr + " " + python_operator + " " + b.expr + ")"
+        if a.type is arg_type and b.type is arg_type:
+            return Code(lines, fast, result_type)
+        slow = self.builtin(name) + "(" + a.expr + ", " + b.expr + ")"
+        if not (a.stable and b.stable):
+            return Code(lines, slow)
+        checks = " and ".join("type(" + code.expr + ") is " + arg_type.__name__ for code in (a, b) if code.type is not arg_type)
+        return Code(lines, "(" + fast + " if " + checks + " else " + slow + ")", guarded=(checks, fast, slow))
+
+    def negation(self, arguments, frame):
+        (lines, (a,)) = self.sequence(arguments, frame)
+        if a.type is bool:
+            return Code(lines, "(not " + a.expr + ")", bool)
+        return Code(lines, self.builtin('!') + "(" + a.expr + ")")
+
+    def equality(self, arguments, frame):
+        # (= a b) is never true for values of different types (e.g. 1 and true)
+        (lines, (a, b)) = self.sequence(arguments, frame)
+        if a.type is not None and a.type is b.type and a.type is not FUNCTION:
+            return Code(lines, "(" + a.expr + " == " + b.expr + ")", bool)
+        for (x, y, node) in ((a, b, arguments[0]), (b, a, arguments[1])):
+            if y.expr == "None" and type(node) is Literal:
+                # (Python warns about "is" with a literal)
+                return Code(lines, repr(node.value is None), bool, stable=True)
+            if y.expr == "None" and x.stable:
+                return Code(lines, "(" + x.expr + " is None)", bool)
+            if y.stable and y.type is str and x.stable:
+                # a string is only == to a string (a str, or a strings.Rope)
+                return Code(lines, "(" + x.expr + " == " + y.expr + ")", bool)
+            if y.stable and y.type in (int, bool) and x.stable:
+                return Code(lines, "(type(" + x.expr + ") is " + y.type.__name__ + " and " + x.expr + " == " + y.expr + ")", bool)
+        return Code(lines, self.builtin('=') + "(" + a.expr + ", " + b.expr + ")", bool)
+
+    def test(self, node, frame):
+        '''Generate code for the test of an (if ...), which has to be a boolean.'''
+        code = self.expression(node, frame)
+        if code.type is bool:
+            return code
+        if code.guarded is not None:
+            (checks, fast, slow) = code.guarded
+            return Code(code.lines, "(" + fast + " if " + checks + " else truth(" + slow + "))", bool)
+        return Code(code.lines, "truth(" + code.expr + ")", bool)
+
+    # Special forms
+
+    def compile_do(self, args, frame):
+        (do_frame, lines) = self.do_frame(args, frame)
+        last = None
+        for (i, arg) in enumerate(args):
+            code = self.expression(arg, do_frame)
+            lines.extend(code.lines)
+            if i < len(args) - 1:
+                if not code.stable:
+                    lines.append(code.expr)
+            else:
+                last = code
+        return Code(self.initialized(do_frame, lines), last.expr, last.type, last.stable)
+
+    def do_frame(self, args, frame):
+        do_frame = Frame("do", frame, defines=defined_names(args))
+        for variable in do_frame.defines:
+            do_frame.names[variable] = self.name(variable)
+        return (do_frame, [])
+
+    def initialized(self, frame, lines):
+        '''Start a frame's code by setting the variables that may be read before they're defined to UNSET.'''
+        return [frame.names[v] + " = UNSET" for v in sorted(frame.needs_init)] + lines
+
+    def compile_lambda(self, args, frame, defining=None):
+        variables = tuple(l.name for l in args[:-1])
+        lambda_frame = Frame("anon_fn", frame, params=variables, defines=defined_names(args[-1:]))
+        for variable in variables:
+            if variable not in lambda_frame.names:
+                lambda_frame.names[variable] = self.name(variable)
+        for variable in lambda_frame.defines:
+            if variable not in lambda_frame.names:
+                lambda_frame.names[variable] = self.name(variable)
+        outer = frame
+        while outer is not None:
+            lambda_frame.snapshot[id(outer)] = frozenset(outer.assigned)
+            outer = outer.outer
+        lambda_frame.defining = defining
+        # the def is named after the variable it's defined as, if any
+        if defining is not None and defining[0] is not None and plain_define(defining[0], defining[1]):
+            def_name = defining[0].names[defining[1]]
+        else:
+            def_name = self.name(defining[1] if defining is not None else "anonymous")
+        body = self.tail(args[-1], lambda_frame)
+        arity = str(len(variables))
+        lines = ["def " + def_name + "(*arguments):",
+                 "    if len(arguments) != " + arity + ":",
+                 "        throw_arity_error(" + arity + ", len(arguments))"]
+        if variables:
+            lines.append("    (" + ", ".join(lambda_frame.names[v] for v in variables) + ("," if len(variables) == 1 else "") + ") = arguments")
+        lines += indent(self.initialized(lambda_frame, body))
+        lines.append(def_name + ".__name__ = \"anonymous\"")
+        return Code(lines, def_name, FUNCTION, stable=True)
+
+    def compile_define(self, args, frame):
+        variable = args[0].name
+        value_node = args[1]
+        is_lambda = (type(value_node) is Apply and type(value_node.operator) is Symbol
+                     and value_node.operator.name == 'lambda')
+        if frame is None:
+            # defining in the global environment, which is shared with other programs
+            value = self.expression(value_node, frame, defining=(None, variable) if is_lambda else None)
+            return Code(value.lines, "define_global(env, " + repr(variable) + ", " + value.expr + ")", value.type)
+        if is_lambda and plain_define(frame, variable):
+            # so the lambda can call itself directly
+            frame.types[variable] = FUNCTION
+        value = self.expression(value_node, frame, defining=(frame, variable) if is_lambda else None)
+        lines = list(value.lines)
+        python_name = frame.names[variable]
+        if variable in frame.params or variable in frame.assigned:
+            # defining a variable again always fails, but only after evaluating the value
+            if not value.stable:
+                lines.append(value.expr)
+            lines.append("already_exists(" + repr(variable) + ", " + repr(frame.name) + ")")
+            return Code(lines, "None", stable=True)
+        if plain_define(frame, variable):
+            if value.expr != python_name:
+                lines.append(python_name + " = " + value.expr)
+            frame.types[variable] = value.type
+        else:
+            # the variable may already have been defined, by another (define ...) of it in the frame
+            frame.needs_init.add(variable)
+            temp = self.temp()
+            lines += [temp + " = " + value.expr,
+                      "if " + python_name + " is not UNSET:",
+                      "    already_exists(" + repr(variable) + ", " + repr(frame.name) + ")",
+                      python_name + " = " + temp]
+        frame.assigned.add(variable)
+        return Code(lines, python_name, frame.types.get(variable), stable=True)
+
+    def compile_if(self, args, frame):
+        test = self.test(args[0], frame)
+        before = set(frame.assigned) if frame is not None else None
+        branches = []
+        for branch in args[1:]:
+            if frame is not None:
+                frame.assigned = set(before)
+            branches.append((self.expression(branch, frame), frame.assigned if frame is not None else None))
+        ((passed, pass_assigned), (failed, fail_assigned)) = branches
+        if frame is not None:
+            frame.assigned = pass_assigned & fail_assigned
+        result_type = passed.type if passed.type is failed.type else None
+        if not passed.lines and not failed.lines:
+            return Code(test.lines, "(" + passed.expr + " if " + test.expr + " else " + failed.expr + ")", result_type)
+        temp = self.temp()
+        lines = test.lines + ["if " + test.expr + ":"]
+        lines += indent(passed.lines + [temp + " = " + passed.expr])
+        lines += ["else:"]
+        lines += indent(failed.lines + [temp + " = " + failed.expr])
+        return Code(lines, temp, result_type, stable=True)
+
+    def compile_memo(self, args, frame):
+        (lines, codes) = self.sequence(args, frame)
+        return Code(lines, "make_memo(" + ", ".join(code.expr for code in codes) + ")", FUNCTION)
+
+    # Tail positions
+
+    def tail(self, node, frame):
+        '''Generate the statements that evaluate an expression and return its value
+        (the body of a function), with (if ...) and (do ...) as statements rather than expressions.'''
+        if type(node) is Apply and type(node.operator) is Symbol and well_formed(node.operator.name, node.arguments):
+            name = node.operator.name
+            args = node.arguments
+            if name == 'if':
+                test = self.test(args[0], frame)
+                before = set(frame.assigned) if frame is not None else None
+                lines = test.lines + ["if " + test.expr + ":"] + indent(self.tail(args[1], frame))
+                if frame is not None:
+                    frame.assigned = before
+                return lines + ["else:"] + indent(self.tail(args[2], frame))
+            elif name == 'do':
+                (do_frame, lines) = self.do_frame(args, frame)
+                for arg in args[:-1]:
+                    code = self.expression(arg, do_frame)
+                    lines.extend(code.lines)
+                    if not code.stable:
+                        lines.append(code.expr)
+                lines += self.tail(args[-1], do_frame)
+                return self.initialized(do_frame, lines)
+        code = self.expression(node, frame)
+        return code.lines + ["return " + code.expr]
+
+def is_builtin(name, frame):
+    '''Whether a variable is a builtin (which programs can't redefine in the global environment),
+    rather than a variable of one of the frames.'''
+    while frame is not None:
+        if name in frame.params or name in frame.defines:
+            return False
+        frame = frame.outer
+    return name in builtin_env()
+
+def plain_define(frame, variable):
+    '''Whether a (define ...) of a variable in a frame is certainly the only one, so needs no check.'''
+    return variable not in frame.params and frame.defines[variable] == 1 and variable not in frame.assigned
+
+def malformed(node):
+    '''Generate code that raises the error the interpreter raises for a special form used incorrectly
+    (which it does before evaluating anything in it).'''
+    try:
+        evaluate(node, standard_env())
+    except KimiError as error:
+        return Code([], "fail(" + repr(error.kind) + ", " + repr(error.message) + ")")
+    complain_and_die("Expected " + str(node) + " to be used incorrectly.")
@@ -0,0 +1,137 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+import operator as op
+import budgets
+from array import array
+from errors import *
+
+# NumPy is optional: without it, vectors are plain arrays of 64-bit integers,
+# and their operations loop in Python
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class Vec:
+    '''A Kimi vector: a fixed-length sequence of integers, that arithmetic and comparison builtins
+    work on element by element. The values are a NumPy int64 array if NumPy is installed,
+    otherwise an array.array of 64-bit integers.'''
+    __slots__ = ('values',)
+
+    def __init__(self, values):
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        return (int(x) for x in self.values)
+
+    def __eq__(self, other):
+        if type(other) is not Vec:
+            return NotImplemented
+        return len(self) == len(other) and all(x == y for (x, y) in zip(self.values, other.values))
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return "Vec(" + repr(list(self)) + ")"
+
+# The range of the 64-bit integers vectors hold
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+# Results of NumPy arithmetic whose floating-point estimate is smaller than this can't have overflowed
+SAFE = 2.0 ** 62
+
+def throw_overflow_error():
+    throw_error("type", "Vector values must be 64-bit integers (from " + str(INT64_MIN) + " to " + str(INT64_MAX) + ").")
+
+def make_vec(values):
+    '''Return a Vec of the integers in a Python iterable (which must all fit in 64 bits).'''
+    values = list(values)
+    if values and (min(values) < INT64_MIN or max(values) > INT64_MAX):
+        throw_overflow_error()
+    if numpy is not None:
+        return Vec(numpy.array(values, dtype=numpy.int64))
+    return Vec(array('q', values))
+
+def vec_range(start, end):
+    if start < end and (start < INT64_MIN or end - 1 > INT64_MAX):
+        throw_overflow_error()
+    budgets.charge(end - start)
+    if numpy is not None:
+        return Vec(numpy.arange(start, max(start, end), dtype=numpy.int64))
+    return Vec(array('q', range(start, end)))
+
+def throw_vec_error(value):
+    throw_error("type", "Invalid argument type: " + str(value) + " is type " + type(value).__name__ + ", expected type vec.")
+
+def verify_vec(value):
+    if type(value) is not Vec:
+        throw_vec_error(value)
+
+def operands(a, b):
+    '''Check the arguments of an elementwise operation: vectors of the same length, or a vector and an int.'''
+    for x in (a, b):
+        if type(x) is not Vec and type(x) is not int:
+            throw_error("type", "Invalid argument type: " + str(x) + " is type " + type(x).__name__ + ", expected type int or vec.")
+        if type(x) is int and not INT64_MIN <= x <= INT64_MAX:
+            throw_overflow_error()
+    if type(a) is Vec and type(b) is Vec and len(a) != len(b):
+        throw_error("type", "Vectors of different lengths: " + str(len(a)) + " and " + str(len(b)) + ".")
+    return (a.values if type(a) is Vec else a, b.values if type(b) is Vec else b)
+
+def exactly(fn, x, y):
+    '''Apply fn elementwise to the values of vectors (or ints), with Python's unbounded ints.'''
+    if type(x) is int:
+        return [int(fn(x, int(j))) for j in y]
+    elif type(y) is int:
+        return [int(fn(int(i), y)) for i in x]
+    return [int(fn(int(i), int(j))) for (i, j) in zip(x, y)]
+
+def elementwise(fn, numpy_name, divides=False, overflows=False):
+    '''Return the function a builtin calls when it is given a vector (and ints or other vectors of the same length).
+    Comparisons give a vector of 1s (true) and 0s (false).
+    Results that don't fit in 64 bits are errors with both backends (NumPy would wrap them around).'''
+    def vector_fn(a, b):
+        (x, y) = operands(a, b)
+        if divides and (y == 0 if type(y) is int else 0 in y):
+            # like dividing ints (NumPy would give 0 instead)
+            raise ZeroDivisionError("integer division or modulo by zero")
+        if numpy is None:
+            return make_vec(exactly(fn, x, y))
+        if overflows:
+            estimate = getattr(numpy, numpy_name)(numpy.asarray(x, dtype=numpy.float64), numpy.asarray(y, dtype=numpy.float64))
+            if estimate.size and numpy.abs(estimate).max() >= SAFE:
+                # some results might not fit: work them out exactly
+                return make_vec(exactly(fn, x, y))
+        return Vec(numpy.asarray(getattr(numpy, numpy_name)(x, y), dtype=numpy.int64))
+    return vector_fn
+
+# What the arithmetic and comparison builtins do with vectors
+ELEMENTWISE = {
+    '+': elementwise(op.add, 'add', overflows=True),
+    '-': elementwise(op.sub, 'subtract', overflows=True),
+    '*': elementwise(op.mul, 'multiply', overflows=True),
+    '/': elementwise(op.floordiv, 'floor_divide', divides=True, overflows=True),
+    '%': elementwise(op.mod, 'mod', divides=True),
+    '>': elementwise(op.gt, 'greater'),
+    '<': elementwise(op.lt, 'less'),
+    '>=': elementwise(op.ge, 'greater_equal'),
+    '<=': elementwise(op.le, 'less_equal'),
+}
+
+def vec_sum(v):
+    # the sum is a Kimi int, so it isn't limited to 64 bits (with either backend)
+    verify_vec(v)
+    return sum(v.values.tolist())
+
+def vec_max(v):
+    verify_vec(v)
+    if len(v) == 0:
+        return None
+    return int(v.values.max()) if numpy is not None else max(v.values)
@@ -0,0 +1,249 @@
+# Kimi language interpreter in Python 3
+# Anjana Vakil
+# http://www.github.com/vakila/kimi
+
+import evaluator as ev
+import profiling
+import budgets
+from bytecode import *
+from closures import UNSET
+from special_forms import throw_arity_error, throw_test_error, make_memo, Memo, Remember, MISSING
+from environments import already_exists
+from errors import *
+
+class Function:
+    '''A function created by a lambda expression in compiled code: the Code for its body,
+    and the frame it was created in.
+    The VM calls functions itself, so it can make proper tail calls;
+    they can also be called like any other Python function (e.g. by builtins).'''
+    __slots__ = ('code', 'environment', 'name')
+    __name__ = "anonymous"
+
+    def __init__(self, code, environment):
+        self.code = code
+        self.environment = environment
+        self.name = None
+
+    def bind(self, arguments):
+        '''Return the frame to run the body in, with the arguments in the first slots.'''
+        code = self.code
+        if len(arguments) != code.params:
+            throw_arity_error(code.params, len(arguments))
+        return [self.environment, *arguments] + [UNSET] * code.size
+
+    def __call__(self, *arguments):
+        frame = self.bind(arguments)
+        profiler = profiling.ACTIVE
+        if profiler is None:
+            return run(self.code, frame)
+        profiler.enter(self.name)
+        try:
+            return run(self.code, frame)
+        finally:
+            profiler.exit()
+
+def evaluate(expression, environment):
+    '''Take an expression (a tree of nodes) and an environment.
+    Compile the expression to bytecode, then run it in the environment and return the result.
+
+    >>> evaluate(parse(tokenize("(+ 1 2)")), standard_env())
+    3
+    '''
+    return run(compile_program(expression), environment)
+
+def lookup(env, entry):
+    '''Find a variable the slow way: in the first frame that has a value for it, or else the global environment.'''
+    (name, candidates, global_depth) = entry
+    for (depth, slot) in candidates:
+        frame = env
+        for _ in range(depth):
+            frame = frame[0]
+        value = frame[slot]
+        if value is not UNSET:
+            return value
+    for _ in range(global_depth):
+        env = env[0]
+    return env.get(name)
+
+def run(code, env):
+    '''Run Code in a frame (or the global environment, for a whole program), and return its value.
+
+    Values are kept on one stack, and the callers of the function currently running on another,
+    so neither deep recursion nor long tail-recursive loops grow Python's stack.
+    '''
+    return budgets.finish(steps(code, env, budgets.ACTIVE))
+
+def steps(code, env, budget=None):
+    '''Run Code like run, as a generator that can be paused (see evaluator.steps):
+    every call to a Function counts against the budget, at the depth of its callers.'''
+    values = []
+    callers = []
+    instructions = code.instructions
+    constants = code.constants
+    symbols = code.symbols
+    sites = code.sites
+    pc = 0
+    profiler = profiling.ACTIVE
+    # while profiling, the number of function calls in progress that were started by this run
+    entered = 0
+    while True:
+        op = instructions[pc]
+        arg = instructions[pc + 1]
+        pc += 2
+        if op == LOAD_LOCAL:
+            entry = symbols[arg]
+            value = env[entry[1][0][1]]
+            if value is UNSET:
+                value = lookup(env, entry)
+            values.append(value)
+        elif op == CONST:
+            values.append(constants[arg])
+        elif op == LOAD_GLOBAL:
+            (name, candidates, global_depth) = symbols[arg]
+            frame = env
+            for _ in range(global_depth):
+                frame = frame[0]
+            values.append(frame.get(name))
+        elif op == LOAD_OUTER:
+            entry = symbols[arg]
+            (depth, slot) = entry[1][0]
+            frame = env
+            for _ in range(depth):
+                frame = frame[0]
+            value = frame[slot]
+            if value is UNSET:
+                value = lookup(env, entry)
+            values.append(value)
+        elif op == FUNCTION:
+            if not callable(values[-1]):
+                ev.throw_call_error()
+        elif op == CALL or op == TAIL_CALL:
+            # Each call site has an inline cache of the last type-checked builtin it called:
+            # (builtin, unchecked, arg_type). If the site calls the same builtin again, and the arguments
+            # have the right type, the builtin's function is called directly, skipping its type checks.
+            fn = values[-arg - 1]
+            site = sites[pc >> 1]
+            if site is not None and fn is site[0] and arg == 2 and type(values[-1]) is site[2] and type(values[-2]) is site[2]:
+                value = site[1](values[-2], values[-1])
+                del values[-3:]
+            elif site is not None and fn is site[0] and arg == 1 and type(values[-1]) is site[2]:
+                value = site[1](values[-1])
+                del values[-2:]
+            else:
+                if arg:
+                    arguments = values[-arg:]
+                    del values[-arg:]
+                else:
+                    arguments = ()
+                values.pop()
+                memo = None
+                if type(fn) is Memo:
+                    (key, value) = fn.lookup(tuple(arguments))
+                    if value is MISSING:
+                        if type(fn.function) is Function:
+                            # run the call here, remembering its result when it returns
+                            (memo, fn) = (fn, fn.function)
+                        else:
+                            value = fn.remember(key, fn.function(*arguments))
+                if type(fn) is Function:
+                    if op == CALL:
+                        callers.append((code, pc, env))
+                    if memo is not None:
+                        callers.append(Remember(memo, key))
+                    env = fn.bind(arguments)
+                    if profiler is not None:
+                        if op == CALL or not entered:
+                            entered += 1
+                        else:
+                            # a tail call: the caller is done
+                            profiler.exit()
+                        profiler.enter(fn.name)
+                    if budget is not None and budget.step(len(callers)):
+                        yield
+                    code = fn.code
+                    instructions = code.instructions
+                    constants = code.constants
+                    symbols = code.symbols
+                    sites = code.sites
+                    pc = 0
+                    continue
+                if type(fn) is not Memo:
+                    unchecked = getattr(fn, 'unchecked', None)
+                    if unchecked is not None:
+                        sites[pc >> 1] = (fn, unchecked, fn.arg_type)
+                    value = fn(*arguments)
+            if op == CALL:
+                values.append(value)
+                continue
+            if entered:
+                profiler.exit()
+                entered -= 1
+            while callers and type(callers[-1]) is Remember:
+                remembering = callers.pop()
+                remembering.memo.remember(remembering.key, value)
+            if not callers:
+                return value
+            else:
+                values.append(value)
+                (code, pc, env) = callers.pop()
+                instructions = code.instructions
+                constants = code.constants
+                symbols = code.symbols
+                sites = code.sites
+        elif op == RETURN:
+            if entered:
+                profiler.exit()
+                entered -= 1
+            while callers and type(callers[-1]) is Remember:
+                remembering = callers.pop()
+                remembering.memo.remember(remembering.key, values[-1])
+            if not callers:
+                return values.pop()
+            (code, pc, env) = callers.pop()
+            instructions = code.instructions
+            constants = code.constants
+            symbols = code.symbols
+            sites = code.sites
+        elif op == JUMP_IF_FALSE:
+            test = values.pop()
+            if test is False:
+                pc = arg
+            elif test is not True:
+                throw_test_error()
+        elif op == POP:
+            values.pop()
+        elif op == JUMP:
+            pc = arg
+        elif op == DEFINE:
+            (name, slot, env_name) = code.definitions[arg]
+            env[slot] = values[-1]
+            if profiler is not None:
+                profiling.name_function(values[-1], name)
+        elif op == ENTER:
+            env = [env] + [UNSET] * arg
+        elif op == LEAVE:
+            env = env[0]
+        elif op == MAKE_LAMBDA:
+            values.append(Function(constants[arg], env))
+        elif op == DEFINE_CHECKED:
+            (name, slot, env_name) = code.definitions[arg]
+            if env[slot] is not UNSET:
+                already_exists(name, env_name)
+            env[slot] = values[-1]
+            if profiler is not None:
+                profiling.name_function(values[-1], name)
+        elif op == DEFINE_GLOBAL:
+            name = code.definitions[arg][0]
+            env.set(name, values[-1])
+            profiling.name_function(values[-1], name)
+        elif op == REDEFINE:
+            (name, slot, env_name) = code.definitions[arg]
+            already_exists(name, env_name)
+        elif op == MALFORMED:
+            values.append(ev.evaluate(thaw(constants[arg]), env))
+        elif op == MEMO:
+            arguments = values[-arg:]
+            del values[-arg:]
+            values.append(make_memo(*arguments))
+        else:
+            complain_and_die("BYTECODE ERROR! Unexpected opcode: " + str(op) + ".")